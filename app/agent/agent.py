@@ -4,46 +4,39 @@
 @Time    : 2025/11/18 00:08
 @Desc    : LangGraph图配置模块
 """
-import logging
-
 from langchain_core.runnables import RunnableConfig
-from langfuse import get_client
-from langfuse.langchain import CallbackHandler
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.constants import START, END
 from langgraph.graph.state import CompiledStateGraph, StateGraph
 
 from app.agent.edge import should_continue
-from app.agent.node import llm_node, tool_node
-from app.common.constants import LLM_NODE, TOOL_NODE
-from app.config import create_postgres_pool_from_config
+from app.agent.instrumentation import instrument_node
+from app.agent.node import context_node, llm_node, tool_node
+from app.common.constants import CONTEXT_NODE, LLM_NODE, TOOL_NODE
 from app.model.state import MyState
 
-langfuse = get_client()
-
-langfuse_handler = CallbackHandler()
-
 
-async def my_agent() -> CompiledStateGraph:
+def build_graph(checkpointer: BaseCheckpointSaver) -> CompiledStateGraph:
     """
-    获取单例的LangGraph图实例
-    """
-    config = RunnableConfig(recursion_limit=25, callbacks=[langfuse_handler])
-    # 使用 AsyncPostgresSaver
-    checkpointer = AsyncPostgresSaver(create_postgres_pool_from_config())
-    # 初始化检查点保存器（这会创建必要的表结构）
-    await checkpointer.setup()
+    使用给定的检查点保存器构建并编译LangGraph图
 
-    # 构建图
+    只应在应用启动时调用一次，请求处理阶段统一复用 AgentRuntime 持有的共享实例
+    :param checkpointer: 检查点保存器
+    :type checkpointer: BaseCheckpointSaver
+    :return: 编译后的图
+    :rtype: CompiledStateGraph
+    """
+    config = RunnableConfig(recursion_limit=25)
     graph = (
         StateGraph(MyState)
-        .add_node(LLM_NODE, llm_node)
-        .add_node(TOOL_NODE, tool_node)
-        .add_edge(START, LLM_NODE)
+        .add_node(CONTEXT_NODE, instrument_node(CONTEXT_NODE, context_node))
+        .add_node(LLM_NODE, instrument_node(LLM_NODE, llm_node))
+        .add_node(TOOL_NODE, instrument_node(TOOL_NODE, tool_node))
+        .add_edge(START, CONTEXT_NODE)
+        .add_edge(CONTEXT_NODE, LLM_NODE)
         .add_conditional_edges(LLM_NODE, should_continue, [TOOL_NODE, END])
         .add_edge(TOOL_NODE, LLM_NODE)
         .compile(checkpointer=checkpointer)
         .with_config(config=config)
     )
-    logging.info(f"graph 图实例:{graph.get_graph(xray=True).draw_mermaid()}")
     return graph
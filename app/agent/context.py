@@ -0,0 +1,187 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:13
+@Desc    : context.py 对话上下文窗口管理：按token预算保留最近的轮次，更早的轮次增量合并进滚动摘要
+"""
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+from langchain_core.messages import (
+    BaseMessage, HumanMessage, SystemMessage, RemoveMessage, AIMessage, ToolMessage
+)
+from langchain_core.messages.utils import count_tokens_approximately
+
+from app.common.constants import (
+    CONTEXT_ENABLED, CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_TURNS, CONTEXT_SUMMARY_THRESHOLD
+)
+from app.config import create_model_from_config
+
+# 摘要生成函数：(已有摘要, 新折叠的消息) -> 新摘要
+Summarizer = Callable[[Optional[str], list[BaseMessage]], Awaitable[str]]
+
+SUMMARY_PROMPT = (
+    "你负责维护一段对话的滚动摘要。请在已有摘要的基础上，合并下面新增的对话内容，"
+    "保留用户的关键信息、偏好、已确认的结论和工具调用结果，输出更新后的完整摘要，不要添加无关内容。"
+)
+
+# 单条消息写入摘要输入时的最大字符数，避免超长的工具输出撑爆摘要请求
+_MAX_MESSAGE_CHARS = 2000
+
+
+def _render_message(message: BaseMessage) -> str:
+    if isinstance(message, HumanMessage):
+        role = "用户"
+    elif isinstance(message, ToolMessage):
+        role = f"工具({message.name})"
+    elif isinstance(message, AIMessage):
+        role = "助手"
+        if message.tool_calls:
+            calls = ", ".join(f"{call['name']}({call['args']})" for call in message.tool_calls)
+            return f"{role}: 调用工具 {calls} {message.text}".rstrip()
+    else:
+        role = message.type
+    return f"{role}: {message.text[:_MAX_MESSAGE_CHARS]}"
+
+
+async def summarize_with_llm(summary: Optional[str], messages: list[BaseMessage]) -> str:
+    """
+    使用配置的模型增量更新摘要，只传入已有摘要和新折叠的消息
+    :param summary: 已有摘要
+    :param messages: 新折叠的消息
+    :return: 更新后的摘要
+    """
+    conversation = "\n".join(_render_message(message) for message in messages)
+    prompt = f"已有摘要:\n{summary or '无'}\n\n新增对话:\n{conversation}"
+    response = await create_model_from_config().ainvoke([SystemMessage(content=SUMMARY_PROMPT),
+                                                         HumanMessage(content=prompt)])
+    return response.text
+
+
+def split_turns(messages: list[BaseMessage]) -> tuple[list[BaseMessage], list[list[BaseMessage]]]:
+    """
+    按用户消息切分对话轮次
+
+    每一轮从一条用户消息（及紧邻其前的系统消息）开始，包含其后的助手消息、工具调用及工具结果，
+    因此按轮次裁剪不会拆散工具调用与工具结果
+    :param messages: 消息列表
+    :return: (第一条用户消息之前的前缀消息, 轮次列表)
+    """
+    prefix: list[BaseMessage] = []
+    turns: list[list[BaseMessage]] = []
+    pending: list[BaseMessage] = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            turns.append([*pending, message])
+            pending = []
+        elif not turns:
+            prefix.append(message)
+        elif isinstance(message, SystemMessage):
+            pending.append(message)
+        else:
+            turns[-1].extend(pending)
+            turns[-1].append(message)
+            pending = []
+    if pending:
+        turns[-1].extend(pending)
+    return prefix, turns
+
+
+class ContextWindowManager:
+    """
+    上下文窗口管理器
+
+    历史消息的token数超过摘要阈值或轮次超过 max_turns 时，从最新一轮开始向前保留不超过 max_turns // 2 轮、
+    且总量不超过 token_budget 的消息（最新一轮始终保留），其余轮次交给摘要函数合并进滚动摘要，
+    并从状态中删除，从而同时限制提示词长度和检查点大小。
+
+    触发线（summary_threshold、max_turns）高于折叠后的低水位（token_budget、max_turns // 2），
+    一次折叠后要再积累若干轮才会再次触发，避免稳定状态下每轮都多一次同步的摘要模型调用。
+    """
+
+    def __init__(self,
+                 token_budget: int = 4000,
+                 max_turns: int = 10,
+                 summary_threshold: int = 6000,
+                 enabled: bool = True,
+                 summarizer: Summarizer = summarize_with_llm):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        # 折叠后保留的轮数（低水位）
+        self.keep_turns = max(max_turns // 2, 1)
+        self.summary_threshold = summary_threshold
+        self.enabled = enabled
+        self._summarizer = summarizer
+
+    @classmethod
+    def from_config(cls) -> "ContextWindowManager":
+        """
+        从.env文件创建上下文窗口管理器
+        """
+        return cls(
+            token_budget=int(os.getenv(CONTEXT_TOKEN_BUDGET, "4000")),
+            max_turns=int(os.getenv(CONTEXT_MAX_TURNS, "10")),
+            summary_threshold=int(os.getenv(CONTEXT_SUMMARY_THRESHOLD, "6000")),
+            enabled=os.getenv(CONTEXT_ENABLED, "true").lower() == "true",
+        )
+
+    @staticmethod
+    def count_tokens(messages: list[BaseMessage]) -> int:
+        return count_tokens_approximately(messages)
+
+    def select_folded_turns(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """
+        计算需要折叠进摘要的消息
+        :param messages: 当前全部历史消息
+        :return: 需要折叠的消息，不需要折叠时返回空列表
+        """
+        prefix, turns = split_turns(messages)
+        turn_tokens = [self.count_tokens(turn) for turn in turns]
+        total = self.count_tokens(prefix) + sum(turn_tokens)
+        if total <= self.summary_threshold and len(turns) <= self.max_turns:
+            return []
+
+        used = self.count_tokens(prefix)
+        kept = 0
+        for tokens in reversed(turn_tokens):
+            if kept and (kept >= self.keep_turns or used + tokens > self.token_budget):
+                break
+            used += tokens
+            kept += 1
+        return [message for turn in turns[:len(turns) - kept] for message in turn]
+
+    async def compact(self, messages: list[BaseMessage], summary: Optional[str]) -> Optional[dict]:
+        """
+        按预算压缩历史消息
+        :param messages: 当前全部历史消息
+        :param summary: 已有摘要
+        :return: 状态更新（新摘要和删除指令），无需压缩时返回None
+        """
+        if not self.enabled:
+            return None
+        folded = self.select_folded_turns(messages)
+        if not folded:
+            return None
+        new_summary = await self._summarizer(summary, [m for m in folded if not isinstance(m, SystemMessage)])
+        logging.info("上下文压缩：折叠 %d 条消息进摘要", len(folded))
+        return {
+            "summary": new_summary,
+            "messages": [RemoveMessage(id=message.id) for message in folded],
+        }
+
+
+def with_summary(messages: list[BaseMessage], summary: Optional[str]) -> list[BaseMessage]:
+    """
+    将滚动摘要作为系统消息插入到前缀系统消息之后，用于构造发送给模型的消息列表
+    :param messages: 历史消息
+    :param summary: 滚动摘要
+    :return: 发送给模型的消息列表
+    """
+    if not summary:
+        return messages
+    prefix_length = 0
+    while prefix_length < len(messages) and isinstance(messages[prefix_length], SystemMessage):
+        prefix_length += 1
+    summary_message = SystemMessage(content=f"以下是此前对话的摘要：\n{summary}")
+    return [*messages[:prefix_length], summary_message, *messages[prefix_length:]]
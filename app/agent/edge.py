@@ -9,6 +9,7 @@ import logging
 from langgraph.constants import END
 
 from app.common.constants import TOOL_NODE
+from app.common.log import summarize
 from app.model import MyState
 
 
@@ -26,7 +27,7 @@ def should_continue(state: MyState) -> str:
     last_message = messages[-1]
 
     if last_message.tool_calls:
-        logging.info(f"检测到工具调用: {last_message.tool_calls}")
+        logging.info("检测到工具调用: %s", summarize(last_message.tool_calls))
         return TOOL_NODE
     logging.info("LLM没有工具调用，回复用户")
     return END
@@ -0,0 +1,83 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:08
+@Desc    : instrumentation.py 图节点耗时与单次运行步数统计
+"""
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterator, Optional
+
+from app.common.metrics import Histogram
+
+NODE_DURATION = Histogram(
+    "graph_node_duration_seconds",
+    "Latency of a single graph node execution",
+    ("node", "status"),
+)
+GRAPH_STEPS = Histogram(
+    "graph_steps_per_run",
+    "Number of node executions in one graph run",
+    ("entrypoint",),
+    buckets=(1, 2, 3, 4, 5, 7, 10, 15, 20, 25),
+)
+
+
+class _RunSteps:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+# 当前图运行的节点执行计数，节点在图创建的子任务中执行，会继承该上下文变量
+_current_run: ContextVar[Optional[_RunSteps]] = ContextVar("graph_run_steps", default=None)
+
+
+def instrument_node(name: str, func: Callable[..., Awaitable[dict]]) -> Callable[..., Awaitable[dict]]:
+    """
+    包装异步节点函数，记录节点耗时并累计当前运行的步数
+
+    保留原函数签名，LangGraph 仍会按签名注入 config 等参数
+    :param name: 节点名称
+    :param func: 节点函数
+    :return: 包装后的节点函数
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        run = _current_run.get()
+        if run is not None:
+            run.count += 1
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = await func(*args, **kwargs)
+            status = "success"
+            return result
+        finally:
+            NODE_DURATION.observe(time.perf_counter() - start, node=name, status=status)
+
+    return wrapper
+
+
+@contextmanager
+def track_graph_run(entrypoint: str) -> Iterator[_RunSteps]:
+    """
+    统计代码块内一次图运行执行的节点数
+    :param entrypoint: 运行入口，例如 chat、chat_stream
+    """
+    run = _RunSteps()
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        try:
+            _current_run.reset(token)
+        except ValueError:
+            # 异步生成器在其他上下文中被关闭时无法还原，计数对象随运行结束被丢弃即可
+            pass
+        if run.count:
+            GRAPH_STEPS.observe(run.count, entrypoint=entrypoint)
@@ -7,12 +7,40 @@
 import logging
 
 from langchain_core.runnables import RunnableConfig
-from langgraph.prebuilt import ToolNode
 
+from app.agent.context import ContextWindowManager, with_summary
+from app.cache.tool_cache import ToolResultCache
+from app.common.log import PAYLOAD, summarize
 from app.config import create_model_from_config
 from app.model.state import MyState
 from app.tools import user_tools
 from app.tools.mcp_client import my_mcp_client
+from app.tools.tool_executor import ToolExecutor
+from app.tools.tool_registry import ToolBindingRegistry
+
+# 确定性工具的结果缓存，作为ToolNode的工具调用拦截器
+tool_result_cache = ToolResultCache.from_config()
+
+# 工具调用的并发上限、超时与故障隔离，位于结果缓存内层，缓存命中不占用并发名额
+tool_executor = ToolExecutor.from_config()
+
+# 按工具集指纹缓存绑定工具后的模型与ToolNode，工具集不变时不再重复转换工具结构
+tool_binding_registry = ToolBindingRegistry(create_model_from_config,
+                                            tool_call_wrappers=(tool_result_cache.awrap, tool_executor.awrap))
+
+context_window_manager = ContextWindowManager.from_config()
+
+
+async def context_node(state: MyState) -> dict:
+    """
+    上下文管理节点，历史超出预算时把较早的轮次合并进滚动摘要
+    :param state: 状态
+    :type state: MyState
+    :return: 更新状态
+    :rtype: dict
+    """
+    update = await context_window_manager.compact(state.messages, state.summary)
+    return update or {}
 
 
 async def llm_node(state: MyState) -> dict:
@@ -23,26 +51,28 @@ async def llm_node(state: MyState) -> dict:
     :return: 更新状态
     :rtype: dict
     """
-    logging.info(f"llm_node节点 state: {state}")
+    logging.info("llm_node节点 state: %s", summarize(state), extra=PAYLOAD)
     mcp_tools = await my_mcp_client.get_mcp_tools()
-    llm = create_model_from_config().bind_tools(user_tools + mcp_tools)
+    llm = tool_binding_registry.get_bound_model(user_tools + mcp_tools)
     config = RunnableConfig(configurable={"thread_id": state.thread_id})
-    messages = state.messages
+    messages = with_summary(state.messages, state.summary)
     response = await llm.ainvoke(messages, config)
-    logging.info(f"llm_node节点 response: {response}")
+    logging.info("llm_node节点 response: %s", summarize(response), extra=PAYLOAD)
     return {"messages": response, "thread_id": state.thread_id}
 
 
-async def tool_node(state: MyState) -> ToolNode:
+async def tool_node(state: MyState, config: RunnableConfig) -> dict:
     """
     tool节点
     :param state: 状态
     :type state: MyState
-    :return: 状态
+    :param config: 运行配置
+    :type config: RunnableConfig
+    :return: 更新状态
     :rtype: dict
     """
-    logging.info(f"tool_node节点，state：{state}")
+    logging.info("tool_node节点，state：%s", summarize(state), extra=PAYLOAD)
     mcp_tools = await my_mcp_client.get_mcp_tools()
-    # 创建工具节点
-    tool_node_instance = ToolNode(user_tools + mcp_tools)
-    return tool_node_instance
+    # 复用与当前工具集对应的工具节点并执行工具调用
+    tool_node_instance = tool_binding_registry.get_tool_node(user_tools + mcp_tools)
+    return await tool_node_instance.ainvoke(state, config)
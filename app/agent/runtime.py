@@ -0,0 +1,323 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:08
+@Desc    : runtime.py Agent运行时，负责在应用生命周期内管理图实例、连接池和检查点保存器
+"""
+import logging
+import time
+from dataclasses import asdict
+from enum import Enum
+from typing import Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.graph.state import CompiledStateGraph
+from psycopg_pool import AsyncConnectionPool
+
+from app.agent.agent import build_graph
+from app.agent.node import tool_result_cache, tool_executor, tool_binding_registry
+from app.cache.semantic_cache import SemanticCache
+from app.cache.stream_runs import StreamRunStore
+from app.checkpoint.backends import (
+    CheckpointBackendConfig, SnapshotMemorySaver, WriteBehindSaver, checkpointer_stats, close_checkpointer,
+    create_memory_saver, open_sqlite_saver
+)
+from app.checkpoint.serde import create_checkpoint_serde_from_config
+from app.checkpoint.pool import PostgresPoolConfig, PoolMonitor, open_pool, close_pool
+from app.checkpoint.retention import CheckpointRetention
+from app.common.admission import admission_controller
+from app.common.log import logging_stats
+from app.common.metrics import CallbackMetric, Sample
+from app.common.model_router import active_router_stats, set_active_router
+from app.common.tracing import tracing
+from app.config import (
+    create_model_from_config, create_embeddings_from_config, create_postgres_pool_from_config,
+    create_llm_http_client_from_config, create_router_http_client_from_config
+)
+from app.service.impl import OpenAiChatServiceImpl
+from app.tools.mcp_client.my_mcp_client import mcp_tool_registry
+
+
+class RuntimeStatus(str, Enum):
+    """运行时状态"""
+    STARTING = "starting"
+    READY = "ready"
+    FAILED = "failed"
+    STOPPED = "stopped"
+
+
+class AgentRuntime:
+    """
+    Agent运行时
+
+    在应用启动时打开Postgres连接池、执行一次检查点表结构初始化、建立MCP长连接并加载工具、
+    编译并预热图，请求处理阶段只读取共享的图实例。
+    """
+    _status: RuntimeStatus
+    _graph: Optional[CompiledStateGraph]
+    _chat_service: Optional[OpenAiChatServiceImpl]
+    _pool: Optional[AsyncConnectionPool]
+    _pool_config: Optional[PostgresPoolConfig]
+    _pool_monitor: Optional[PoolMonitor]
+    _checkpoint_config: Optional[CheckpointBackendConfig]
+    _checkpointer: Optional[BaseCheckpointSaver]
+    _retention: Optional[CheckpointRetention]
+    _semantic_cache: Optional[SemanticCache]
+    _stream_runs: Optional[StreamRunStore]
+    _error: Optional[str]
+    _started_at: Optional[float]
+
+    def __init__(self):
+        self._status = RuntimeStatus.STOPPED
+        self._graph = None
+        self._chat_service = None
+        self._pool = None
+        self._pool_config = None
+        self._pool_monitor = None
+        self._checkpoint_config = None
+        self._checkpointer = None
+        self._retention = None
+        self._semantic_cache = None
+        self._stream_runs = None
+        self._error = None
+        self._started_at = None
+
+    @property
+    def status(self) -> RuntimeStatus:
+        return self._status
+
+    @property
+    def ready(self) -> bool:
+        return self._status == RuntimeStatus.READY
+
+    @property
+    def graph(self) -> CompiledStateGraph:
+        """
+        获取共享的图实例
+        :raises RuntimeError: 运行时尚未就绪
+        """
+        if self._graph is None or not self.ready:
+            raise RuntimeError(f"Agent运行时未就绪，当前状态: {self._status.value}")
+        return self._graph
+
+    @property
+    def chat_service(self) -> OpenAiChatServiceImpl:
+        """
+        获取共享的聊天服务实例，每次 start() 随图实例一起重新构建
+        :raises RuntimeError: 运行时尚未就绪
+        """
+        if self._chat_service is None or not self.ready:
+            raise RuntimeError(f"Agent运行时未就绪，当前状态: {self._status.value}")
+        return self._chat_service
+
+    @property
+    def semantic_cache(self) -> Optional[SemanticCache]:
+        """
+        语义缓存，未启用时为None
+        """
+        return self._semantic_cache
+
+    @property
+    def stream_runs(self) -> Optional[StreamRunStore]:
+        """
+        可续传的流式运行，未启用时为None
+        """
+        return self._stream_runs
+
+    async def start(self) -> None:
+        """
+        启动运行时：打开连接池、初始化检查点表结构、编译并预热图
+        """
+        self._status = RuntimeStatus.STARTING
+        start = time.perf_counter()
+        # 上一次 stop() 的 drain() 会拒绝新的执行，重新启动时恢复准入
+        admission_controller.resume()
+        try:
+            self._checkpoint_config = CheckpointBackendConfig.from_config()
+            self._checkpointer = await self._create_checkpointer(self._checkpoint_config)
+            if self._pool is not None and CheckpointRetention.enabled_in_config():
+                self._retention = CheckpointRetention.from_config(self._pool)
+                self._retention.start()
+            if SemanticCache.enabled_in_config():
+                self._semantic_cache = SemanticCache.from_config(create_embeddings_from_config(), self._pool)
+                await self._semantic_cache.start()
+            if StreamRunStore.enabled_in_config():
+                self._stream_runs = StreamRunStore.from_config(self._pool)
+                await self._stream_runs.start()
+            await mcp_tool_registry.start()
+            tracing.start()
+            self._graph = build_graph(self._checkpointer)
+            self._chat_service = OpenAiChatServiceImpl(graph=self._graph, semantic_cache=self._semantic_cache,
+                                                       stream_runs=self._stream_runs)
+            self._warm_up()
+        except Exception as e:
+            self._status = RuntimeStatus.FAILED
+            self._error = str(e)
+            logging.exception("Agent运行时启动失败")
+            raise
+        self._status = RuntimeStatus.READY
+        self._error = None
+        self._started_at = time.time()
+        logging.info("Agent运行时已就绪，耗时 %.1fms", (time.perf_counter() - start) * 1000)
+
+    async def _create_checkpointer(self, config: CheckpointBackendConfig) -> BaseCheckpointSaver:
+        """
+        按 CHECKPOINT_BACKEND 创建检查点保存器：postgres（默认）、sqlite 或 memory，
+        启用 CHECKPOINT_WRITE_BEHIND 时再包装为异步写回
+
+        sqlite 和 memory 不打开连接池，只适合单机单进程部署
+        """
+        config.validate()
+        checkpointer = await self._create_backend_checkpointer(config)
+        if config.write_behind:
+            logging.warning("检查点异步写回已启用，进程崩溃时可能丢失最近的超步")
+            checkpointer = WriteBehindSaver(checkpointer, max_pending=config.write_behind_max_pending)
+        return checkpointer
+
+    async def _create_backend_checkpointer(self, config: CheckpointBackendConfig) -> BaseCheckpointSaver:
+        if config.backend == "memory":
+            checkpointer = create_memory_saver(config, serde=create_checkpoint_serde_from_config())
+            if isinstance(checkpointer, SnapshotMemorySaver):
+                await checkpointer.start()
+            else:
+                logging.warning("使用内存检查点保存器，会话状态不会持久化")
+            return checkpointer
+        if config.backend == "sqlite":
+            return await open_sqlite_saver(config, serde=create_checkpoint_serde_from_config())
+        self._pool_config = PostgresPoolConfig.from_config()
+        self._pool = create_postgres_pool_from_config()
+        await open_pool(self._pool, self._pool_config)
+        self._pool_monitor = PoolMonitor(self._pool, warn_threshold=self._pool_config.waiting_warn_threshold,
+                                         interval=self._pool_config.monitor_interval)
+        self._pool_monitor.start()
+        checkpointer = AsyncPostgresSaver(self._pool, serde=create_checkpoint_serde_from_config())
+        # 初始化检查点保存器（这会创建必要的表结构），整个进程只执行一次
+        await checkpointer.setup()
+        return checkpointer
+
+    def _warm_up(self) -> None:
+        """
+        预热：提前构建模型客户端并渲染一次图结构，避免首个请求承担初始化开销
+        """
+        create_model_from_config()
+        drawable_graph = self._graph.get_graph(xray=True)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("graph 图实例:%s", drawable_graph.draw_mermaid())
+
+    async def stop(self) -> None:
+        """
+        停止运行时并关闭连接池
+
+        先等待已准入的图执行结束，避免在执行途中关闭MCP会话和连接池
+        """
+        await admission_controller.drain()
+        # 丢弃持有旧图实例、检查点保存器和缓存的聊天服务，重新启动后不会再被请求使用
+        self._chat_service = None
+        self._graph = None
+        # drain() 超时后仍在执行的分离运行，在关闭检查点保存器、MCP会话和连接池之前取消
+        if self._stream_runs is not None:
+            await self._stream_runs.stop()
+            self._stream_runs = None
+        # 在关闭连接池之前写完积压的检查点
+        if self._checkpointer is not None:
+            await close_checkpointer(self._checkpointer)
+            self._checkpointer = None
+        await mcp_tool_registry.stop()
+        tool_executor.shutdown()
+        tracing.stop()
+        if self._retention is not None:
+            await self._retention.stop()
+            self._retention = None
+        if self._semantic_cache is not None:
+            await self._semantic_cache.stop()
+            self._semantic_cache = None
+        if self._pool_monitor is not None:
+            await self._pool_monitor.stop()
+            self._pool_monitor = None
+        if self._pool is not None:
+            await close_pool(self._pool, self._pool_config)
+            self._pool = None
+            create_postgres_pool_from_config.cache_clear()
+        await self._close_llm_http_client()
+        self._status = RuntimeStatus.STOPPED
+        logging.info("Agent运行时已停止")
+
+    @staticmethod
+    async def _close_llm_http_client() -> None:
+        """
+        关闭模型服务共享的HTTP客户端，并丢弃持有该客户端的模型实例
+        """
+        for create_client in (create_llm_http_client_from_config, create_router_http_client_from_config):
+            if create_client.cache_info().currsize:
+                await create_client().aclose()
+            create_client.cache_clear()
+        create_model_from_config.cache_clear()
+        set_active_router(None)
+        create_embeddings_from_config.cache_clear()
+        tool_binding_registry.clear()
+
+    def pool_stats(self) -> dict[str, int]:
+        """
+        Postgres连接池的统计信息，连接池未打开时为空
+        """
+        return self._pool.get_stats() if self._pool is not None else {}
+
+    def health(self) -> dict:
+        """
+        运行时健康状态
+        """
+        health = {"status": self._status.value, "ready": self.ready}
+        if self._started_at is not None:
+            health["started_at"] = self._started_at
+        if self._error is not None:
+            health["error"] = self._error
+        health["mcp"] = mcp_tool_registry.stats()
+        health["tool_cache"] = tool_result_cache.stats()
+        health["tools"] = tool_executor.stats()
+        health["tracing"] = tracing.stats()
+        health["admission"] = admission_controller.stats()
+        health["logging"] = logging_stats()
+        model_backends = active_router_stats()
+        if model_backends is not None:
+            health["model_backends"] = model_backends
+        if self._checkpoint_config is not None:
+            health["checkpointer"] = checkpointer_stats(self._checkpointer, self._checkpoint_config.backend)
+        if self._pool is not None:
+            health["postgres_pool"] = {**self.pool_stats(), **self._pool_monitor.stats(),
+                                       "config": asdict(self._pool_config)}
+        if self._semantic_cache is not None:
+            health["semantic_cache"] = self._semantic_cache.stats()
+        if self._stream_runs is not None:
+            health["stream_runs"] = self._stream_runs.stats()
+        return health
+
+
+# 进程级单例，由 main.py 中的 lifespan 负责启动与停止
+agent_runtime = AgentRuntime()
+
+
+def _pool_stat(key: str, scale: float = 1.0):
+    def collect() -> list[Sample]:
+        stats = agent_runtime.pool_stats()
+        return [({}, stats.get(key, 0) * scale)] if stats else []
+
+    return collect
+
+
+# 连接池指标在导出时读取 get_stats()，不在获取连接的路径上增加开销
+for _name, _key, _type, _scale, _doc in (
+        ("postgres_pool_size", "pool_size", "gauge", 1.0, "Connections currently managed by the pool"),
+        ("postgres_pool_min_size", "pool_min", "gauge", 1.0, "Connections kept open by the pool"),
+        ("postgres_pool_max_size", "pool_max", "gauge", 1.0, "Maximum pool size"),
+        ("postgres_pool_idle", "pool_available", "gauge", 1.0, "Idle connections available in the pool"),
+        ("postgres_pool_requests_waiting", "requests_waiting", "gauge", 1.0, "Clients waiting for a connection"),
+        ("postgres_pool_requests_total", "requests_num", "counter", 1.0, "Connection requests served by the pool"),
+        ("postgres_pool_requests_queued_total", "requests_queued", "counter", 1.0,
+         "Connection requests that had to wait because no connection was idle"),
+        ("postgres_pool_wait_seconds_total", "requests_wait_ms", "counter", 0.001,
+         "Total time clients spent waiting for a connection"),
+        ("postgres_pool_request_errors_total", "requests_errors", "counter", 1.0,
+         "Connection requests that failed (timeout or pool closed)"),
+):
+    CallbackMetric(_name, _doc, _pool_stat(_key, _scale), metric_type=_type)
@@ -0,0 +1,241 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:15
+@Desc    : semantic_cache.py 基于向量相似度的首轮问答语义缓存
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from psycopg_pool import AsyncConnectionPool
+
+from app.common.constants import (
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_PERSIST
+)
+from app.common.metrics import Counter
+
+SEMANTIC_CACHE_REQUESTS = Counter(
+    "semantic_cache_requests_total",
+    "Semantic cache lookups by result (hit, miss, bypass)",
+    ("result",),
+)
+SEMANTIC_CACHE_SAVED_SECONDS = Counter(
+    "semantic_cache_saved_seconds_total",
+    "Estimated model latency saved by semantic cache hits",
+)
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id BIGSERIAL PRIMARY KEY,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    embedding BYTEA NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+CREATE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS semantic_cache_created_at_idx ON semantic_cache (created_at)"
+INSERT_SQL = "INSERT INTO semantic_cache (question, answer, embedding) VALUES (%s, %s, %s)"
+SELECT_RECENT_SQL = """
+SELECT question, answer, embedding, extract(epoch FROM created_at) FROM semantic_cache
+WHERE created_at > now() - make_interval(secs => %s)
+ORDER BY created_at DESC
+LIMIT %s
+"""
+DELETE_EXPIRED_SQL = "DELETE FROM semantic_cache WHERE created_at <= now() - make_interval(secs => %s)"
+
+
+@dataclass
+class CacheHit:
+    """缓存命中结果"""
+    question: str
+    answer: str
+    score: float
+
+
+class SemanticCache:
+    """
+    语义缓存
+
+    问题向量归一化后存放在一个预分配的NumPy矩阵中，查询时一次矩阵乘法得到全部余弦相似度，
+    最高分不低于阈值即命中。条目按TTL过期，容量满时淘汰最久未访问的条目。
+    可选把条目写入Postgres，启动时加载未过期的条目，多个进程之间共享缓存内容。
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 threshold: float = 0.92,
+                 max_entries: int = 1000,
+                 ttl: float = 3600.0,
+                 pool: Optional[AsyncConnectionPool] = None):
+        self._embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._pool = pool
+        self._matrix: Optional[np.ndarray] = None
+        self._questions: list[Optional[str]] = [None] * max_entries
+        self._answers: list[Optional[str]] = [None] * max_entries
+        self._created_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_access = np.zeros(max_entries, dtype=np.float64)
+        self._valid = np.zeros(max_entries, dtype=bool)
+        # 未命中请求的模型耗时的指数移动平均，用于估算命中节省的时间
+        self._miss_latency: Optional[float] = None
+        self._background_tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_config(cls, embeddings: Embeddings, pool: Optional[AsyncConnectionPool] = None) -> "SemanticCache":
+        """
+        从.env文件创建语义缓存
+        """
+        persist = os.getenv(SEMANTIC_CACHE_PERSIST, "false").lower() == "true"
+        return cls(
+            embeddings=embeddings,
+            threshold=float(os.getenv(SEMANTIC_CACHE_THRESHOLD, "0.92")),
+            max_entries=int(os.getenv(SEMANTIC_CACHE_MAX_ENTRIES, "1000")),
+            ttl=float(os.getenv(SEMANTIC_CACHE_TTL, "3600")),
+            pool=pool if persist else None,
+        )
+
+    @staticmethod
+    def enabled_in_config() -> bool:
+        return os.getenv(SEMANTIC_CACHE_ENABLED, "false").lower() == "true"
+
+    @property
+    def size(self) -> int:
+        return int(self._valid.sum())
+
+    async def start(self) -> None:
+        """
+        启用持久化时建表并加载未过期的条目
+        """
+        if self._pool is None:
+            return
+        async with self._pool.connection() as conn:
+            await conn.execute(CREATE_TABLE_SQL)
+            await conn.execute(CREATE_INDEX_SQL)
+            await conn.execute(DELETE_EXPIRED_SQL, (self.ttl,))
+            cursor = await conn.execute(SELECT_RECENT_SQL, (self.ttl, self.max_entries))
+            rows = await cursor.fetchall()
+        # 按时间从旧到新插入，使最新的条目拥有最新的访问时间
+        for question, answer, embedding, created_at in reversed(rows):
+            self._insert(question, answer, np.frombuffer(embedding, dtype=np.float32), float(created_at))
+        logging.info("语义缓存已从Postgres加载 %d 个条目", len(rows))
+
+    async def stop(self) -> None:
+        """
+        等待尚未完成的持久化写入
+        """
+        if self._background_tasks:
+            await asyncio.wait(set(self._background_tasks))
+
+    async def embed(self, question: str) -> np.ndarray:
+        """
+        计算问题的归一化向量
+        """
+        vector = np.asarray(await self._embeddings.aembed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def search(self, vector: np.ndarray) -> Optional[CacheHit]:
+        """
+        在内存索引中查找最相似且未过期的条目
+        """
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            return None
+        now = time.time()
+        live = self._valid & (self._created_at > now - self.ttl)
+        if not live.any():
+            return None
+        scores = self._matrix @ vector
+        scores[~live] = -1.0
+        index = int(np.argmax(scores))
+        score = float(scores[index])
+        if score < self.threshold:
+            return None
+        self._last_access[index] = now
+        return CacheHit(question=self._questions[index], answer=self._answers[index], score=score)
+
+    async def lookup(self, question: str) -> tuple[Optional[CacheHit], np.ndarray]:
+        """
+        查询缓存
+        :param question: 用户问题
+        :return: (命中结果, 问题向量)，未命中时命中结果为None，问题向量可直接用于写入
+        """
+        vector = await self.embed(question)
+        hit = self.search(vector)
+        SEMANTIC_CACHE_REQUESTS.inc(result="hit" if hit else "miss")
+        if hit is not None and self._miss_latency is not None:
+            SEMANTIC_CACHE_SAVED_SECONDS.inc(self._miss_latency)
+        return hit, vector
+
+    @staticmethod
+    def record_bypass() -> None:
+        SEMANTIC_CACHE_REQUESTS.inc(result="bypass")
+
+    def record_miss_latency(self, seconds: float) -> None:
+        """
+        记录一次未命中请求的完整处理耗时
+        """
+        self._miss_latency = seconds if self._miss_latency is None else 0.9 * self._miss_latency + 0.1 * seconds
+
+    def _free_slot(self, now: float) -> int:
+        expired = self._valid & (self._created_at <= now - self.ttl)
+        self._valid[expired] = False
+        free = np.flatnonzero(~self._valid)
+        if free.size:
+            return int(free[0])
+        # 容量已满，淘汰最久未访问的条目
+        return int(np.argmin(self._last_access))
+
+    def _insert(self, question: str, answer: str, vector: np.ndarray, created_at: float) -> None:
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            # 首次写入或向量维度变化（更换了向量模型）时重建索引
+            self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self._valid[:] = False
+        slot = self._free_slot(time.time())
+        self._matrix[slot] = vector
+        self._questions[slot] = question
+        self._answers[slot] = answer
+        self._created_at[slot] = created_at
+        self._last_access[slot] = created_at
+        self._valid[slot] = True
+
+    def store(self, question: str, answer: str, vector: np.ndarray) -> None:
+        """
+        写入缓存，启用持久化时在后台写入Postgres
+        """
+        if not answer:
+            return
+        self._insert(question, answer, vector, time.time())
+        if self._pool is not None:
+            task = asyncio.create_task(self._persist(question, answer, vector))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _persist(self, question: str, answer: str, vector: np.ndarray) -> None:
+        try:
+            async with self._pool.connection() as conn:
+                await conn.execute(INSERT_SQL, (question, answer, vector.astype(np.float32).tobytes()))
+        except Exception:
+            logging.exception("语义缓存写入Postgres失败")
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        """
+        return {
+            "size": self.size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": SEMANTIC_CACHE_REQUESTS.value(result="hit"),
+            "misses": SEMANTIC_CACHE_REQUESTS.value(result="miss"),
+            "bypassed": SEMANTIC_CACHE_REQUESTS.value(result="bypass"),
+            "saved_seconds": SEMANTIC_CACHE_SAVED_SECONDS.value(),
+        }
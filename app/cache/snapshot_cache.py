@@ -0,0 +1,110 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:29
+@Desc    : snapshot_cache.py 按会话和检查点ID缓存序列化后的状态快照
+"""
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from langgraph.types import StateSnapshot
+
+from app.common.constants import SNAPSHOT_CACHE_MAX_ENTRIES
+from app.common.metrics import Counter
+from app.model.snapshot import SnapshotProjection, checkpoint_id_of, snapshot_to_json
+
+SNAPSHOT_CACHE_REQUESTS = Counter(
+    "snapshot_cache_requests_total",
+    "Current-state requests by result (hit, miss, not_modified)",
+    ("result",),
+)
+
+
+@dataclass(frozen=True)
+class SnapshotEntry:
+    """一个检查点序列化后的状态"""
+    checkpoint_id: Optional[str]
+    # 完整状态的JSON
+    body: bytes
+    # 检查点元数据和除消息以外的状态值，增量响应复用
+    header: dict[str, Any]
+    messages: list[dict[str, Any]]
+    message_ids: tuple[str, ...]
+
+    @classmethod
+    def from_snapshot(cls, snapshot: StateSnapshot) -> "SnapshotEntry":
+        data = snapshot_to_json(snapshot, SnapshotProjection.FULL)
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        values = dict(data["values"])
+        messages = values.pop("messages")
+        header = {key: value for key, value in data.items() if key != "values"}
+        header["values"] = values
+        return cls(
+            checkpoint_id=checkpoint_id_of(snapshot),
+            body=body,
+            header=header,
+            messages=messages,
+            message_ids=tuple(message.id for message in snapshot.values.get("messages", [])),
+        )
+
+    def messages_after(self, base: "SnapshotEntry") -> Optional[list[dict[str, Any]]]:
+        """
+        相对 base 新增的消息
+
+        :return: 新增消息，base 中有消息已被删除（例如上下文压缩）时为None，此时无法用增量表示
+        """
+        current = set(self.message_ids)
+        if any(message_id not in current for message_id in base.message_ids):
+            return None
+        previous = set(base.message_ids)
+        return [message for message_id, message in zip(self.message_ids, self.messages)
+                if message_id not in previous]
+
+
+class SnapshotCache:
+    """
+    最近序列化过的状态快照，按 (会话ID, 检查点ID) 进行LRU淘汰
+
+    同一个检查点读到的状态并不总是不变：运行中途写入的 pending writes 会改变快照的 next/tasks，
+    启用异步写回（WriteBehindSaver）时，中止运行的补写和 aupdate_state 在写入完成前后读到的内容也可能不同。
+    因此服务每次写入会话状态（图执行结束、中止补写、写入缓存命中的问答）后调用 invalidate() 清除该会话的条目
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], SnapshotEntry] = OrderedDict()
+
+    @classmethod
+    def from_config(cls) -> "SnapshotCache":
+        """
+        从.env文件创建快照缓存
+        """
+        return cls(max_entries=int(os.getenv(SNAPSHOT_CACHE_MAX_ENTRIES, "256")))
+
+    def get(self, thread_id: str, checkpoint_id: Optional[str]) -> Optional[SnapshotEntry]:
+        key = (thread_id, checkpoint_id)
+        entry = self._entries.get(key) if checkpoint_id else None
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, thread_id: str, entry: SnapshotEntry) -> SnapshotEntry:
+        if entry.checkpoint_id is None or self.max_entries <= 0:
+            return entry
+        key = (thread_id, entry.checkpoint_id)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, thread_id: str) -> None:
+        """
+        清除会话的全部条目
+        :param thread_id: 会话ID
+        """
+        for key in [key for key in self._entries if key[0] == thread_id]:
+            del self._entries[key]
@@ -0,0 +1,467 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:27
+@Desc    : stream_runs.py 可续传的流式运行：事件环形缓冲、Last-Event-ID 重放、TTL与内存上限淘汰、可选溢出到Postgres
+"""
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from psycopg_pool import AsyncConnectionPool
+
+from app.common.constants import (
+    STREAM_RESUME_ENABLED, STREAM_RESUME_TTL, STREAM_RESUME_MAX_EVENTS, STREAM_RESUME_MAX_MB,
+    STREAM_RESUME_DETACH_TIMEOUT, STREAM_RESUME_SPILL
+)
+from app.common.metrics import Counter
+from app.common.sse import HEARTBEAT, EVENT_REPLAY_GAP, SseEvent, SseStreamConfig
+
+STREAM_RESUMES = Counter(
+    "chat_stream_resumes_total",
+    "Reconnects to a streamed run, by result (live, finished, evicted, missing)",
+    ("result",),
+)
+STREAM_REPLAYED_EVENTS = Counter(
+    "chat_stream_replayed_events_total",
+    "Events replayed to reconnecting clients, by source (memory, postgres)",
+    ("source",),
+)
+STREAM_REPLAY_GAPS = Counter(
+    "chat_stream_replay_gaps_total",
+    "Reconnects or slow subscribers that skipped events no longer held in memory or Postgres",
+)
+STREAM_RUN_EVICTIONS = Counter(
+    "chat_stream_run_evictions_total",
+    "Streamed runs or events dropped from memory, by reason (ttl, memory, ring)",
+    ("reason",),
+)
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stream_events (
+    run_id TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    frame TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_id, event_id)
+)
+"""
+CREATE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS stream_events_created_at_idx ON stream_events (created_at)"
+INSERT_SQL = "INSERT INTO stream_events (run_id, event_id, frame) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING"
+SELECT_RANGE_SQL = """
+SELECT event_id, frame FROM stream_events
+WHERE run_id = %s AND event_id > %s AND event_id < %s
+ORDER BY event_id
+"""
+DELETE_EXPIRED_SQL = "DELETE FROM stream_events WHERE created_at <= now() - make_interval(secs => %s)"
+
+# 后台任务（溢出写入、过期清理、分离超时检查）的执行间隔
+_SWEEP_INTERVAL = 1.0
+
+# stream_events.event_id 为 INTEGER，事件ID不会超过该值
+_MAX_EVENT_ID = 2 ** 31 - 1
+
+
+class StreamRun:
+    """
+    一次流式运行保存在内存中的事件
+
+    事件ID由 SseEncoder 从1开始连续分配，环形缓冲只保留最近 max_events 个事件
+    """
+
+    def __init__(self, run_id: str, session_id: str, max_events: int):
+        self.run_id = run_id
+        self.session_id = session_id
+        self.max_events = max_events
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.last_id = 0
+        self.bytes = 0
+        self.subscribers = 0
+        self.detached_since: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._frames: deque[tuple[int, str, int]] = deque()
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def first_id(self) -> int:
+        """
+        内存中最早的事件ID，没有事件时为下一个事件的ID
+        """
+        return self._frames[0][0] if self._frames else self.last_id + 1
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, event_id: int, frame: str) -> list[tuple[int, str]]:
+        """
+        追加一个事件
+        :return: 超出环形缓冲被移出的事件
+        """
+        size = sys.getsizeof(frame)
+        self._frames.append((event_id, frame, size))
+        self.last_id = event_id
+        self.bytes += size
+        evicted = self.trim(len(self._frames) - self.max_events)
+        self._notify()
+        return evicted
+
+    def trim(self, count: int) -> list[tuple[int, str]]:
+        """
+        移出最早的 count 个事件
+        """
+        evicted = []
+        for _ in range(max(min(count, len(self._frames)), 0)):
+            event_id, frame, size = self._frames.popleft()
+            self.bytes -= size
+            evicted.append((event_id, frame))
+        return evicted
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def frames_after(self, after: int) -> list[str]:
+        """
+        内存中ID大于 after 的事件
+        """
+        start = max(after + 1 - self.first_id, 0)
+        return [frame for _, frame, _ in itertools.islice(self._frames, start, None)]
+
+    async def wait(self, timeout: float) -> None:
+        """
+        等待新事件或运行结束，最多等待 timeout 秒
+        """
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class StreamRunStore:
+    """
+    可续传的流式运行
+
+    - 每次流式请求创建一个运行，运行的事件写入环形缓冲；HTTP响应只是运行的订阅者，
+      连接断开后运行继续执行，带 Last-Event-ID 重连时先重放缺失的事件，再继续接收实时事件；
+      运行已结束时重放到结束事件为止
+    - 没有订阅者超过 detach_timeout 秒的运行被取消（0 表示最后一个订阅者断开时立即取消），
+      避免客户端不再回来时继续消耗模型调用；分离期间运行仍占用准入名额，因此默认不启用（STREAM_RESUME_ENABLED）
+    - 运行结束 ttl 秒后被淘汰；内存占用超过上限时先淘汰最早结束的运行，再截断最早的事件
+    - 启用溢出时，被移出内存的事件在后台批量写入Postgres，重放时从Postgres补齐
+    - 运行只保存在创建它的进程中，多worker部署时重连需要路由到同一个worker（例如按 session_id 做粘性会话）
+    """
+
+    def __init__(self,
+                 ttl: float = 300.0,
+                 max_events: int = 2000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 detach_timeout: float = 30.0,
+                 pool: Optional[AsyncConnectionPool] = None,
+                 stream_config: Optional[SseStreamConfig] = None):
+        self.ttl = ttl
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.detach_timeout = detach_timeout
+        self._pool = pool
+        self._stream_config = stream_config or SseStreamConfig.from_config()
+        self._runs: OrderedDict[str, StreamRun] = OrderedDict()
+        self._latest: dict[str, str] = {}
+        self._bytes = 0
+        # 等待写入Postgres的事件，写入完成前重放时从这里读取
+        self._pending_spill: dict[str, list[tuple[int, str]]] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, pool: Optional[AsyncConnectionPool] = None) -> "StreamRunStore":
+        """
+        从.env文件创建流式运行存储
+        """
+        spill = os.getenv(STREAM_RESUME_SPILL, "false").lower() == "true"
+        return cls(
+            ttl=float(os.getenv(STREAM_RESUME_TTL, "300")),
+            max_events=int(os.getenv(STREAM_RESUME_MAX_EVENTS, "2000")),
+            max_bytes=int(float(os.getenv(STREAM_RESUME_MAX_MB, "64")) * 1024 * 1024),
+            detach_timeout=float(os.getenv(STREAM_RESUME_DETACH_TIMEOUT, "30")),
+            pool=pool if spill else None,
+        )
+
+    @staticmethod
+    def enabled_in_config() -> bool:
+        return os.getenv(STREAM_RESUME_ENABLED, "false").lower() == "true"
+
+    async def start(self) -> None:
+        """
+        启用溢出时建表并清理过期事件，启动后台任务
+        """
+        if self._pool is not None:
+            async with self._pool.connection() as conn:
+                await conn.execute(CREATE_TABLE_SQL)
+                await conn.execute(CREATE_INDEX_SQL)
+                await conn.execute(DELETE_EXPIRED_SQL, (self.ttl,))
+        self._sweeper = asyncio.create_task(self._run_periodically(), name="stream-run-sweeper")
+
+    async def stop(self) -> None:
+        """
+        停止后台任务，取消仍在执行的运行，并写入尚未溢出的事件
+
+        drain() 超时后分离的运行可能仍在执行，必须在关闭MCP会话、检查点保存器和连接池之前结束
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        tasks = [run.task for run in self._runs.values() if run.task is not None and not run.task.done()]
+        for run in self._runs.values():
+            self._cancel(run, "运行时停止")
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self._flush_spill()
+
+    def create(self, session_id: str) -> StreamRun:
+        """
+        创建一个运行并作为该会话最近的运行
+        """
+        run = StreamRun(uuid.uuid4().hex, session_id, self.max_events)
+        # 响应体从未被读取时（例如发送响应头失败）同样按分离超时取消
+        run.detached_since = time.monotonic()
+        self._runs[run.run_id] = run
+        self._latest[session_id] = run.run_id
+        return run
+
+    def get(self, run_id: str) -> Optional[StreamRun]:
+        return self._runs.get(run_id)
+
+    def latest(self, session_id: str) -> Optional[StreamRun]:
+        """
+        会话最近一次的运行，已被淘汰时为None
+        """
+        run_id = self._latest.get(session_id)
+        return self._runs.get(run_id) if run_id is not None else None
+
+    def append(self, run: StreamRun, event_id: int, frame: str) -> None:
+        """
+        保存运行输出的一个事件，作为 SseEncoder 的 on_event 回调
+        """
+        before = run.bytes
+        evicted = run.append(event_id, frame)
+        self._bytes += run.bytes - before
+        if evicted:
+            STREAM_RUN_EVICTIONS.inc(len(evicted), reason="ring")
+            self._spill(run.run_id, evicted)
+        if self._bytes > self.max_bytes:
+            self._enforce_memory_limit()
+
+    def finish(self, run: StreamRun) -> None:
+        run.finish()
+
+    def _spill(self, run_id: str, frames: list[tuple[int, str]]) -> None:
+        if self._pool is not None and frames:
+            self._pending_spill.setdefault(run_id, []).extend(frames)
+
+    def _remove(self, run: StreamRun) -> None:
+        self._runs.pop(run.run_id, None)
+        if self._latest.get(run.session_id) == run.run_id:
+            del self._latest[run.session_id]
+        self._bytes -= run.bytes
+
+    def _enforce_memory_limit(self) -> None:
+        """
+        内存超过上限时，先淘汰最早结束的运行，仍然超过时截断占用最多的运行中最早的事件
+        """
+        for run in sorted((run for run in self._runs.values() if run.done), key=lambda run: run.finished_at):
+            if self._bytes <= self.max_bytes:
+                return
+            # 先按截断前的占用扣减，再把事件移出内存
+            self._remove(run)
+            self._spill(run.run_id, run.trim(len(run)))
+            STREAM_RUN_EVICTIONS.inc(reason="memory")
+        while self._bytes > self.max_bytes and self._runs:
+            largest = max(self._runs.values(), key=lambda run: run.bytes)
+            if largest.bytes == 0:
+                return
+            before = largest.bytes
+            evicted = largest.trim(max(len(largest) // 2, 1))
+            self._bytes -= before - largest.bytes
+            STREAM_RUN_EVICTIONS.inc(len(evicted), reason="memory")
+            self._spill(largest.run_id, evicted)
+
+    def _sweep(self) -> None:
+        """
+        淘汰过期的运行，取消长时间没有订阅者的运行
+        """
+        now = time.monotonic()
+        for run in list(self._runs.values()):
+            if run.done:
+                if now - run.finished_at >= self.ttl:
+                    self._remove(run)
+                    STREAM_RUN_EVICTIONS.inc(reason="ttl")
+            elif (run.subscribers == 0 and run.detached_since is not None
+                  and now - run.detached_since >= self.detach_timeout):
+                self._cancel(run, f"{self.detach_timeout:g}s 内没有客户端重连")
+
+    @staticmethod
+    def _cancel(run: StreamRun, reason: str) -> None:
+        if run.task is not None and not run.task.done():
+            logging.info("取消会话 %s 的流式运行 %s：%s", run.session_id, run.run_id, reason)
+            run.task.cancel()
+
+    async def _flush_spill(self) -> None:
+        if self._pool is None or not self._pending_spill:
+            return
+        # 列表在写入期间仍会被 _spill 追加，只记录本次写入的事件数
+        counts, rows = {}, []
+        for run_id, frames in self._pending_spill.items():
+            counts[run_id] = len(frames)
+            rows.extend((run_id, event_id, frame) for event_id, frame in frames)
+        try:
+            async with self._pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(INSERT_SQL, rows)
+        except Exception:
+            logging.exception("流式事件写入Postgres失败，%d 个事件将在下次重试", len(rows))
+            return
+        # 写入期间新增的事件保留到下一轮
+        for run_id, count in counts.items():
+            remaining = self._pending_spill.get(run_id, [])[count:]
+            if remaining:
+                self._pending_spill[run_id] = remaining
+            else:
+                self._pending_spill.pop(run_id, None)
+
+    async def _run_periodically(self) -> None:
+        last_expire = time.monotonic()
+        while True:
+            await asyncio.sleep(_SWEEP_INTERVAL)
+            try:
+                self._sweep()
+                await self._flush_spill()
+                if self._pool is not None and time.monotonic() - last_expire >= self.ttl:
+                    last_expire = time.monotonic()
+                    async with self._pool.connection() as conn:
+                        await conn.execute(DELETE_EXPIRED_SQL, (self.ttl,))
+            except Exception:
+                logging.exception("流式运行清理失败")
+
+    async def _spilled_frames(self, run_id: str, after: int, before: int) -> list[str]:
+        """
+        读取已溢出的事件中ID在 (after, before) 范围内的部分
+        """
+        if self._pool is None:
+            return []
+        frames = {event_id: frame for event_id, frame in self._pending_spill.get(run_id, [])
+                  if after < event_id < before}
+        async with self._pool.connection() as conn:
+            cursor = await conn.execute(SELECT_RANGE_SQL, (run_id, after, before))
+            for event_id, frame in await cursor.fetchall():
+                frames.setdefault(event_id, frame)
+        return [frames[event_id] for event_id in sorted(frames)]
+
+    async def replay_evicted(self, run_id: str, after: int) -> Optional[list[str]]:
+        """
+        运行已从内存中淘汰时，从Postgres读取 after 之后的全部事件
+        :return: 事件列表，未启用溢出或没有记录时为None
+        """
+        if self._pool is None:
+            return None
+        frames = await self._spilled_frames(run_id, after, _MAX_EVENT_ID + 1)
+        return frames or None
+
+    async def subscribe(self,
+                        run: StreamRun,
+                        after: int = 0,
+                        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator[str]:
+        """
+        订阅运行：先输出ID大于 after 的已保存事件，再输出实时事件，直到运行结束或客户端断开
+
+        :param run: 流式运行
+        :param after: 客户端最后收到的事件ID，0 表示从头开始
+        :param is_disconnected: 客户端断开检测函数
+        :return: SSE帧
+        """
+        run.subscribers += 1
+        run.detached_since = None
+        cursor = after
+        heartbeat_interval = self._stream_config.heartbeat_interval
+        poll_interval = self._stream_config.disconnect_poll_interval
+        last_output = time.monotonic()
+        replaying = after > 0
+        try:
+            if after > 0 and after + 1 < run.first_id:
+                spilled = await self._spilled_frames(run.run_id, after, run.first_id)
+                if spilled:
+                    STREAM_REPLAYED_EVENTS.inc(len(spilled), source="postgres")
+                    yield "".join(spilled)
+                cursor = after + len(spilled)
+            while True:
+                if cursor + 1 < run.first_id:
+                    STREAM_REPLAY_GAPS.inc()
+                    yield self._gap(cursor + 1, run.first_id)
+                    cursor = run.first_id - 1
+                frames = run.frames_after(cursor)
+                if frames:
+                    if replaying:
+                        replaying = False
+                        STREAM_REPLAYED_EVENTS.inc(len(frames), source="memory")
+                    cursor = run.last_id
+                    last_output = time.monotonic()
+                    yield "".join(frames)
+                    continue
+                if run.done:
+                    return
+                await run.wait(poll_interval if is_disconnected is not None else heartbeat_interval or 1.0)
+                if is_disconnected is not None and await is_disconnected():
+                    logging.info("客户端已断开，会话 %s 的流式运行 %s 在后台继续", run.session_id, run.run_id)
+                    return
+                if heartbeat_interval > 0 and time.monotonic() - last_output >= heartbeat_interval:
+                    last_output = time.monotonic()
+                    yield HEARTBEAT
+        finally:
+            run.subscribers -= 1
+            if run.subscribers == 0:
+                run.detached_since = time.monotonic()
+                if not run.done and self.detach_timeout <= 0:
+                    self._cancel(run, "客户端已断开")
+
+    @staticmethod
+    def _gap(missing_from: int, resumed_from: int) -> str:
+        """
+        告知客户端 [missing_from, resumed_from) 范围内的事件已无法重放
+        """
+        return SseEvent(event=EVENT_REPLAY_GAP,
+                        data={"missing_from": missing_from, "resumed_from": resumed_from}).encode()
+
+    def stats(self) -> dict:
+        """
+        运行数、内存占用和待溢出事件数
+        """
+        live = sum(1 for run in self._runs.values() if not run.done)
+        return {
+            "runs": len(self._runs),
+            "live": live,
+            "detached": sum(1 for run in self._runs.values() if not run.done and run.subscribers == 0),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "pending_spill": sum(len(frames) for frames in self._pending_spill.values()),
+            "resumes": {result: STREAM_RESUMES.value(result=result)
+                        for result in ("live", "finished", "evicted", "missing")},
+            "replay_gaps": STREAM_REPLAY_GAPS.value(),
+        }
+
@@ -0,0 +1,244 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:15
+@Desc    : tool_cache.py 确定性工具的TTL结果缓存
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool
+from langgraph.prebuilt.tool_node import ToolCallRequest
+from langgraph.types import Command
+
+from app.common.constants import TOOL_CACHE_ENABLED, TOOL_CACHE_POLICIES
+from app.common.metrics import Counter
+
+TOOL_CACHE_REQUESTS = Counter(
+    "tool_cache_requests_total",
+    "Tool result cache lookups by tool and result (hit, miss, coalesced)",
+    ("tool", "result"),
+)
+TOOL_CACHE_EVICTIONS = Counter(
+    "tool_cache_evictions_total",
+    "Tool result cache entries evicted because the per-tool capacity was reached",
+    ("tool",),
+)
+
+# 工具 metadata 中缓存策略的键
+CACHE_POLICY_METADATA_KEY = "result_cache"
+
+
+@dataclass(frozen=True)
+class ToolCachePolicy:
+    """单个工具的缓存策略"""
+    # 结果的有效期（秒）
+    ttl: float = 60.0
+    # 该工具最多缓存的不同参数组合数
+    max_entries: int = 128
+
+
+def cacheable(ttl: float = 60.0, max_entries: int = 128) -> Callable[[BaseTool], BaseTool]:
+    """
+    把工具标记为可缓存，放在 @tool 装饰器之上使用
+
+    只应标记确定性的工具：相同参数在TTL内返回相同结果，且没有副作用
+    :param ttl: 结果的有效期（秒）
+    :param max_entries: 最多缓存的不同参数组合数
+    :return: 装饰器
+    """
+
+    def decorator(tool: BaseTool) -> BaseTool:
+        tool.metadata = {**(tool.metadata or {}),
+                         CACHE_POLICY_METADATA_KEY: ToolCachePolicy(ttl=ttl, max_entries=max_entries)}
+        return tool
+
+    return decorator
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def cache_key(args: dict[str, Any]) -> str:
+    """
+    计算参数的归一化缓存键：键排序、去掉值为None的参数、去掉字符串首尾空白
+    :param args: 工具调用参数
+    :return: 缓存键
+    """
+    payload = json.dumps(_normalize(args), sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _CachedResult:
+    content: Any
+    artifact: Any
+    expires_at: float
+
+
+class _InFlight:
+    """正在执行的工具调用，相同参数的并发调用共享同一次执行"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ToolResultCache:
+    """
+    工具结果缓存
+
+    作为ToolNode的 awrap_tool_call 拦截器使用。每个工具按自己的策略独立缓存：
+    工具 metadata 中通过 cacheable 声明的策略，或 TOOL_CACHE_POLICIES 中按工具名配置的策略（优先）。
+    相同工具、相同归一化参数的并发调用只执行一次，其余调用等待并复用结果；
+    只缓存成功的结果，返回错误状态或Command的调用不缓存。
+    """
+
+    def __init__(self, policies: Optional[dict[str, ToolCachePolicy]] = None, enabled: bool = True):
+        self.enabled = enabled
+        self._policies = policies or {}
+        self._entries: dict[str, OrderedDict[str, _CachedResult]] = {}
+        self._in_flight: dict[tuple[str, str], _InFlight] = {}
+
+    @classmethod
+    def from_config(cls) -> "ToolResultCache":
+        """
+        从.env文件创建工具结果缓存
+
+        TOOL_CACHE_POLICIES 为JSON，例如 {"get_weather": {"ttl": 300, "max_entries": 256}}
+        """
+        policies = json.loads(os.getenv(TOOL_CACHE_POLICIES) or "{}")
+        return cls(
+            policies={name: ToolCachePolicy(**policy) for name, policy in policies.items()},
+            enabled=os.getenv(TOOL_CACHE_ENABLED, "true").lower() == "true",
+        )
+
+    def policy_for(self, tool: Optional[BaseTool]) -> Optional[ToolCachePolicy]:
+        """
+        获取工具的缓存策略，不可缓存时返回None
+        """
+        if tool is None:
+            return None
+        policy = self._policies.get(tool.name)
+        if policy is None and tool.metadata:
+            policy = tool.metadata.get(CACHE_POLICY_METADATA_KEY)
+        return policy
+
+    def _get(self, tool_name: str, key: str) -> Optional[_CachedResult]:
+        entries = self._entries.get(tool_name)
+        if not entries:
+            return None
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return entry
+
+    def _put(self, tool_name: str, key: str, message: ToolMessage, policy: ToolCachePolicy) -> None:
+        entries = self._entries.setdefault(tool_name, OrderedDict())
+        entries[key] = _CachedResult(content=message.content, artifact=message.artifact,
+                                     expires_at=time.monotonic() + policy.ttl)
+        entries.move_to_end(key)
+        while len(entries) > policy.max_entries:
+            entries.popitem(last=False)
+            TOOL_CACHE_EVICTIONS.inc(tool=tool_name)
+
+    @staticmethod
+    def _reply(request: ToolCallRequest, content: Any, artifact: Any) -> ToolMessage:
+        return ToolMessage(content=content, artifact=artifact, name=request.tool_call["name"],
+                           tool_call_id=request.tool_call["id"])
+
+    async def awrap(self,
+                    request: ToolCallRequest,
+                    execute: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]]) -> ToolMessage | Command:
+        """
+        ToolNode的异步工具调用拦截器
+        :param request: 工具调用请求
+        :param execute: 实际执行工具调用的函数
+        :return: 工具消息
+        """
+        policy = self.policy_for(request.tool) if self.enabled else None
+        if policy is None:
+            return await execute(request)
+        tool_name = request.tool_call["name"]
+        key = cache_key(request.tool_call.get("args") or {})
+        cached = self._get(tool_name, key)
+        if cached is not None:
+            TOOL_CACHE_REQUESTS.inc(tool=tool_name, result="hit")
+            return self._reply(request, cached.content, cached.artifact)
+
+        in_flight = self._in_flight.get((tool_name, key))
+        if in_flight is None:
+            TOOL_CACHE_REQUESTS.inc(tool=tool_name, result="miss")
+            in_flight = _InFlight(asyncio.ensure_future(execute(request)))
+            self._in_flight[(tool_name, key)] = in_flight
+            in_flight.task.add_done_callback(
+                lambda task: self._on_done(task, tool_name, key, policy)
+            )
+        else:
+            TOOL_CACHE_REQUESTS.inc(tool=tool_name, result="coalesced")
+        in_flight.waiters += 1
+        try:
+            result = await asyncio.shield(in_flight.task)
+        finally:
+            in_flight.waiters -= 1
+            # 所有等待者都已离开（例如客户端断开）时才取消共享的执行
+            if in_flight.waiters == 0 and not in_flight.task.done():
+                in_flight.task.cancel()
+        if isinstance(result, ToolMessage):
+            # 共享的执行使用首个调用的 tool_call_id，返回前替换为本次调用的ID
+            return result.model_copy(update={"tool_call_id": request.tool_call["id"]})
+        return result
+
+    def _on_done(self, task: asyncio.Task, tool_name: str, key: str, policy: ToolCachePolicy) -> None:
+        self._in_flight.pop((tool_name, key), None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if isinstance(result, ToolMessage) and result.status != "error":
+            self._put(tool_name, key, result, policy)
+        else:
+            logging.debug("工具 %s 的结果不可缓存: %r", tool_name, type(result))
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        按工具统计缓存状态
+        """
+        tool_names = set(self._entries) | {labels["tool"] for labels, _ in TOOL_CACHE_REQUESTS.samples()}
+        return {
+            "enabled": self.enabled,
+            "tools": {
+                name: {
+                    "size": len(self._entries.get(name, ())),
+                    "hits": TOOL_CACHE_REQUESTS.value(tool=name, result="hit"),
+                    "misses": TOOL_CACHE_REQUESTS.value(tool=name, result="miss"),
+                    "coalesced": TOOL_CACHE_REQUESTS.value(tool=name, result="coalesced"),
+                    "evictions": TOOL_CACHE_EVICTIONS.value(tool=name),
+                }
+                for name in sorted(tool_names)
+            },
+        }
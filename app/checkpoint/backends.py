@@ -0,0 +1,389 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:30
+@Desc    : backends.py 可配置的检查点后端：Postgres、SQLite（WAL）、内存（可定期快照到磁盘），以及可选的异步写回
+"""
+import asyncio
+import copy
+import logging
+import os
+import pickle
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Collection, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+
+from app.common.constants import (
+    CHECKPOINT_BACKEND, CHECKPOINT_SQLITE_PATH, CHECKPOINT_SQLITE_SYNCHRONOUS, CHECKPOINT_MEMORY_SNAPSHOT_PATH,
+    CHECKPOINT_MEMORY_SNAPSHOT_INTERVAL, CHECKPOINT_WRITE_BEHIND, CHECKPOINT_WRITE_BEHIND_MAX_PENDING
+)
+from app.common.metrics import Counter, Histogram
+
+try:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+except ImportError:  # 未安装 langgraph-checkpoint-sqlite 时不支持 sqlite 后端
+    AsyncSqliteSaver = None
+
+CHECKPOINT_WRITE_BEHIND_ERRORS = Counter(
+    "checkpoint_write_behind_errors_total",
+    "Checkpoint writes that failed after the super-step had already been acknowledged",
+)
+CHECKPOINT_WRITE_BEHIND_LAG = Histogram(
+    "checkpoint_write_behind_lag_seconds",
+    "Time from acknowledging a checkpoint write to it being stored by the underlying backend",
+)
+
+SUPPORTED_BACKENDS = ("postgres", "sqlite", "memory")
+
+_SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+@dataclass(frozen=True)
+class CheckpointBackendConfig:
+    """检查点后端配置"""
+    # postgres、sqlite 或 memory
+    backend: str = "postgres"
+    # SQLite数据库文件
+    sqlite_path: str = "data/checkpoints.sqlite"
+    # SQLite的 synchronous：WAL模式下 NORMAL 在进程崩溃时不丢数据，掉电时可能丢失最近提交的事务；FULL 每次提交都落盘
+    sqlite_synchronous: str = "NORMAL"
+    # 内存后端的快照文件，为空时不快照
+    memory_snapshot_path: str = ""
+    # 内存后端的快照间隔（秒），只在有新写入时才写文件
+    memory_snapshot_interval: float = 30.0
+    # 是否异步写回检查点
+    write_behind: bool = False
+    # 异步写回时最多积压的写入数，超过后写入退化为同步等待
+    write_behind_max_pending: int = 1000
+
+    @classmethod
+    def from_config(cls) -> "CheckpointBackendConfig":
+        """
+        从.env文件读取检查点后端配置
+        """
+        return cls(
+            backend=os.getenv(CHECKPOINT_BACKEND, "postgres").lower(),
+            sqlite_path=os.getenv(CHECKPOINT_SQLITE_PATH, "data/checkpoints.sqlite"),
+            sqlite_synchronous=os.getenv(CHECKPOINT_SQLITE_SYNCHRONOUS, "NORMAL").upper(),
+            memory_snapshot_path=os.getenv(CHECKPOINT_MEMORY_SNAPSHOT_PATH, ""),
+            memory_snapshot_interval=float(os.getenv(CHECKPOINT_MEMORY_SNAPSHOT_INTERVAL, "30")),
+            write_behind=os.getenv(CHECKPOINT_WRITE_BEHIND, "false").lower() == "true",
+            write_behind_max_pending=int(os.getenv(CHECKPOINT_WRITE_BEHIND_MAX_PENDING, "1000")),
+        )
+
+    def validate(self) -> None:
+        """
+        :raises ValueError: 不支持的后端或SQLite同步模式
+        """
+        if self.backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"不支持的检查点后端: {self.backend}，可选: {', '.join(SUPPORTED_BACKENDS)}")
+        if self.sqlite_synchronous not in _SQLITE_SYNCHRONOUS_MODES:
+            raise ValueError(f"不支持的 SQLite synchronous: {self.sqlite_synchronous}")
+
+
+class SnapshotMemorySaver(InMemorySaver):
+    """
+    定期把全部检查点快照到磁盘的内存检查点保存器
+
+    读写都在内存中完成；后台任务每隔 interval 秒检查是否有新写入，有则在事件循环中复制一份状态，
+    再在线程中序列化并原子替换快照文件（先写临时文件再 rename）。启动时从快照文件恢复。
+    进程崩溃会丢失上次快照之后的写入；快照文件使用 pickle，只能加载本服务自己写入的文件。
+    """
+
+    def __init__(self, path: str, interval: float = 30.0, serde: Optional[SerializerProtocol] = None):
+        super().__init__(serde=serde)
+        self.path = Path(path)
+        self.interval = interval
+        self._version = 0
+        self._saved_version = 0
+        self._last_snapshot_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        self._version += 1
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        self._version += 1
+        super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._version += 1
+        super().delete_thread(thread_id)
+
+    def load(self) -> None:
+        """
+        从快照文件恢复，文件不存在时为空
+        """
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as f:
+            data = pickle.load(f)
+        for thread_id, namespaces in data["storage"].items():
+            for checkpoint_ns, checkpoints in namespaces.items():
+                self.storage[thread_id][checkpoint_ns].update(checkpoints)
+        for key, writes in data["writes"].items():
+            self.writes[key].update(writes)
+        self.blobs.update(data["blobs"])
+        logging.info("已从 %s 恢复 %d 个会话的检查点", self.path, len(data["storage"]))
+
+    def _copy_state(self) -> dict:
+        # 序列化后的值是不可变的元组，只需复制各层字典
+        return {
+            "storage": {thread_id: {ns: dict(checkpoints) for ns, checkpoints in namespaces.items()}
+                        for thread_id, namespaces in self.storage.items()},
+            "writes": {key: dict(writes) for key, writes in self.writes.items()},
+            "blobs": dict(self.blobs),
+        }
+
+    def _write(self, data: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def snapshot(self) -> None:
+        """
+        有新写入时把当前状态写入快照文件
+        """
+        version = self._version
+        if version == self._saved_version:
+            return
+        await asyncio.to_thread(self._write, self._copy_state())
+        self._saved_version = version
+        self._last_snapshot_at = time.time()
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.snapshot()
+            except Exception:
+                logging.exception("内存检查点快照失败")
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.load)
+        self._task = asyncio.create_task(self._run_periodically(), name="checkpoint-snapshot")
+
+    async def stop(self) -> None:
+        """
+        停止后台任务并写入最后一次快照
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.snapshot()
+
+    def stats(self) -> dict:
+        return {
+            "threads": len(self.storage),
+            "unsaved_writes": self._version - self._saved_version,
+            "last_snapshot_at": self._last_snapshot_at,
+        }
+
+
+async def open_sqlite_saver(config: CheckpointBackendConfig,
+                            serde: Optional[SerializerProtocol] = None) -> BaseCheckpointSaver:
+    """
+    打开WAL模式的SQLite检查点保存器，由调用方通过 close_checkpointer 关闭
+
+    需要安装 langgraph-checkpoint-sqlite（依赖 aiosqlite）
+    """
+    if AsyncSqliteSaver is None:
+        raise RuntimeError("CHECKPOINT_BACKEND=sqlite 需要安装 langgraph-checkpoint-sqlite")
+    import aiosqlite
+    Path(config.sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = await aiosqlite.connect(config.sqlite_path)
+    # WAL下读不阻塞写，写入只追加到WAL文件，提交时不需要同步主数据库文件
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute(f"PRAGMA synchronous={config.sqlite_synchronous}")
+    await conn.execute("PRAGMA busy_timeout=5000")
+    saver = AsyncSqliteSaver(conn, serde=serde)
+    await saver.setup()
+    logging.info("SQLite检查点: %s（WAL，synchronous=%s）", config.sqlite_path, config.sqlite_synchronous)
+    return saver
+
+
+class WriteBehindSaver(BaseCheckpointSaver):
+    """
+    异步写回的检查点保存器
+
+    aput/aput_writes 把写入交给后台任务后立即返回，图执行不再等待每个超步落盘；
+    同一会话的写入按提交顺序串行执行，读取会话（aget_tuple/alist/adelete_thread）之前先等待该会话积压的写入完成，
+    因此同一进程内的读取总能看到之前的写入。
+
+    与 langgraph 自带的 durability="async" 的区别：async 模式下检查点写入与下一个超步并行执行，
+    但一次运行（ainvoke/astream）结束前仍要等待本次运行的全部写入完成，且每次写入都要等上一次写入结束，
+    因此每轮的延迟至少包含最后一个检查点的写入时间。写回模式下运行结束时不等待写入，写入在运行返回后继续进行，
+    最后一个超步的写入延迟也从每轮延迟中移除；代价是运行返回时检查点可能尚未持久化。
+
+    持久性的代价：
+    - 已确认的超步在写入完成前只存在于进程内存中，进程崩溃或被强制终止会丢失这些写入，
+      会话回退到最后一个已落盘的检查点（正常停止时会先写完积压的写入）
+    - 后台写入失败时图执行不会感知，只记录日志和 checkpoint_write_behind_errors_total；
+      此时后续检查点可能引用缺失的写入，需要结合告警处理
+    - 其他进程（多worker、其他实例）读取会话时看不到尚未写完的检查点
+    适合检查点写入延迟占主导、可以接受崩溃时丢失最近几个超步的场景；积压超过 max_pending 时写入退化为同步等待。
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver, max_pending: int = 1000):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.max_pending = max_pending
+        # 每个会话最后一个写入任务，新的写入等待它完成后执行
+        self._tails: dict[str, asyncio.Task] = {}
+        self._pending = 0
+
+    @property
+    def config_specs(self) -> list:
+        return self.saver.config_specs
+
+    def with_allowlist(self, extra_allowlist: Collection[tuple[str, ...]]) -> "WriteBehindSaver":
+        # 共享积压的写入，只替换内层保存器
+        clone = copy.copy(self)
+        clone.saver = self.saver.with_allowlist(extra_allowlist)
+        return clone
+
+    def get_next_version(self, current: Any, channel: None) -> Any:
+        return self.saver.get_next_version(current, channel)
+
+    @staticmethod
+    async def _write(previous: Optional[asyncio.Task], operation: Callable[[], Awaitable[None]],
+                     acknowledged_at: float) -> None:
+        if previous is not None:
+            await asyncio.wait({previous})
+        try:
+            # 轮到本次写入时才创建内层保存器的协程，任务被提前取消时不会留下未等待的协程
+            await operation()
+            CHECKPOINT_WRITE_BEHIND_LAG.observe(time.perf_counter() - acknowledged_at)
+        except Exception:
+            CHECKPOINT_WRITE_BEHIND_ERRORS.inc()
+            logging.exception("检查点异步写回失败")
+
+    async def _submit(self, thread_id: str, operation: Callable[[], Awaitable[None]]) -> None:
+        previous = self._tails.get(thread_id)
+        self._pending += 1
+        task = asyncio.create_task(self._write(previous, operation, time.perf_counter()))
+        self._tails[thread_id] = task
+
+        def release(done: asyncio.Task) -> None:
+            # 在回调中计数：任务在开始执行前被取消时协程体不会运行
+            self._pending -= 1
+            if self._tails.get(thread_id) is done:
+                del self._tails[thread_id]
+            if done.cancelled():
+                CHECKPOINT_WRITE_BEHIND_ERRORS.inc()
+                logging.error("会话 %s 的检查点写入在完成前被取消，该写入已丢失", thread_id)
+
+        task.add_done_callback(release)
+        if self._pending > self.max_pending:
+            await asyncio.wait({task})
+
+    async def barrier(self, thread_id: Optional[str] = None) -> None:
+        """
+        等待会话积压的写入完成，thread_id 为空时等待全部会话
+        """
+        if thread_id is None:
+            tasks = list(self._tails.values())
+        else:
+            tasks = [self._tails[thread_id]] if thread_id in self._tails else []
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        # Pregel 传入的已是检查点的副本，后台写入期间不会被修改
+        await self._submit(thread_id, lambda: self.saver.aput(config, checkpoint, metadata, new_versions))
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        writes = list(writes)
+        await self._submit(config["configurable"]["thread_id"],
+                           lambda: self.saver.aput_writes(config, writes, task_id, task_path))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        await self.barrier(config["configurable"]["thread_id"])
+        return await self.saver.aget_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None
+                    ) -> AsyncIterator[CheckpointTuple]:
+        await self.barrier((config or {}).get("configurable", {}).get("thread_id"))
+        async for item in self.saver.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.barrier(thread_id)
+        await self.saver.adelete_thread(thread_id)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "threads_pending": len(self._tails),
+            "errors": CHECKPOINT_WRITE_BEHIND_ERRORS.value(),
+        }
+
+
+def unwrap_checkpointer(checkpointer: Optional[BaseCheckpointSaver]) -> Optional[BaseCheckpointSaver]:
+    """
+    去掉异步写回包装，返回实际存储检查点的保存器
+    """
+    return checkpointer.saver if isinstance(checkpointer, WriteBehindSaver) else checkpointer
+
+
+async def close_checkpointer(checkpointer: Optional[BaseCheckpointSaver]) -> None:
+    """
+    写完积压的写入并关闭本地检查点后端；Postgres 连接池由调用方关闭
+    """
+    if isinstance(checkpointer, WriteBehindSaver):
+        await checkpointer.barrier()
+    checkpointer = unwrap_checkpointer(checkpointer)
+    if isinstance(checkpointer, SnapshotMemorySaver):
+        await checkpointer.stop()
+    elif AsyncSqliteSaver is not None and isinstance(checkpointer, AsyncSqliteSaver):
+        await checkpointer.conn.close()
+
+
+def checkpointer_stats(checkpointer: Optional[BaseCheckpointSaver], backend: str) -> dict:
+    stats: dict[str, Any] = {"backend": backend}
+    if isinstance(checkpointer, WriteBehindSaver):
+        stats["write_behind"] = checkpointer.stats()
+    saver = unwrap_checkpointer(checkpointer)
+    if isinstance(saver, SnapshotMemorySaver):
+        stats["snapshot"] = saver.stats()
+    return stats
+
+
+def create_memory_saver(config: CheckpointBackendConfig,
+                        serde: Optional[SerializerProtocol] = None) -> InMemorySaver:
+    """
+    内存检查点保存器，配置了快照文件时返回 SnapshotMemorySaver，需要调用 start() 恢复快照并启动后台任务
+    """
+    if config.memory_snapshot_path:
+        return SnapshotMemorySaver(config.memory_snapshot_path, config.memory_snapshot_interval, serde=serde)
+    return InMemorySaver(serde=serde)
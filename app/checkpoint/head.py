@@ -0,0 +1,70 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:29
+@Desc    : head.py 只读取会话最新的检查点ID，不加载和反序列化状态
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from app.checkpoint.backends import AsyncSqliteSaver, WriteBehindSaver
+
+# 与 AsyncPostgresSaver、AsyncSqliteSaver 的 aget_tuple 未指定检查点时的排序一致
+SELECT_LATEST_CHECKPOINT_ID_SQL = """
+SELECT checkpoint_id FROM checkpoints
+WHERE thread_id = %s AND checkpoint_ns = %s
+ORDER BY checkpoint_id DESC
+LIMIT 1
+"""
+SELECT_LATEST_CHECKPOINT_ID_SQLITE_SQL = SELECT_LATEST_CHECKPOINT_ID_SQL.replace("%s", "?")
+
+
+@asynccontextmanager
+async def _postgres_connection(checkpointer: AsyncPostgresSaver) -> AsyncIterator[AsyncConnection]:
+    if isinstance(checkpointer.conn, AsyncConnectionPool):
+        async with checkpointer.conn.connection() as conn:
+            yield conn
+    else:
+        # 单个连接由检查点保存器的锁保护
+        async with checkpointer.lock:
+            yield checkpointer.conn
+
+
+async def latest_checkpoint_id(checkpointer: Optional[BaseCheckpointSaver],
+                               thread_id: str,
+                               checkpoint_ns: str = "") -> Optional[str]:
+    """
+    读取会话最新的检查点ID，用于在加载完整状态之前判断状态是否变化
+
+    :param checkpointer: 检查点保存器
+    :param thread_id: 会话ID
+    :param checkpoint_ns: 检查点命名空间，默认为根图
+    :return: 检查点ID，会话没有检查点或检查点保存器不支持时为None（调用方应退回到加载完整状态）
+    """
+    if isinstance(checkpointer, WriteBehindSaver):
+        # 先等待积压的写入完成，与 aget_tuple 看到的状态一致
+        await checkpointer.barrier(thread_id)
+        checkpointer = checkpointer.saver
+    if isinstance(checkpointer, AsyncPostgresSaver):
+        async with _postgres_connection(checkpointer) as conn:
+            cursor = await conn.execute(SELECT_LATEST_CHECKPOINT_ID_SQL, (thread_id, checkpoint_ns))
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return row["checkpoint_id"] if isinstance(row, dict) else row[0]
+    if AsyncSqliteSaver is not None and isinstance(checkpointer, AsyncSqliteSaver):
+        async with checkpointer.lock:
+            async with checkpointer.conn.execute(SELECT_LATEST_CHECKPOINT_ID_SQLITE_SQL,
+                                                 (thread_id, checkpoint_ns)) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+    if isinstance(checkpointer, InMemorySaver):
+        checkpoints = checkpointer.storage.get(thread_id, {}).get(checkpoint_ns)
+        return max(checkpoints) if checkpoints else None
+    return None
@@ -0,0 +1,195 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:21
+@Desc    : pool.py Postgres连接池配置、启动预热与等待队列监控
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from psycopg_pool import AsyncConnectionPool
+
+from app.common.constants import (
+    POSTGRES_POOL_MIN_SIZE, POSTGRES_POOL_MAX_SIZE, POSTGRES_POOL_TIMEOUT, POSTGRES_POOL_MAX_WAITING,
+    POSTGRES_POOL_MAX_IDLE, POSTGRES_POOL_MAX_LIFETIME, POSTGRES_POOL_RECONNECT_TIMEOUT, POSTGRES_POOL_CHECK,
+    POSTGRES_POOL_OPEN_TIMEOUT, POSTGRES_POOL_CLOSE_TIMEOUT, POSTGRES_CONNECT_TIMEOUT,
+    POSTGRES_POOL_WAITING_WARN_THRESHOLD, POSTGRES_POOL_MONITOR_INTERVAL
+)
+
+
+@dataclass(frozen=True)
+class PostgresPoolConfig:
+    """Postgres连接池配置，时间单位均为秒"""
+    # 启动时预先建立并长期保持的连接数
+    min_size: int = 4
+    max_size: int = 20
+    # 获取连接的最长等待时间，超时抛出 PoolTimeout
+    timeout: float = 30.0
+    # 允许排队等待连接的最大请求数，0 表示不限制，超出时立即抛出 TooManyRequests
+    max_waiting: int = 0
+    # 超过 min_size 的空闲连接在空闲该时长后关闭
+    max_idle: float = 600.0
+    # 连接的最长使用时间，到期后由后台任务替换
+    max_lifetime: float = 3600.0
+    # 连接失败后持续重连的时间
+    reconnect_timeout: float = 300.0
+    # 为True时每次取出连接前执行一次检查，断开的连接会被丢弃并替换
+    check: bool = False
+    # 启动时等待 min_size 个连接就绪的时间，以及关闭时等待后台任务结束的时间
+    open_timeout: float = 30.0
+    close_timeout: float = 5.0
+    # 建立单个连接的超时（libpq connect_timeout）
+    connect_timeout: int = 10
+    # 等待连接的请求数达到该值时输出警告，0 表示不监控
+    waiting_warn_threshold: int = 5
+    monitor_interval: float = 1.0
+
+    @classmethod
+    def from_config(cls) -> "PostgresPoolConfig":
+        """
+        从.env文件读取连接池配置
+        """
+        config = cls(
+            min_size=int(os.getenv(POSTGRES_POOL_MIN_SIZE, "4")),
+            max_size=int(os.getenv(POSTGRES_POOL_MAX_SIZE, "20")),
+            timeout=float(os.getenv(POSTGRES_POOL_TIMEOUT, "30")),
+            max_waiting=int(os.getenv(POSTGRES_POOL_MAX_WAITING, "0")),
+            max_idle=float(os.getenv(POSTGRES_POOL_MAX_IDLE, "600")),
+            max_lifetime=float(os.getenv(POSTGRES_POOL_MAX_LIFETIME, "3600")),
+            reconnect_timeout=float(os.getenv(POSTGRES_POOL_RECONNECT_TIMEOUT, "300")),
+            check=os.getenv(POSTGRES_POOL_CHECK, "false").lower() == "true",
+            open_timeout=float(os.getenv(POSTGRES_POOL_OPEN_TIMEOUT, "30")),
+            close_timeout=float(os.getenv(POSTGRES_POOL_CLOSE_TIMEOUT, "5")),
+            connect_timeout=int(os.getenv(POSTGRES_CONNECT_TIMEOUT, "10")),
+            waiting_warn_threshold=int(os.getenv(POSTGRES_POOL_WAITING_WARN_THRESHOLD, "5")),
+            monitor_interval=float(os.getenv(POSTGRES_POOL_MONITOR_INTERVAL, "1")),
+        )
+        if not 0 <= config.min_size <= config.max_size:
+            raise ValueError(f"连接池大小配置无效: min_size={config.min_size}, max_size={config.max_size}")
+        return config
+
+    def create_pool(self, conninfo: str, **connection_kwargs) -> AsyncConnectionPool:
+        """
+        创建未打开的连接池，由调用方通过 open_pool() 打开
+        :param conninfo: 连接串
+        :param connection_kwargs: 传给每个连接的参数
+        """
+        return AsyncConnectionPool(
+            conninfo=conninfo,
+            kwargs={"connect_timeout": self.connect_timeout, **connection_kwargs},
+            min_size=self.min_size,
+            max_size=self.max_size,
+            timeout=self.timeout,
+            max_waiting=self.max_waiting,
+            max_idle=self.max_idle,
+            max_lifetime=self.max_lifetime,
+            reconnect_timeout=self.reconnect_timeout,
+            check=AsyncConnectionPool.check_connection if self.check else None,
+            name="checkpoint",
+            open=False,
+        )
+
+
+async def open_pool(pool: AsyncConnectionPool, config: PostgresPoolConfig) -> None:
+    """
+    打开连接池并等待 min_size 个连接建立完成，避免首批请求承担建连开销
+    :param pool: 未打开的连接池
+    :param config: 连接池配置
+    """
+    start = time.perf_counter()
+    await pool.open(wait=True, timeout=config.open_timeout)
+    stats = pool.get_stats()
+    logging.info("Postgres连接池已预热，连接 %d/%d，耗时 %.1fms",
+                 stats.get("pool_size", 0), config.max_size, (time.perf_counter() - start) * 1000)
+
+
+async def close_pool(pool: AsyncConnectionPool, config: PostgresPoolConfig) -> None:
+    """
+    关闭连接池：不再借出新连接，已借出的连接归还后关闭
+    """
+    await pool.close(timeout=config.close_timeout)
+
+
+class PoolMonitor:
+    """
+    连接池等待队列监控
+
+    定时读取 get_stats()，等待连接的请求数超过阈值或出现获取连接失败时输出警告，
+    同一类警告在 warn_interval 秒内只输出一次
+    """
+
+    def __init__(self,
+                 pool: AsyncConnectionPool,
+                 warn_threshold: int = 5,
+                 interval: float = 1.0,
+                 warn_interval: float = 30.0):
+        self._pool = pool
+        self.warn_threshold = warn_threshold
+        self.interval = interval
+        self.warn_interval = warn_interval
+        self.max_waiting_seen = 0
+        self.warnings = 0
+        self._last_errors = 0
+        self._last_warned: dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _warn(self, kind: str, message: str, *args) -> None:
+        now = time.monotonic()
+        if now - self._last_warned.get(kind, -self.warn_interval) < self.warn_interval:
+            return
+        self._last_warned[kind] = now
+        self.warnings += 1
+        logging.warning(message, *args)
+
+    def check(self) -> None:
+        """
+        检查一次连接池状态
+        """
+        stats = self._pool.get_stats()
+        waiting = stats.get("requests_waiting", 0)
+        self.max_waiting_seen = max(self.max_waiting_seen, waiting)
+        if waiting >= self.warn_threshold:
+            self._warn("waiting", "Postgres连接池有 %d 个请求在等待连接（连接 %d/%d，空闲 %d），"
+                                  "可考虑调大 POSTGRES_POOL_MAX_SIZE",
+                       waiting, stats.get("pool_size", 0), stats.get("pool_max", 0), stats.get("pool_available", 0))
+        errors = stats.get("requests_errors", 0)
+        if errors > self._last_errors:
+            self._warn("errors", "Postgres连接池获取连接失败 %d 次（累计 %d），可能是等待超时或数据库不可用",
+                       errors - self._last_errors, errors)
+        self._last_errors = errors
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.warning("读取Postgres连接池状态失败: %r", e)
+
+    def start(self) -> None:
+        """
+        启动后台监控任务，阈值为0时不启动
+        """
+        if self.warn_threshold > 0:
+            self._task = asyncio.create_task(self._run_periodically(), name="postgres-pool-monitor")
+
+    async def stop(self) -> None:
+        """
+        停止后台监控任务
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {"max_waiting_seen": self.max_waiting_seen, "warnings": self.warnings}
+
@@ -0,0 +1,296 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:15
+@Desc    : retention.py Postgres检查点保留与压缩
+
+运行方式: python -m app.checkpoint.retention [--keep-last 20] [--idle-ttl 604800] [--batch-size 500]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+
+from psycopg_pool import AsyncConnectionPool
+
+from app.common.constants import (
+    CHECKPOINT_RETENTION_ENABLED, CHECKPOINT_KEEP_LAST, CHECKPOINT_IDLE_TTL,
+    CHECKPOINT_RETENTION_INTERVAL, CHECKPOINT_RETENTION_BATCH_SIZE
+)
+
+# 超过保留数量的线程
+SELECT_OVERFLOW_THREADS_SQL = """
+SELECT thread_id FROM checkpoints
+GROUP BY thread_id, checkpoint_ns
+HAVING count(*) > %(keep_last)s
+"""
+
+# 删除一批超出保留数量的检查点及其待写入记录，返回删除的行数和字节数
+DELETE_OVERFLOW_BATCH_SQL = """
+WITH ranked AS (
+    SELECT thread_id, checkpoint_ns, checkpoint_id,
+           row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+    FROM checkpoints
+    WHERE thread_id = ANY(%(thread_ids)s)
+), victims AS (
+    SELECT thread_id, checkpoint_ns, checkpoint_id FROM ranked
+    WHERE rn > %(keep_last)s
+    LIMIT %(batch_size)s
+), deleted_writes AS (
+    DELETE FROM checkpoint_writes w USING victims v
+    WHERE w.thread_id = v.thread_id AND w.checkpoint_ns = v.checkpoint_ns AND w.checkpoint_id = v.checkpoint_id
+    RETURNING pg_column_size(w.*) AS size
+), deleted_checkpoints AS (
+    DELETE FROM checkpoints c USING victims v
+    WHERE c.thread_id = v.thread_id AND c.checkpoint_ns = v.checkpoint_ns AND c.checkpoint_id = v.checkpoint_id
+    RETURNING pg_column_size(c.*) AS size
+)
+SELECT (SELECT count(*) FROM deleted_checkpoints), (SELECT coalesce(sum(size), 0) FROM deleted_checkpoints),
+       (SELECT count(*) FROM deleted_writes), (SELECT coalesce(sum(size), 0) FROM deleted_writes)
+"""
+
+# 删除不再被任何检查点引用的blob
+# 只删除版本号小于该通道当前最大引用版本的blob，避免误删正在写入、尚未提交检查点的新blob
+DELETE_ORPHAN_BLOBS_BATCH_SQL = """
+WITH victims AS (
+    SELECT b.thread_id, b.checkpoint_ns, b.channel, b.version
+    FROM checkpoint_blobs b
+    WHERE b.thread_id = ANY(%(thread_ids)s)
+      AND NOT EXISTS (
+          SELECT 1 FROM checkpoints c
+          WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+            AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+      )
+      AND b.version < (
+          SELECT max(c.checkpoint -> 'channel_versions' ->> b.channel) FROM checkpoints c
+          WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+      )
+    LIMIT %(batch_size)s
+), deleted_blobs AS (
+    DELETE FROM checkpoint_blobs b USING victims v
+    WHERE b.thread_id = v.thread_id AND b.checkpoint_ns = v.checkpoint_ns
+      AND b.channel = v.channel AND b.version = v.version
+    RETURNING pg_column_size(b.*) AS size
+)
+SELECT count(*), coalesce(sum(size), 0) FROM deleted_blobs
+"""
+
+# 最近一次检查点早于TTL的空闲线程
+SELECT_IDLE_THREADS_SQL = """
+SELECT thread_id FROM checkpoints
+GROUP BY thread_id
+HAVING max((checkpoint ->> 'ts')::timestamptz) < now() - make_interval(secs => %(idle_ttl)s)
+LIMIT %(batch_size)s
+"""
+
+DELETE_THREADS_SQL = {
+    "checkpoints": "DELETE FROM checkpoints t WHERE thread_id = ANY(%(thread_ids)s) RETURNING pg_column_size(t.*) AS size",
+    "checkpoint_blobs": "DELETE FROM checkpoint_blobs t WHERE thread_id = ANY(%(thread_ids)s) RETURNING pg_column_size(t.*) AS size",
+    "checkpoint_writes": "DELETE FROM checkpoint_writes t WHERE thread_id = ANY(%(thread_ids)s) RETURNING pg_column_size(t.*) AS size",
+}
+
+
+@dataclass
+class RetentionReport:
+    """单次保留任务的清理结果"""
+    checkpoints: int = 0
+    checkpoint_writes: int = 0
+    checkpoint_blobs: int = 0
+    bytes_reclaimed: int = 0
+    expired_threads: int = 0
+    trimmed_threads: int = 0
+    elapsed_ms: float = 0.0
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def rows(self) -> int:
+        return self.checkpoints + self.checkpoint_writes + self.checkpoint_blobs
+
+
+class CheckpointRetention:
+    """
+    检查点保留策略
+
+    - 每个线程只保留最近 keep_last 个检查点，其余检查点、对应的待写入记录和不再被引用的blob被删除
+    - 最近一次检查点早于 idle_ttl 秒的空闲线程被整体删除
+    - 所有删除都按 batch_size 分批、每批一个短事务并设置 lock_timeout，避免长时间持有锁
+    """
+
+    def __init__(self,
+                 pool: AsyncConnectionPool,
+                 keep_last: int = 20,
+                 idle_ttl: Optional[float] = None,
+                 batch_size: int = 500,
+                 interval: float = 3600.0,
+                 lock_timeout_ms: int = 2000):
+        self._pool = pool
+        self.keep_last = keep_last
+        self.idle_ttl = idle_ttl
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock_timeout_ms = lock_timeout_ms
+        self._task: Optional[asyncio.Task] = None
+        self.last_report: Optional[RetentionReport] = None
+
+    @classmethod
+    def from_config(cls, pool: AsyncConnectionPool) -> "CheckpointRetention":
+        """
+        从.env文件创建检查点保留策略
+        """
+        idle_ttl = float(os.getenv(CHECKPOINT_IDLE_TTL, "0"))
+        return cls(
+            pool=pool,
+            keep_last=int(os.getenv(CHECKPOINT_KEEP_LAST, "20")),
+            idle_ttl=idle_ttl if idle_ttl > 0 else None,
+            batch_size=int(os.getenv(CHECKPOINT_RETENTION_BATCH_SIZE, "500")),
+            interval=float(os.getenv(CHECKPOINT_RETENTION_INTERVAL, "3600")),
+        )
+
+    @staticmethod
+    def enabled_in_config() -> bool:
+        return os.getenv(CHECKPOINT_RETENTION_ENABLED, "false").lower() == "true"
+
+    async def _fetch(self, sql: str, params: dict) -> list[tuple]:
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                return await cur.fetchall()
+
+    async def _execute_batch(self, sql: str, params: dict) -> tuple:
+        """
+        在一个短事务内执行一批删除，lock_timeout 只对本事务生效
+        """
+        async with self._pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute(f"SET LOCAL lock_timeout = {int(self._lock_timeout_ms)}")
+                    await cur.execute(sql, params)
+                    return await cur.fetchone()
+
+    async def trim_threads(self, report: RetentionReport) -> None:
+        """
+        删除每个线程中超出保留数量的检查点
+        """
+        rows = await self._fetch(SELECT_OVERFLOW_THREADS_SQL, {"keep_last": self.keep_last})
+        thread_ids = list(dict.fromkeys(row[0] for row in rows))
+        report.trimmed_threads += len(thread_ids)
+        for start in range(0, len(thread_ids), self.batch_size):
+            chunk = thread_ids[start:start + self.batch_size]
+            while True:
+                checkpoints, checkpoint_bytes, writes, write_bytes = await self._execute_batch(
+                    DELETE_OVERFLOW_BATCH_SQL,
+                    {"thread_ids": chunk, "keep_last": self.keep_last, "batch_size": self.batch_size}
+                )
+                report.checkpoints += checkpoints
+                report.checkpoint_writes += writes
+                report.bytes_reclaimed += checkpoint_bytes + write_bytes
+                if checkpoints < self.batch_size:
+                    break
+            while True:
+                blobs, blob_bytes = await self._execute_batch(
+                    DELETE_ORPHAN_BLOBS_BATCH_SQL, {"thread_ids": chunk, "batch_size": self.batch_size}
+                )
+                report.checkpoint_blobs += blobs
+                report.bytes_reclaimed += blob_bytes
+                if blobs < self.batch_size:
+                    break
+
+    async def expire_idle_threads(self, report: RetentionReport) -> None:
+        """
+        删除超过TTL未活动的线程
+        """
+        if self.idle_ttl is None:
+            return
+        while True:
+            rows = await self._fetch(SELECT_IDLE_THREADS_SQL,
+                                     {"idle_ttl": self.idle_ttl, "batch_size": self.batch_size})
+            thread_ids = [row[0] for row in rows]
+            if not thread_ids:
+                break
+            report.expired_threads += len(thread_ids)
+            for table, sql in DELETE_THREADS_SQL.items():
+                count, size = await self._execute_batch(
+                    f"WITH deleted AS ({sql}) SELECT count(*), coalesce(sum(size), 0) FROM deleted",
+                    {"thread_ids": thread_ids}
+                )
+                setattr(report, table, getattr(report, table) + count)
+                report.bytes_reclaimed += size
+            if len(thread_ids) < self.batch_size:
+                break
+
+    async def run_once(self) -> RetentionReport:
+        """
+        执行一次完整的保留任务
+        :return: 清理结果
+        """
+        report = RetentionReport()
+        start = time.perf_counter()
+        for step in (self.expire_idle_threads, self.trim_threads):
+            try:
+                await step(report)
+            except Exception as e:
+                report.errors.append(f"{step.__name__}: {e!r}")
+                logging.exception("检查点保留任务 %s 执行失败", step.__name__)
+        report.elapsed_ms = (time.perf_counter() - start) * 1000
+        self.last_report = report
+        logging.info("检查点保留任务完成，删除 %d 行，回收约 %d 字节，耗时 %.1fms",
+                     report.rows, report.bytes_reclaimed, report.elapsed_ms)
+        return report
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def start(self) -> None:
+        """
+        启动后台保留任务
+        """
+        self._task = asyncio.create_task(self._run_periodically(), name="checkpoint-retention")
+
+    async def stop(self) -> None:
+        """
+        停止后台保留任务
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.checkpoint.pool import PostgresPoolConfig, open_pool, close_pool
+    from app.config import create_postgres_pool_from_config
+
+    pool_config = PostgresPoolConfig.from_config()
+    pool = create_postgres_pool_from_config()
+    await open_pool(pool, pool_config)
+    try:
+        retention = CheckpointRetention.from_config(pool)
+        if args.keep_last is not None:
+            retention.keep_last = args.keep_last
+        if args.idle_ttl is not None:
+            retention.idle_ttl = args.idle_ttl if args.idle_ttl > 0 else None
+        if args.batch_size is not None:
+            retention.batch_size = args.batch_size
+        report = await retention.run_once()
+        print(json.dumps({**asdict(report), "rows": report.rows}, ensure_ascii=False, indent=2))
+    finally:
+        await close_pool(pool, pool_config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="清理Postgres中的历史检查点")
+    parser.add_argument("--keep-last", type=int, help="每个线程保留的检查点数量")
+    parser.add_argument("--idle-ttl", type=float, help="空闲线程的过期时间（秒），0 表示不过期")
+    parser.add_argument("--batch-size", type=int, help="每批删除的最大行数")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,191 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:28
+@Desc    : serde.py 检查点序列化压缩：超过阈值的blob使用zstd（不可用时zlib）压缩并加版本头，未压缩的旧数据照常读取
+"""
+import logging
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from langgraph.checkpoint.serde.base import CipherProtocol, SerializerProtocol
+from langgraph.checkpoint.serde.encrypted import EncryptedSerializer
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from app.common.constants import CHECKPOINT_COMPRESSION, CHECKPOINT_COMPRESSION_THRESHOLD, CHECKPOINT_COMPRESSION_LEVEL
+from app.common.metrics import Counter
+
+try:
+    # Python 3.14 起标准库自带 zstd
+    from compression import zstd as _zstd
+
+    def _zstd_compress(data: bytes, level: int) -> bytes:
+        return _zstd.compress(data, level=level)
+
+    def _zstd_decompress(data: bytes, _: int) -> bytes:
+        return _zstd.decompress(data)
+except ImportError:
+    try:
+        import zstandard as _zstd
+
+        def _zstd_compress(data: bytes, level: int) -> bytes:
+            return _zstd.ZstdCompressor(level=level).compress(data)
+
+        def _zstd_decompress(data: bytes, size: int) -> bytes:
+            return _zstd.ZstdDecompressor().decompress(data, max_output_size=size)
+    except ImportError:
+        _zstd = None
+
+CHECKPOINT_SERIALIZED_BYTES = Counter(
+    "checkpoint_serialized_bytes_total",
+    "Checkpoint blob bytes before (raw) and after (stored) compression",
+    ("stage",),
+)
+
+# 压缩数据的头部：格式版本（1字节）+ 原始长度（4字节，大端）
+_HEADER = struct.Struct(">BI")
+_FORMAT_VERSION = 1
+
+# 未压缩数据的 cipher 名
+_PLAIN = "plain"
+
+_CODECS: dict[str, tuple[Callable[[bytes, int], bytes], Callable[[bytes, int], bytes]]] = {
+    "zlib": (lambda data, level: zlib.compress(data, level), lambda data, _: zlib.decompress(data)),
+}
+if _zstd is not None:
+    _CODECS["zstd"] = (_zstd_compress, _zstd_decompress)
+
+
+def zstd_available() -> bool:
+    return _zstd is not None
+
+
+@dataclass(frozen=True)
+class CheckpointCompressionConfig:
+    """检查点压缩配置"""
+    # 压缩算法：auto（有zstd时用zstd，否则zlib）、zstd、zlib 或 none
+    codec: str = "auto"
+    # 序列化后不小于该字节数的blob才压缩，小blob压缩收益低且多占CPU
+    threshold: int = 1024
+    # 压缩级别，为空时使用算法的默认级别（zstd 3，zlib 6）
+    level: Optional[int] = None
+
+    @classmethod
+    def from_config(cls) -> "CheckpointCompressionConfig":
+        """
+        从.env文件读取检查点压缩配置
+        """
+        level = os.getenv(CHECKPOINT_COMPRESSION_LEVEL, "")
+        return cls(
+            codec=os.getenv(CHECKPOINT_COMPRESSION, "auto").lower(),
+            threshold=int(os.getenv(CHECKPOINT_COMPRESSION_THRESHOLD, "1024")),
+            level=int(level) if level else None,
+        )
+
+    def resolve_codec(self) -> Optional[str]:
+        """
+        实际使用的压缩算法，none 时为None
+        :raises ValueError: 不支持的压缩算法
+        """
+        if self.codec == "none":
+            return None
+        if self.codec == "auto":
+            return "zstd" if zstd_available() else "zlib"
+        if self.codec == "zstd" and not zstd_available():
+            logging.warning("未安装 zstandard（或 Python < 3.14），检查点压缩使用 zlib")
+            return "zlib"
+        if self.codec not in _CODECS:
+            raise ValueError(f"不支持的检查点压缩算法: {self.codec}")
+        return self.codec
+
+
+class CompressionCipher(CipherProtocol):
+    """
+    以 langgraph 加密序列化器的 cipher 接口实现的压缩，压缩算法名作为 cipher 名追加在序列化类型之后
+
+    - 不小于 threshold 字节的数据加版本头后压缩，cipher 名为算法名（msgpack -> msgpack+zstd）；
+      小于阈值或压缩后没有变小的数据原样保存，cipher 名为 plain（CompressedSerializer 写入时会去掉该后缀）
+    - threshold 为None时只解压不压缩，用于关闭压缩后继续读取已压缩的数据
+    """
+
+    def __init__(self, codec: str = "zlib", threshold: Optional[int] = 1024, level: Optional[int] = None):
+        """
+        :param codec: 压缩算法，zstd 或 zlib
+        :param threshold: 压缩阈值（字节），为None时不压缩
+        :param level: 压缩级别，为空时使用算法的默认级别
+        """
+        if codec not in _CODECS:
+            raise ValueError(f"不支持的检查点压缩算法: {codec}")
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level if level is not None else (3 if codec == "zstd" else 6)
+
+    def encrypt(self, plaintext: bytes) -> tuple[str, bytes]:
+        if self.threshold is None or len(plaintext) < self.threshold:
+            return _PLAIN, plaintext
+        compressed = _HEADER.pack(_FORMAT_VERSION, len(plaintext)) + _CODECS[self.codec][0](plaintext, self.level)
+        CHECKPOINT_SERIALIZED_BYTES.inc(len(plaintext), stage="raw")
+        if len(compressed) >= len(plaintext):
+            CHECKPOINT_SERIALIZED_BYTES.inc(len(plaintext), stage="stored")
+            return _PLAIN, plaintext
+        CHECKPOINT_SERIALIZED_BYTES.inc(len(compressed), stage="stored")
+        return self.codec, compressed
+
+    def decrypt(self, ciphername: str, ciphertext: bytes) -> bytes:
+        if ciphername == _PLAIN:
+            return ciphertext
+        if ciphername not in _CODECS:
+            if ciphername == "zstd":
+                raise RuntimeError("检查点数据使用 zstd 压缩，需要安装 zstandard 才能读取")
+            raise ValueError(f"不支持的检查点压缩算法: {ciphername}")
+        version, size = _HEADER.unpack_from(ciphertext)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"不支持的检查点压缩格式版本: {version}")
+        return _CODECS[ciphername][1](memoryview(ciphertext)[_HEADER.size:], size)
+
+
+class CompressedSerializer(EncryptedSerializer):
+    """
+    在检查点序列化器之外包装一层压缩
+
+    沿用 EncryptedSerializer 的类型后缀约定：压缩的数据类型为 msgpack+zstd 等，类型中没有 + 的数据
+    （开启压缩前写入的旧数据和未达到阈值的数据）直接交给内层序列化器读取。
+    继承它也使检查点保存器的 msgpack 白名单（LANGGRAPH_STRICT_MSGPACK）对内层序列化器照常生效。
+    关闭压缩或切换算法后仍能读取已写入的数据，但读取 zstd 数据的进程必须有 zstd
+    """
+
+    def __init__(self,
+                 serde: Optional[SerializerProtocol] = None,
+                 codec: str = "zlib",
+                 threshold: Optional[int] = 1024,
+                 level: Optional[int] = None):
+        """
+        :param serde: 内层序列化器，默认为 JsonPlusSerializer
+        :param codec: 压缩算法，zstd 或 zlib
+        :param threshold: 压缩阈值（字节），为None时不压缩
+        :param level: 压缩级别，为空时使用算法的默认级别
+        """
+        super().__init__(CompressionCipher(codec, threshold, level), serde or JsonPlusSerializer())
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        # 未压缩的数据不加后缀，回退到没有压缩的版本后仍可读取
+        type_, data = super().dumps_typed(obj)
+        base_type, _, ciphername = type_.rpartition("+")
+        return (base_type, data) if ciphername == _PLAIN else (type_, data)
+
+
+def create_checkpoint_serde_from_config() -> CompressedSerializer:
+    """
+    按配置创建检查点序列化器
+
+    关闭压缩（CHECKPOINT_COMPRESSION=none）时同样返回压缩序列化器，只是不再压缩，保证已压缩的数据仍可读取
+    """
+    config = CheckpointCompressionConfig.from_config()
+    codec = config.resolve_codec()
+    if codec is None:
+        return CompressedSerializer(codec="zstd" if zstd_available() else "zlib", threshold=None)
+    logging.info("检查点压缩: %s，阈值 %d 字节", codec, config.threshold)
+    return CompressedSerializer(codec=codec, threshold=config.threshold, level=config.level)
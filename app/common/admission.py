@@ -0,0 +1,299 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:22
+@Desc    : admission.py 图执行的准入控制：同一会话串行执行、全局并发上限与公平排队、队列满时快速拒绝
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.common.constants import (
+    ADMISSION_ENABLED, ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_SESSION_MAX_PENDING, ADMISSION_SESSION_TIMEOUT, ADMISSION_RETRY_AFTER, ADMISSION_DRAIN_TIMEOUT
+)
+from app.common.metrics import CallbackMetric, Counter, Histogram, Sample
+
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds",
+    "Time a graph run waited in the session or global admission queue",
+    ("queue",),
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Graph runs rejected by admission control (queue_full, timeout, draining)",
+    ("queue", "reason"),
+)
+
+# 运行耗时平滑系数，用于估算 Retry-After
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(HTTPException):
+    """
+    准入被拒绝：会话队列满或等待超时返回429，全局队列满或等待超时返回503，均带有 Retry-After
+    """
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+        self.retry_after = retry_after
+
+
+class QueueFull(Exception):
+    """排队人数已达上限"""
+
+
+class FairLimiter:
+    """
+    先进先出的并发限制器
+
+    释放名额时直接交给队首的等待者，新来的请求不能插队；排队人数达到 max_queue 时立即抛出 QueueFull
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def idle(self) -> bool:
+        return self.active == 0 and not self._waiters
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        获取一个名额
+        :param timeout: 最长排队时间（秒），超时抛出 asyncio.TimeoutError
+        """
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise QueueFull()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经交给本请求，放弃时转交给下一个等待者
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self) -> None:
+        """
+        释放一个名额，有等待者时直接转交
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionTicket:
+    """一次图执行持有的准入名额，release() 可重复调用"""
+    __slots__ = ("_controller", "session_id", "admitted_at", "_released")
+
+    def __init__(self, controller: Optional["AdmissionController"], session_id: str):
+        self._controller = controller
+        self.session_id = session_id
+        self.admitted_at = time.perf_counter()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self._controller is not None:
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    图执行的准入控制
+
+    - 同一会话（thread_id）的请求按到达顺序串行执行，避免并发写同一线程的检查点；
+      每个会话最多排队 session_max_pending 个请求
+    - 全局最多同时执行 max_concurrency 个图，超出的请求先进先出排队，最多排队 max_queue 个
+    - 先获取会话名额再获取全局名额，同一会话排队中的请求不占用全局队列
+    - 队列已满或等待超时时立即拒绝，Retry-After 按最近的平均执行耗时和排队人数估算
+    - 进程退出前调用 drain()：拒绝新的请求，等待已准入和排队中的执行结束；重新启动时调用 resume() 恢复准入
+    """
+
+    def __init__(self,
+                 enabled: bool = True,
+                 max_concurrency: int = 32,
+                 max_queue: int = 64,
+                 queue_timeout: float = 30.0,
+                 session_max_pending: int = 2,
+                 session_timeout: float = 120.0,
+                 retry_after: int = 1,
+                 drain_timeout: float = 30.0):
+        self.enabled = enabled
+        self.queue_timeout = queue_timeout
+        self.session_max_pending = session_max_pending
+        self.session_timeout = session_timeout
+        self.retry_after = retry_after
+        self.drain_timeout = drain_timeout
+        self._draining = False
+        self._global = FairLimiter(max_concurrency, max_queue)
+        self._sessions: dict[str, FairLimiter] = {}
+        self._avg_run_seconds: Optional[float] = None
+
+    @classmethod
+    def from_config(cls) -> "AdmissionController":
+        """
+        从.env文件创建准入控制器
+        """
+        return cls(
+            enabled=os.getenv(ADMISSION_ENABLED, "true").lower() == "true",
+            max_concurrency=int(os.getenv(ADMISSION_MAX_CONCURRENCY, "32")),
+            max_queue=int(os.getenv(ADMISSION_MAX_QUEUE, "64")),
+            queue_timeout=float(os.getenv(ADMISSION_QUEUE_TIMEOUT, "30")),
+            session_max_pending=int(os.getenv(ADMISSION_SESSION_MAX_PENDING, "2")),
+            session_timeout=float(os.getenv(ADMISSION_SESSION_TIMEOUT, "120")),
+            retry_after=int(os.getenv(ADMISSION_RETRY_AFTER, "1")),
+            drain_timeout=float(os.getenv(ADMISSION_DRAIN_TIMEOUT, "30")),
+        )
+
+    def _estimate_retry_after(self, queued: int, concurrency: int) -> int:
+        if self._avg_run_seconds is None:
+            return self.retry_after
+        estimate = math.ceil(self._avg_run_seconds * (queued + 1) / max(concurrency, 1))
+        return min(max(estimate, self.retry_after), 60)
+
+    def _reject(self, queue: str, reason: str, status_code: int, detail: str, retry_after: int) -> AdmissionRejected:
+        ADMISSION_REJECTIONS.inc(queue=queue, reason=reason)
+        logging.warning("请求被准入控制拒绝: %s（%s/%s）", detail, queue, reason)
+        return AdmissionRejected(status_code, detail, retry_after)
+
+    async def _acquire(self, limiter: FairLimiter, queue: str, timeout: float) -> None:
+        start = time.perf_counter()
+        await limiter.acquire(timeout)
+        ADMISSION_WAIT.observe(time.perf_counter() - start, queue=queue)
+
+    async def enter(self, session_id: str) -> AdmissionTicket:
+        """
+        获取一次图执行的准入名额，执行结束后必须调用 ticket.release()
+        :param session_id: 会话ID
+        :return: 准入名额
+        :raises AdmissionRejected: 队列已满或等待超时
+        """
+        if not self.enabled:
+            return AdmissionTicket(None, session_id)
+        if self._draining:
+            raise self._reject("global", "draining", 503, "服务正在重启，请稍后重试", self.retry_after)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = FairLimiter(1, self.session_max_pending)
+        try:
+            await self._acquire(session, "session", self.session_timeout)
+        except (QueueFull, asyncio.TimeoutError) as e:
+            self._drop_session_if_idle(session_id, session)
+            reason = "queue_full" if isinstance(e, QueueFull) else "timeout"
+            raise self._reject("session", reason, 429, f"会话 {session_id} 已有请求在执行，排队请求过多",
+                               self._estimate_retry_after(session.queued, 1))
+        except BaseException:
+            self._drop_session_if_idle(session_id, session)
+            raise
+        try:
+            await self._acquire(self._global, "global", self.queue_timeout)
+        except (QueueFull, asyncio.TimeoutError) as e:
+            self._release_session(session_id)
+            reason = "queue_full" if isinstance(e, QueueFull) else "timeout"
+            raise self._reject("global", reason, 503, "服务繁忙，请稍后重试",
+                               self._estimate_retry_after(self._global.queued, self._global.max_concurrency))
+        except BaseException:
+            self._release_session(session_id)
+            raise
+        return AdmissionTicket(self, session_id)
+
+    def _drop_session_if_idle(self, session_id: str, session: FairLimiter) -> None:
+        if session.idle and self._sessions.get(session_id) is session:
+            del self._sessions[session_id]
+
+    def _release_session(self, session_id: str) -> None:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.release()
+            self._drop_session_if_idle(session_id, session)
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        elapsed = time.perf_counter() - ticket.admitted_at
+        self._avg_run_seconds = elapsed if self._avg_run_seconds is None else \
+            self._avg_run_seconds + _EWMA_ALPHA * (elapsed - self._avg_run_seconds)
+        self._global.release()
+        self._release_session(ticket.session_id)
+
+    async def drain(self, timeout: Optional[float] = None, interval: float = 0.05) -> bool:
+        """
+        停止准入新的执行，并等待已准入和排队中的执行全部结束
+        :param timeout: 最长等待时间（秒），默认使用 drain_timeout
+        :param interval: 检查间隔（秒）
+        :return: 是否在超时前全部结束
+        """
+        self._draining = True
+        if not self.enabled:
+            return True
+        timeout = self.drain_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while not (self._global.idle and not self._sessions):
+            if time.monotonic() >= deadline:
+                logging.warning("等待执行中的请求结束超时（%.0fs），仍有 %d 个在执行、%d 个在排队",
+                                timeout, self._global.active, self._global.queued)
+                return False
+            await asyncio.sleep(interval)
+        return True
+
+    def resume(self) -> None:
+        """
+        恢复准入新的执行，运行时重新启动时调用，撤销此前 drain() 的效果
+        """
+        self._draining = False
+
+    def stats(self) -> dict:
+        """
+        当前执行数、排队数和平均执行耗时
+        """
+        return {
+            "enabled": self.enabled,
+            "draining": self._draining,
+            "active": self._global.active,
+            "max_concurrency": self._global.max_concurrency,
+            "queued": self._global.queued,
+            "max_queue": self._global.max_queue,
+            "sessions": len(self._sessions),
+            "session_queued": sum(session.queued for session in self._sessions.values()),
+            "avg_run_ms": (self._avg_run_seconds or 0.0) * 1000,
+        }
+
+
+# 进程级单例，聊天服务的每次图执行都经过该控制器
+admission_controller = AdmissionController.from_config()
+
+
+def _queue_depth() -> list[Sample]:
+    stats = admission_controller.stats()
+    return [({"queue": "global"}, stats["queued"]), ({"queue": "session"}, stats["session_queued"])]
+
+
+CallbackMetric("admission_queue_depth", "Graph runs waiting for admission, by queue", _queue_depth)
+CallbackMetric("admission_active_runs", "Graph runs currently admitted",
+               lambda: [({}, admission_controller.stats()["active"])])
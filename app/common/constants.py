@@ -7,6 +7,26 @@
 OPENAI_API_KEY = "OPENAI_API_KEY"
 OPENAI_BASE_URL = "OPENAI_BASE_URL"
 OPENAI_MODEL_NAME = "OPENAI_MODEL_NAME"
+OPENAI_EMBEDDINGS = "OPENAI_EMBEDDINGS"
+
+LLM_HTTP_MAX_CONNECTIONS = "LLM_HTTP_MAX_CONNECTIONS"
+LLM_HTTP_MAX_KEEPALIVE = "LLM_HTTP_MAX_KEEPALIVE"
+LLM_HTTP_KEEPALIVE_EXPIRY = "LLM_HTTP_KEEPALIVE_EXPIRY"
+LLM_HTTP_CONNECT_TIMEOUT = "LLM_HTTP_CONNECT_TIMEOUT"
+LLM_HTTP_READ_TIMEOUT = "LLM_HTTP_READ_TIMEOUT"
+LLM_HTTP_WRITE_TIMEOUT = "LLM_HTTP_WRITE_TIMEOUT"
+LLM_HTTP_POOL_TIMEOUT = "LLM_HTTP_POOL_TIMEOUT"
+LLM_HTTP_HTTP2 = "LLM_HTTP_HTTP2"
+LLM_HTTP_MAX_RETRIES = "LLM_HTTP_MAX_RETRIES"
+LLM_HTTP_BACKOFF_BASE = "LLM_HTTP_BACKOFF_BASE"
+LLM_HTTP_BACKOFF_MAX = "LLM_HTTP_BACKOFF_MAX"
+LLM_HTTP_RETRY_STATUSES = "LLM_HTTP_RETRY_STATUSES"
+
+MODEL_BACKENDS = "MODEL_BACKENDS"
+MODEL_ROUTER_FAILURE_THRESHOLD = "MODEL_ROUTER_FAILURE_THRESHOLD"
+MODEL_ROUTER_OPEN_SECONDS = "MODEL_ROUTER_OPEN_SECONDS"
+MODEL_ROUTER_ACQUIRE_TIMEOUT = "MODEL_ROUTER_ACQUIRE_TIMEOUT"
+MODEL_ROUTER_MAX_ATTEMPTS = "MODEL_ROUTER_MAX_ATTEMPTS"
 
 REDIS_HOST = "REDIS_HOST"
 REDIS_PORT = "REDIS_PORT"
@@ -18,12 +38,117 @@ LANGFUSE_HOST = "LANGFUSE_HOST"
 
 LLM_NODE = "llm_node"
 TOOL_NODE = "tool_node"
+CONTEXT_NODE = "context_node"
+
+CONTEXT_ENABLED = "CONTEXT_ENABLED"
+CONTEXT_TOKEN_BUDGET = "CONTEXT_TOKEN_BUDGET"
+CONTEXT_MAX_TURNS = "CONTEXT_MAX_TURNS"
+CONTEXT_SUMMARY_THRESHOLD = "CONTEXT_SUMMARY_THRESHOLD"
 
 MCP_BASE_URL = "MCP_BASE_URL"
 MCP_ENDPOINT = "MCP_ENDPOINT"
+MCP_SERVERS = "MCP_SERVERS"
+MCP_TOOLS_TTL = "MCP_TOOLS_TTL"
+MCP_CONNECT_TIMEOUT = "MCP_CONNECT_TIMEOUT"
 
 POSTGRES_USER = "POSTGRES_USER"
 POSTGRES_PASSWORD = "POSTGRES_PASSWORD"
 POSTGRES_HOST = "POSTGRES_HOST"
 POSTGRES_PORT = "POSTGRES_PORT"
-POSTGRES_DB = "POSTGRES_DB"
\ No newline at end of file
+POSTGRES_DB = "POSTGRES_DB"
+POSTGRES_CONNECT_TIMEOUT = "POSTGRES_CONNECT_TIMEOUT"
+
+POSTGRES_POOL_MIN_SIZE = "POSTGRES_POOL_MIN_SIZE"
+POSTGRES_POOL_MAX_SIZE = "POSTGRES_POOL_MAX_SIZE"
+POSTGRES_POOL_TIMEOUT = "POSTGRES_POOL_TIMEOUT"
+POSTGRES_POOL_MAX_WAITING = "POSTGRES_POOL_MAX_WAITING"
+POSTGRES_POOL_MAX_IDLE = "POSTGRES_POOL_MAX_IDLE"
+POSTGRES_POOL_MAX_LIFETIME = "POSTGRES_POOL_MAX_LIFETIME"
+POSTGRES_POOL_RECONNECT_TIMEOUT = "POSTGRES_POOL_RECONNECT_TIMEOUT"
+POSTGRES_POOL_CHECK = "POSTGRES_POOL_CHECK"
+POSTGRES_POOL_OPEN_TIMEOUT = "POSTGRES_POOL_OPEN_TIMEOUT"
+POSTGRES_POOL_CLOSE_TIMEOUT = "POSTGRES_POOL_CLOSE_TIMEOUT"
+POSTGRES_POOL_WAITING_WARN_THRESHOLD = "POSTGRES_POOL_WAITING_WARN_THRESHOLD"
+POSTGRES_POOL_MONITOR_INTERVAL = "POSTGRES_POOL_MONITOR_INTERVAL"
+
+CHECKPOINT_BACKEND = "CHECKPOINT_BACKEND"
+CHECKPOINT_COMPRESSION = "CHECKPOINT_COMPRESSION"
+CHECKPOINT_COMPRESSION_THRESHOLD = "CHECKPOINT_COMPRESSION_THRESHOLD"
+CHECKPOINT_COMPRESSION_LEVEL = "CHECKPOINT_COMPRESSION_LEVEL"
+CHECKPOINT_SQLITE_PATH = "CHECKPOINT_SQLITE_PATH"
+CHECKPOINT_SQLITE_SYNCHRONOUS = "CHECKPOINT_SQLITE_SYNCHRONOUS"
+CHECKPOINT_MEMORY_SNAPSHOT_PATH = "CHECKPOINT_MEMORY_SNAPSHOT_PATH"
+CHECKPOINT_MEMORY_SNAPSHOT_INTERVAL = "CHECKPOINT_MEMORY_SNAPSHOT_INTERVAL"
+CHECKPOINT_WRITE_BEHIND = "CHECKPOINT_WRITE_BEHIND"
+CHECKPOINT_WRITE_BEHIND_MAX_PENDING = "CHECKPOINT_WRITE_BEHIND_MAX_PENDING"
+
+CHECKPOINT_RETENTION_ENABLED = "CHECKPOINT_RETENTION_ENABLED"
+CHECKPOINT_KEEP_LAST = "CHECKPOINT_KEEP_LAST"
+CHECKPOINT_IDLE_TTL = "CHECKPOINT_IDLE_TTL"
+CHECKPOINT_RETENTION_INTERVAL = "CHECKPOINT_RETENTION_INTERVAL"
+CHECKPOINT_RETENTION_BATCH_SIZE = "CHECKPOINT_RETENTION_BATCH_SIZE"
+
+SSE_COALESCE_MAX_LATENCY_MS = "SSE_COALESCE_MAX_LATENCY_MS"
+SSE_COALESCE_MAX_BYTES = "SSE_COALESCE_MAX_BYTES"
+SSE_HEARTBEAT_INTERVAL = "SSE_HEARTBEAT_INTERVAL"
+SSE_DISCONNECT_POLL_INTERVAL = "SSE_DISCONNECT_POLL_INTERVAL"
+
+SNAPSHOT_CACHE_MAX_ENTRIES = "SNAPSHOT_CACHE_MAX_ENTRIES"
+
+STREAM_RESUME_ENABLED = "STREAM_RESUME_ENABLED"
+STREAM_RESUME_TTL = "STREAM_RESUME_TTL"
+STREAM_RESUME_MAX_EVENTS = "STREAM_RESUME_MAX_EVENTS"
+STREAM_RESUME_MAX_MB = "STREAM_RESUME_MAX_MB"
+STREAM_RESUME_DETACH_TIMEOUT = "STREAM_RESUME_DETACH_TIMEOUT"
+STREAM_RESUME_SPILL = "STREAM_RESUME_SPILL"
+
+SEMANTIC_CACHE_ENABLED = "SEMANTIC_CACHE_ENABLED"
+SEMANTIC_CACHE_THRESHOLD = "SEMANTIC_CACHE_THRESHOLD"
+SEMANTIC_CACHE_MAX_ENTRIES = "SEMANTIC_CACHE_MAX_ENTRIES"
+SEMANTIC_CACHE_TTL = "SEMANTIC_CACHE_TTL"
+SEMANTIC_CACHE_PERSIST = "SEMANTIC_CACHE_PERSIST"
+
+TOOL_CACHE_ENABLED = "TOOL_CACHE_ENABLED"
+TOOL_CACHE_POLICIES = "TOOL_CACHE_POLICIES"
+
+TOOL_TIMEOUT = "TOOL_TIMEOUT"
+TOOL_MAX_CONCURRENCY = "TOOL_MAX_CONCURRENCY"
+TOOL_GLOBAL_MAX_CONCURRENCY = "TOOL_GLOBAL_MAX_CONCURRENCY"
+TOOL_THREAD_POOL_SIZE = "TOOL_THREAD_POOL_SIZE"
+TOOL_LIMITS = "TOOL_LIMITS"
+
+LOG_LEVEL = "LOG_LEVEL"
+LOG_PAYLOAD_SAMPLE_RATE = "LOG_PAYLOAD_SAMPLE_RATE"
+LOG_PAYLOAD_SAMPLE_RATES = "LOG_PAYLOAD_SAMPLE_RATES"
+LOG_SUMMARY_MAX_CHARS = "LOG_SUMMARY_MAX_CHARS"
+LOG_QUEUE_SIZE = "LOG_QUEUE_SIZE"
+
+TRACING_ENABLED = "TRACING_ENABLED"
+TRACING_SAMPLE_RATE = "TRACING_SAMPLE_RATE"
+TRACING_ROUTES = "TRACING_ROUTES"
+TRACING_DEBUG_HEADER = "TRACING_DEBUG_HEADER"
+TRACING_FLUSH_AT = "TRACING_FLUSH_AT"
+TRACING_FLUSH_INTERVAL = "TRACING_FLUSH_INTERVAL"
+
+ADMISSION_ENABLED = "ADMISSION_ENABLED"
+ADMISSION_MAX_CONCURRENCY = "ADMISSION_MAX_CONCURRENCY"
+ADMISSION_MAX_QUEUE = "ADMISSION_MAX_QUEUE"
+ADMISSION_QUEUE_TIMEOUT = "ADMISSION_QUEUE_TIMEOUT"
+ADMISSION_SESSION_MAX_PENDING = "ADMISSION_SESSION_MAX_PENDING"
+ADMISSION_SESSION_TIMEOUT = "ADMISSION_SESSION_TIMEOUT"
+ADMISSION_RETRY_AFTER = "ADMISSION_RETRY_AFTER"
+ADMISSION_DRAIN_TIMEOUT = "ADMISSION_DRAIN_TIMEOUT"
+
+BATCH_MAX_ITEMS = "BATCH_MAX_ITEMS"
+BATCH_MAX_CONCURRENCY = "BATCH_MAX_CONCURRENCY"
+
+SERVER_HOST = "SERVER_HOST"
+SERVER_PORT = "SERVER_PORT"
+SERVER_WORKERS = "SERVER_WORKERS"
+SERVER_LOOP = "SERVER_LOOP"
+SERVER_HTTP = "SERVER_HTTP"
+SERVER_GRACEFUL_TIMEOUT = "SERVER_GRACEFUL_TIMEOUT"
+SERVER_KEEP_ALIVE_TIMEOUT = "SERVER_KEEP_ALIVE_TIMEOUT"
+SERVER_BACKLOG = "SERVER_BACKLOG"
+SERVER_LOG_LEVEL = "SERVER_LOG_LEVEL"
+POSTGRES_MAX_CONNECTIONS = "POSTGRES_MAX_CONNECTIONS"
@@ -0,0 +1,179 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:25
+@Desc    : http_client.py 模型服务共享的异步HTTP客户端：连接池与keep-alive、分阶段超时、带抖动的指数退避重试
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from app.common.constants import (
+    LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE, LLM_HTTP_KEEPALIVE_EXPIRY, LLM_HTTP_CONNECT_TIMEOUT,
+    LLM_HTTP_READ_TIMEOUT, LLM_HTTP_WRITE_TIMEOUT, LLM_HTTP_POOL_TIMEOUT, LLM_HTTP_HTTP2, LLM_HTTP_MAX_RETRIES,
+    LLM_HTTP_BACKOFF_BASE, LLM_HTTP_BACKOFF_MAX, LLM_HTTP_RETRY_STATUSES
+)
+from app.common.metrics import Counter
+
+LLM_HTTP_REQUESTS = Counter(
+    "llm_http_requests_total",
+    "HTTP attempts sent to the model backend, by status and whether the connection was new or reused",
+    ("status", "connection"),
+)
+LLM_HTTP_RETRIES = Counter(
+    "llm_http_retries_total",
+    "HTTP attempts to the model backend that were retried, by status code or connect_error",
+    ("reason",),
+)
+
+
+@dataclass(frozen=True)
+class LlmHttpConfig:
+    """模型服务HTTP客户端配置，时间单位均为秒"""
+    # 连接池的最大连接数，以及保持空闲的最大连接数
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    # 空闲连接的保持时间，应小于服务端的keep-alive超时，避免复用已被服务端关闭的连接
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    # 两次读取之间的最长间隔，流式响应中即相邻两个chunk的间隔
+    read_timeout: float = 120.0
+    write_timeout: float = 30.0
+    # 从连接池获取连接的最长等待时间
+    pool_timeout: float = 30.0
+    # 需要安装 h2，未安装时退回HTTP/1.1
+    http2: bool = False
+    # 遇到 retry_statuses 中的状态码或连接失败时的最大重试次数
+    max_retries: int = 3
+    # 第n次重试前等待 [0, min(backoff_max, backoff_base * 2^n)] 内的随机时间
+    backoff_base: float = 0.5
+    backoff_max: float = 20.0
+    retry_statuses: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+
+    @classmethod
+    def from_config(cls) -> "LlmHttpConfig":
+        """
+        从.env文件读取模型服务HTTP客户端配置
+        """
+        statuses = os.getenv(LLM_HTTP_RETRY_STATUSES, "429,500,502,503,504")
+        return cls(
+            max_connections=int(os.getenv(LLM_HTTP_MAX_CONNECTIONS, "100")),
+            max_keepalive_connections=int(os.getenv(LLM_HTTP_MAX_KEEPALIVE, "20")),
+            keepalive_expiry=float(os.getenv(LLM_HTTP_KEEPALIVE_EXPIRY, "30")),
+            connect_timeout=float(os.getenv(LLM_HTTP_CONNECT_TIMEOUT, "5")),
+            read_timeout=float(os.getenv(LLM_HTTP_READ_TIMEOUT, "120")),
+            write_timeout=float(os.getenv(LLM_HTTP_WRITE_TIMEOUT, "30")),
+            pool_timeout=float(os.getenv(LLM_HTTP_POOL_TIMEOUT, "30")),
+            http2=os.getenv(LLM_HTTP_HTTP2, "false").lower() == "true",
+            max_retries=int(os.getenv(LLM_HTTP_MAX_RETRIES, "3")),
+            backoff_base=float(os.getenv(LLM_HTTP_BACKOFF_BASE, "0.5")),
+            backoff_max=float(os.getenv(LLM_HTTP_BACKOFF_MAX, "20")),
+            retry_statuses=frozenset(int(status) for status in statuses.split(",") if status.strip()),
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(connect=self.connect_timeout, read=self.read_timeout, write=self.write_timeout,
+                             pool=self.pool_timeout)
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def create_client(self) -> httpx.AsyncClient:
+        """
+        创建带重试的异步HTTP客户端，由调用方负责在退出时 aclose()
+        """
+        http2 = self.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logging.warning("未安装 h2，模型服务客户端使用HTTP/1.1")
+            http2 = False
+        transport = httpx.AsyncHTTPTransport(limits=self.limits(), http2=http2)
+        return httpx.AsyncClient(transport=RetryTransport(transport, self), timeout=self.timeout())
+
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """
+    解析 retry-after-ms 或 Retry-After（秒数或HTTP日期），无法解析时返回None
+    """
+    value = response.headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """
+    在连接层之上重试的传输层
+
+    - 响应状态码在 retry_statuses 中时关闭响应后重试，服务端给出 Retry-After 时按其等待，
+      要求的等待时间超过 backoff_max 时不再重试，直接返回该响应
+    - 建立连接失败（请求尚未发出）时重试；请求发出后的读超时和断开不重试，避免重复生成
+    - 每次尝试按状态码和连接是否新建计数，用于观察连接复用情况
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, config: LlmHttpConfig):
+        self._transport = transport
+        self._config = config
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self._config.backoff_max, self._config.backoff_base * 2 ** attempt))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # 读取请求体，保证重试时可以再次发送
+        await request.aread()
+        attempt = 0
+        while True:
+            connection = {"state": "reused"}
+
+            async def trace(event: str, _: dict) -> None:
+                if event == "connection.connect_tcp.complete":
+                    connection["state"] = "new"
+
+            request.extensions = {**request.extensions, "trace": trace}
+            try:
+                response = await self._transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                LLM_HTTP_REQUESTS.inc(status="connect_error", connection="new")
+                if attempt >= self._config.max_retries:
+                    raise
+                reason, delay, detail = "connect_error", self._backoff(attempt), repr(e)
+            else:
+                LLM_HTTP_REQUESTS.inc(status=str(response.status_code), connection=connection["state"])
+                if response.status_code not in self._config.retry_statuses or attempt >= self._config.max_retries:
+                    return response
+                retry_after = _retry_after_seconds(response)
+                if retry_after is not None and retry_after > self._config.backoff_max:
+                    return response
+                await response.aclose()
+                reason, detail = str(response.status_code), f"HTTP {response.status_code}"
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+            LLM_HTTP_RETRIES.inc(reason=reason)
+            logging.warning("模型服务请求失败（%s），%.2fs 后第 %d 次重试: %s %s",
+                            detail, delay, attempt + 1, request.method, request.url.path)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
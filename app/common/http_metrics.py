@@ -0,0 +1,71 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:13
+@Desc    : http_metrics.py 按路由统计请求数和耗时的ASGI中间件
+"""
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.common.metrics import Counter, Histogram
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by method, route template and status code",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template, until the response body is fully sent",
+    ("method", "route"),
+)
+
+# 没有匹配到路由的请求统一使用该标签，避免原始路径导致标签基数膨胀
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_label(scope: Scope) -> str:
+    """
+    请求的路由标签
+
+    匹配到不含路径参数的路由时使用实际路径（包含 include_router 的前缀），
+    含路径参数时使用路由模板，未匹配时使用 UNMATCHED_ROUTE
+    """
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return UNMATCHED_ROUTE
+    return path if "{" in path else scope.get("path", path)
+
+
+class HttpMetricsMiddleware:
+    """
+    纯ASGI中间件，不包装请求和响应对象，只在响应开始和结束时更新指标
+
+    路由标签见 route_label，流式响应的耗时截止到响应体发送完毕
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route_path = route_label(scope)
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method=method, route=route_path, status=status_code)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=method, route=route_path)
@@ -0,0 +1,258 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:13
+@Desc    : log.py 非阻塞日志、延迟格式化的状态摘要与按模块采样
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import reprlib
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional, TextIO
+
+from langchain_core.messages import BaseMessage
+from pydantic import BaseModel
+
+from app.common.constants import (
+    LOG_LEVEL, LOG_PAYLOAD_SAMPLE_RATE, LOG_PAYLOAD_SAMPLE_RATES, LOG_SUMMARY_MAX_CHARS, LOG_QUEUE_SIZE
+)
+from app.common.metrics import CallbackMetric, Sample
+
+LOG_FORMAT = "%(asctime)s - %(module)s - %(funcName)s - line:%(lineno)d - %(levelname)s - %(message)s"
+
+# 详细载荷日志的标记，例如 logging.info("state: %s", summarize(state), extra=PAYLOAD)
+PAYLOAD = {"payload": True}
+
+# 摘要的默认最大字符数，0 表示不截断（输出完整内容）
+_summary_max_chars = 500
+
+_repr = reprlib.Repr()
+_repr.maxstring = 200
+_repr.maxother = 200
+
+_listener: Optional[QueueListener] = None
+# 当前根日志处理器及其采样过滤器，用于导出丢弃计数
+_handler: Optional[logging.Handler] = None
+_sampler: Optional["PayloadSampler"] = None
+
+_exception_formatter = logging.Formatter()
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(共{len(text)}字符)"
+
+
+def _message_summary(message: BaseMessage, max_chars: int) -> str:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+    parts = [f"content={_truncate(content, max_chars)!r}"]
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        parts.append(f"tool_calls={[call['name'] for call in tool_calls]}")
+    return f"{message.type}({', '.join(parts)})"
+
+
+def _messages_summary(messages: list, max_chars: int) -> str:
+    if not messages:
+        return "messages=0"
+    return f"messages={len(messages)}, last={_message_summary(messages[-1], max_chars)}"
+
+
+def _summarize(value: Any, max_chars: int) -> str:
+    if max_chars <= 0:
+        return str(value)
+    if isinstance(value, BaseMessage):
+        return _message_summary(value, max_chars)
+    if isinstance(value, BaseModel) and isinstance(getattr(value, "messages", None), list):
+        fields = {name: getattr(value, name) for name in type(value).model_fields if name != "messages"}
+        extra = ", ".join(f"{name}={_repr.repr(field)}" for name, field in fields.items())
+        return f"{type(value).__name__}({_messages_summary(value.messages, max_chars)}, {extra})"
+    if isinstance(value, dict) and isinstance(value.get("messages"), list):
+        extra = ", ".join(f"{key}={_repr.repr(field)}" for key, field in value.items() if key != "messages")
+        return f"{{{_messages_summary(value['messages'], max_chars)}, {extra}}}"
+    values = getattr(value, "values", None)
+    if isinstance(values, dict) and hasattr(value, "next"):
+        # StateSnapshot
+        checkpoint_id = (getattr(value, "config", None) or {}).get("configurable", {}).get("checkpoint_id")
+        return (f"StateSnapshot(checkpoint_id={checkpoint_id}, next={tuple(value.next)}, "
+                f"{_messages_summary(values.get('messages') or [], max_chars)})")
+    if isinstance(value, str):
+        return _truncate(value, max_chars)
+    return _truncate(_repr.repr(value), max_chars)
+
+
+class _Summary:
+    """延迟计算的摘要，只有日志记录真正被输出时才会转换为字符串"""
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: Optional[int]):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        return _summarize(self.value, _summary_max_chars if self.max_chars is None else self.max_chars)
+
+    __repr__ = __str__
+
+
+def summarize(value: Any, max_chars: Optional[int] = None) -> _Summary:
+    """
+    生成用于日志参数的限长摘要，代替直接输出完整的状态或消息
+
+    状态和快照只输出消息数量和最后一条消息，消息内容按 max_chars 截断
+    :param value: 状态、快照、消息或任意对象
+    :param max_chars: 最大字符数，默认使用 LOG_SUMMARY_MAX_CHARS，0 表示不截断
+    :return: 延迟格式化的摘要对象
+    """
+    return _Summary(value, max_chars)
+
+
+class PayloadSampler(logging.Filter):
+    """
+    按模块对标记为 PAYLOAD 的详细日志采样，其他日志不受影响
+
+    被采样丢弃的记录不会被格式化，也不会进入日志队列，只计数
+    """
+
+    def __init__(self, default_rate: float = 1.0, rates: Optional[dict[str, float]] = None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "payload", False):
+            return True
+        rate = self.rates.get(record.module, self.default_rate)
+        if rate >= 1.0 or (rate > 0.0 and random.random() < rate):
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    有界队列的日志处理器，队列已满时丢弃记录并计数，不阻塞事件循环
+
+    标准库的 QueueHandler.prepare() 会在调用线程上格式化消息（包括 summarize() 的摘要），
+    这里直接把原始记录放入队列，消息由 QueueListener 的输出处理器在后台线程格式化；
+    只有异常堆栈在调用线程上提前渲染，避免记录在队列中持有 traceback 及其引用的栈帧
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not record.exc_info:
+            return record
+        record = copy.copy(record)
+        if not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: int | str = logging.INFO,
+                  stream: Optional[TextIO] = None,
+                  payload_sample_rate: float = 1.0,
+                  payload_sample_rates: Optional[dict[str, float]] = None,
+                  summary_max_chars: int = 500,
+                  queue_size: int = 10000,
+                  blocking: bool = False) -> Optional[QueueListener]:
+    """
+    配置根日志记录器：调用线程只把记录放入队列，格式化输出由后台线程完成
+    :param level: 日志级别
+    :param stream: 输出流，默认为 sys.stderr
+    :param payload_sample_rate: 详细载荷日志的默认采样率
+    :param payload_sample_rates: 按模块名配置的采样率，例如 {"node": 0.1}
+    :param summary_max_chars: 摘要的最大字符数，0 表示不截断
+    :param queue_size: 日志队列容量
+    :param blocking: 为True时在调用线程上直接输出，不使用队列（用于调试和基准对比）
+    :return: 后台日志监听器，blocking 为True时为None
+    """
+    global _listener, _summary_max_chars, _handler, _sampler
+    shutdown_logging()
+    _summary_max_chars = summary_max_chars
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler = output if blocking else DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    sampler = PayloadSampler(payload_sample_rate, payload_sample_rates)
+    handler.addFilter(sampler)
+    _handler, _sampler = handler, sampler
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    if blocking:
+        return None
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def setup_logging_from_config() -> Optional[QueueListener]:
+    """
+    从.env文件读取日志配置并初始化日志
+    """
+    return setup_logging(
+        level=os.getenv(LOG_LEVEL, "INFO").upper(),
+        payload_sample_rate=float(os.getenv(LOG_PAYLOAD_SAMPLE_RATE, "1.0")),
+        payload_sample_rates=json.loads(os.getenv(LOG_PAYLOAD_SAMPLE_RATES) or "{}"),
+        summary_max_chars=int(os.getenv(LOG_SUMMARY_MAX_CHARS, "500")),
+        queue_size=int(os.getenv(LOG_QUEUE_SIZE, "10000")),
+    )
+
+
+def shutdown_logging() -> None:
+    """
+    停止后台日志线程，并输出队列中剩余的记录
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> dict:
+    """
+    日志队列积压以及因队列已满、采样被丢弃的记录数
+    """
+    queue_handler = _handler if isinstance(_handler, DroppingQueueHandler) else None
+    return {
+        "queued": queue_handler.queue.qsize() if queue_handler is not None else 0,
+        "queue_size": queue_handler.queue.maxsize if queue_handler is not None else 0,
+        "dropped": queue_handler.dropped if queue_handler is not None else 0,
+        "sampled_out": _sampler.sampled_out if _sampler is not None else 0,
+    }
+
+
+def _dropped_records() -> list[Sample]:
+    stats = logging_stats()
+    return [({"reason": "queue_full"}, stats["dropped"]), ({"reason": "sampled"}, stats["sampled_out"])]
+
+
+atexit.register(shutdown_logging)
+
+# 计数由记录日志的线程直接累加，导出时读取
+CallbackMetric("log_records_dropped_total", "Log records dropped before output, by reason (queue_full, sampled)",
+               _dropped_records, metric_type="counter")
+CallbackMetric("log_queue_depth", "Log records waiting for the background output thread",
+               lambda: [({}, logging_stats()["queued"])])
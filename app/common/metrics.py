@@ -0,0 +1,239 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:13
+@Desc    : metrics.py 进程内指标与Prometheus文本格式导出
+
+所有指标只在事件循环线程中更新，不加锁；导出时遍历当前值生成文本
+"""
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+# 默认的耗时直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Sample = tuple[dict[str, str], float]
+
+
+class _Metric:
+    """指标基类，创建时自动注册到 REGISTRY"""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def expose(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    单调递增计数器
+
+    按标签值元组分别计数，只在事件循环线程中更新，无需加锁
+    """
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list[Sample]:
+        return [(dict(zip(self.label_names, key)), value) for key, value in self._values.items()]
+
+    def expose(self) -> Iterator[str]:
+        for labels, value in self.samples():
+            yield _sample_line(self.name, labels, value)
+
+
+class Gauge(Counter):
+    """可增可减、可直接设置的瞬时值"""
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class CallbackMetric(_Metric):
+    """
+    导出时才通过回调读取当前值的指标，适合连接池状态等由其他组件维护的数据
+    """
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 callback: Callable[[], Iterable[Sample]],
+                 metric_type: str = "gauge"):
+        super().__init__(name, documentation)
+        self.metric_type = metric_type
+        self._callback = callback
+
+    def expose(self) -> Iterator[str]:
+        for labels, value in self._callback():
+            yield _sample_line(self.name, labels, value)
+
+
+class Histogram(_Metric):
+    """
+    分桶直方图
+
+    每个标签组合维护各桶的非累计计数、总和与次数，导出时再转换为累计计数
+    """
+    metric_type = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值元组 -> [各桶计数..., +Inf桶计数, 总和, 次数]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = [0.0] * (len(self.buckets) + 3)
+            self._values[key] = state
+        state[bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        记录代码块的耗时（秒）
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> float:
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0.0
+
+    def sum(self, **labels: str) -> float:
+        state = self._values.get(self._key(labels))
+        return state[-2] if state else 0.0
+
+    def expose(self) -> Iterator[str]:
+        for key, state in self._values.items():
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                yield _sample_line(f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative)
+            yield _sample_line(f"{self.name}_sum", labels, state[-2])
+            yield _sample_line(f"{self.name}_count", labels, state[-1])
+
+
+class MetricsRegistry:
+    """进程内指标注册表"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已注册")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> _Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """
+        以Prometheus文本格式导出全部指标
+        """
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _sample_line(name: str, labels: dict[str, str], value: float) -> str:
+    if labels:
+        rendered = ",".join(f'{key}="{_escape_label(str(val))}"' for key, val in labels.items())
+        return f"{name}{{{rendered}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+REGISTRY = MetricsRegistry()
+
+# 流式请求因客户端断开而中止的次数，stage 表示中止时图执行所处的阶段
+STREAM_ABORTS = Counter(
+    "chat_stream_aborts_total",
+    "Streaming chat runs cancelled because the client disconnected",
+    ("stage",),
+)
+
+# 流式请求从开始执行图到输出第一个token的耗时
+STREAM_TTFT = Histogram(
+    "chat_stream_time_to_first_token_seconds",
+    "Time from the start of a streaming graph run to the first model token",
+)
+# 流式请求中模型输出token的速率，从第一个token开始计算
+STREAM_TOKENS_PER_SECOND = Histogram(
+    "chat_stream_tokens_per_second",
+    "Model output rate of a streaming run, measured from the first token",
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500),
+)
+STREAM_TOKENS = Counter(
+    "chat_stream_tokens_total",
+    "Model output chunks sent on the chat stream",
+)
+
+# 批量聊天的条目数，mode 为 graph（经过图）或 model（直接调用模型的批量接口）
+BATCH_ITEMS = Counter(
+    "chat_batch_items_total",
+    "Batch chat items processed, by execution mode and outcome",
+    ("mode", "status"),
+)
+
+
+def render_metrics() -> str:
+    """
+    以Prometheus文本格式导出进程内全部指标
+    """
+    return REGISTRY.render()
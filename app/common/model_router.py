@@ -0,0 +1,434 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:26
+@Desc    : model_router.py 多个模型后端之间的路由：按权重和在途请求数选择后端、并发上限、熔断与首token前的故障转移
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Optional, Sequence
+
+import openai
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from pydantic import ConfigDict, PrivateAttr
+
+from app.common.constants import (
+    MODEL_BACKENDS, MODEL_ROUTER_FAILURE_THRESHOLD, MODEL_ROUTER_OPEN_SECONDS, MODEL_ROUTER_ACQUIRE_TIMEOUT,
+    MODEL_ROUTER_MAX_ATTEMPTS
+)
+from app.common.metrics import CallbackMetric, Counter, Histogram, Sample
+
+MODEL_BACKEND_REQUESTS = Counter(
+    "model_backend_requests_total",
+    "Model calls routed to each backend, by outcome (ok, error, failover, client_error)",
+    ("backend", "outcome"),
+)
+MODEL_BACKEND_LATENCY = Histogram(
+    "model_backend_request_seconds",
+    "Duration of successful model calls, by backend",
+    ("backend",),
+)
+MODEL_BACKEND_TTFT = Histogram(
+    "model_backend_time_to_first_token_seconds",
+    "Time to the first streamed chunk, by backend",
+    ("backend",),
+)
+
+# 同步调用等待空闲名额时的轮询间隔
+_SYNC_POLL_INTERVAL = 0.05
+
+
+class NoBackendAvailable(Exception):
+    """没有可用的模型后端：全部熔断，或在等待时间内没有空闲的并发名额"""
+
+
+class CircuitState(str, Enum):
+    """熔断器状态"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class ModelBackendConfig:
+    """一个OpenAI兼容的模型后端"""
+    name: str
+    base_url: str
+    model: str
+    api_key: Optional[str] = None
+    # 相对权重，空闲时优先选择权重高的后端，负载按权重比例分配
+    weight: float = 1.0
+    # 同时在途的请求数上限
+    max_concurrency: int = 16
+
+
+@dataclass(frozen=True)
+class ModelRouterConfig:
+    """模型路由配置，时间单位均为秒"""
+    backends: tuple[ModelBackendConfig, ...] = ()
+    # 连续失败该次数后熔断
+    failure_threshold: int = 3
+    # 熔断后经过该时间放行一个探测请求，成功则恢复
+    open_seconds: float = 30.0
+    # 全部后端达到并发上限时等待空闲名额的最长时间
+    acquire_timeout: float = 30.0
+    # 一次调用最多尝试的后端数，0 表示全部后端
+    max_attempts: int = 0
+
+    @classmethod
+    def from_config(cls) -> "ModelRouterConfig":
+        """
+        从.env文件读取模型路由配置，MODEL_BACKENDS 为JSON数组，每项包含 name、base_url、model，
+        可选 api_key、weight、max_concurrency
+        """
+        backends = tuple(ModelBackendConfig(**item) for item in json.loads(os.getenv(MODEL_BACKENDS) or "[]"))
+        if len({backend.name for backend in backends}) != len(backends):
+            raise ValueError("MODEL_BACKENDS 中的后端名称重复")
+        return cls(
+            backends=backends,
+            failure_threshold=int(os.getenv(MODEL_ROUTER_FAILURE_THRESHOLD, "3")),
+            open_seconds=float(os.getenv(MODEL_ROUTER_OPEN_SECONDS, "30")),
+            acquire_timeout=float(os.getenv(MODEL_ROUTER_ACQUIRE_TIMEOUT, "30")),
+            max_attempts=int(os.getenv(MODEL_ROUTER_MAX_ATTEMPTS, "0")),
+        )
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    是否为后端自身的故障：连接失败、超时、429 和 5xx；其余错误（如400参数错误）换后端也不会成功
+    """
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+
+class ModelBackend:
+    """模型后端的运行状态：在途请求数与熔断器"""
+
+    def __init__(self, config: ModelBackendConfig, model: BaseChatModel, failure_threshold: int, open_seconds: float):
+        self.config = config
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.outstanding = 0
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def admits(self, now: float) -> bool:
+        """
+        熔断器是否允许发送请求：关闭时允许；打开超过 open_seconds 后允许一个探测请求
+        """
+        if self.state == CircuitState.CLOSED:
+            return True
+        return not self.probing and now - self.opened_at >= self.open_seconds
+
+    def has_capacity(self) -> bool:
+        return self.outstanding < self.config.max_concurrency
+
+    def score(self) -> float:
+        return (self.outstanding + 1) / self.config.weight
+
+    def acquire(self) -> None:
+        if self.state != CircuitState.CLOSED:
+            self.state = CircuitState.HALF_OPEN
+            self.probing = True
+        self.outstanding += 1
+        self.requests += 1
+
+    def release(self) -> None:
+        self.outstanding -= 1
+        self.probing = False
+
+    def record_success(self) -> None:
+        if self.state != CircuitState.CLOSED:
+            logging.info("模型后端 %s 探测成功，恢复使用", self.name)
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self, error: BaseException) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                logging.warning("模型后端 %s 连续失败 %d 次，熔断 %.0fs: %r",
+                                self.name, self.consecutive_failures, self.open_seconds, error)
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.config.base_url,
+            "model": self.config.model,
+            "weight": self.config.weight,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.config.max_concurrency,
+            "state": self.state.value,
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ModelRouter(BaseChatModel):
+    """
+    在多个模型后端之间路由的聊天模型
+
+    - 选择 (在途请求数 + 1) / 权重 最小的后端，分值相同时随机选择；达到并发上限的后端不参与选择，
+      全部达到上限时等待空闲名额
+    - 连续失败 failure_threshold 次的后端被熔断，open_seconds 后放行一个请求作为探测，成功则恢复
+    - 后端故障（连接失败、超时、429、5xx）且尚未输出任何token时，换一个后端重试；已输出token后直接抛出
+    - 绑定工具时使用第一个后端的 bind_tools 生成请求参数，各后端需兼容同一套工具调用格式
+    - 同步调用（invoke、batch）使用相同的选择、熔断和故障转移逻辑，等待空闲名额时轮询
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backends: list[ModelBackend]
+    acquire_timeout: float = 30.0
+    max_attempts: int = 0
+
+    _available: asyncio.Condition = PrivateAttr(default_factory=asyncio.Condition)
+    # 同步调用可能来自其他线程，选择和占用后端需要加锁
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def from_config(cls,
+                    config: ModelRouterConfig,
+                    model_factory: Callable[[ModelBackendConfig], BaseChatModel]) -> "ModelRouter":
+        """
+        按路由配置创建路由模型
+        :param config: 路由配置
+        :param model_factory: 为每个后端创建聊天模型
+        """
+        if not config.backends:
+            raise ValueError("模型路由至少需要一个后端")
+        backends = [ModelBackend(backend, model_factory(backend), config.failure_threshold, config.open_seconds)
+                    for backend in config.backends]
+        return cls(backends=backends, acquire_timeout=config.acquire_timeout, max_attempts=config.max_attempts)
+
+    @property
+    def _llm_type(self) -> str:
+        return "model-router"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"backends": [backend.name for backend in self.backends]}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> Runnable:
+        bound = self.backends[0].model.bind_tools(tools, **kwargs)
+        return self.bind(**bound.kwargs)
+
+    def _select(self, tried: set[str]) -> Optional[ModelBackend]:
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends
+                      if backend.name not in tried and backend.admits(now) and backend.has_capacity()]
+        if not candidates:
+            return None
+        best = min(backend.score() for backend in candidates)
+        return random.choice([backend for backend in candidates if backend.score() == best])
+
+    def _try_acquire(self, tried: set[str]) -> Optional[ModelBackend]:
+        with self._lock:
+            backend = self._select(tried)
+            if backend is not None:
+                backend.acquire()
+            return backend
+
+    def _wait_timeout(self, tried: set[str], deadline: float) -> float:
+        """
+        没有可选后端时本次最多等待的时间
+        :raises NoBackendAvailable: 其余后端均已熔断，或等待超时
+        """
+        now = time.monotonic()
+        remaining = [backend for backend in self.backends if backend.name not in tried]
+        if not any(backend.admits(now) for backend in remaining):
+            raise NoBackendAvailable("没有可用的模型后端：其余后端均已熔断")
+        # 熔断中的后端到期后也需要被重新选择，因此最多等待1秒后重新检查
+        timeout = min(deadline - now, 1.0)
+        if timeout <= 0:
+            raise NoBackendAvailable(f"等待模型后端空闲名额超时（{self.acquire_timeout:g}s）")
+        return timeout
+
+    async def _acquire(self, tried: set[str]) -> ModelBackend:
+        """
+        选择并占用一个后端，全部后端达到并发上限时等待
+        :raises NoBackendAvailable: 其余后端均已熔断，或等待超时
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        async with self._available:
+            while True:
+                backend = self._try_acquire(tried)
+                if backend is not None:
+                    return backend
+                try:
+                    await asyncio.wait_for(self._available.wait(), self._wait_timeout(tried, deadline))
+                except asyncio.TimeoutError:
+                    pass
+
+    def _acquire_sync(self, tried: set[str]) -> ModelBackend:
+        """
+        同步调用选择并占用一个后端，全部后端达到并发上限时轮询等待
+        :raises NoBackendAvailable: 其余后端均已熔断，或等待超时
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            backend = self._try_acquire(tried)
+            if backend is not None:
+                return backend
+            time.sleep(min(self._wait_timeout(tried, deadline), _SYNC_POLL_INTERVAL))
+
+    def _release_sync(self, backend: ModelBackend) -> None:
+        with self._lock:
+            backend.release()
+
+    async def _release(self, backend: ModelBackend) -> None:
+        self._release_sync(backend)
+        async with self._available:
+            self._available.notify()
+
+    def _should_failover(self, backend: ModelBackend, error: BaseException, tried: set[str]) -> bool:
+        if not is_backend_failure(error):
+            MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="client_error")
+            return False
+        backend.record_failure(error)
+        attempts = self.max_attempts or len(self.backends)
+        if len(tried) >= min(attempts, len(self.backends)):
+            MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="error")
+            return False
+        MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="failover")
+        logging.warning("模型后端 %s 调用失败，切换到其他后端: %r", backend.name, error)
+        return True
+
+    async def _agenerate(self,
+                         messages: list[BaseMessage],
+                         stop: Optional[list[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        tried: set[str] = set()
+        while True:
+            backend = await self._acquire(tried)
+            tried.add(backend.name)
+            start = time.perf_counter()
+            try:
+                result = await backend.model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                if self._should_failover(backend, e, tried):
+                    continue
+                raise
+            finally:
+                await self._release(backend)
+            backend.record_success()
+            MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="ok")
+            MODEL_BACKEND_LATENCY.observe(time.perf_counter() - start, backend=backend.name)
+            return result
+
+    async def _astream(self,
+                       messages: list[BaseMessage],
+                       stop: Optional[list[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tried: set[str] = set()
+        while True:
+            backend = await self._acquire(tried)
+            tried.add(backend.name)
+            start = time.perf_counter()
+            streamed = False
+            try:
+                async for chunk in backend.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    if not streamed:
+                        streamed = True
+                        MODEL_BACKEND_TTFT.observe(time.perf_counter() - start, backend=backend.name)
+                    yield chunk
+            except Exception as e:
+                if not streamed and self._should_failover(backend, e, tried):
+                    continue
+                if streamed and is_backend_failure(e):
+                    backend.record_failure(e)
+                    MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="error")
+                raise
+            finally:
+                await self._release(backend)
+            backend.record_success()
+            MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="ok")
+            MODEL_BACKEND_LATENCY.observe(time.perf_counter() - start, backend=backend.name)
+            return
+
+    def _generate(self,
+                  messages: list[BaseMessage],
+                  stop: Optional[list[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        tried: set[str] = set()
+        while True:
+            backend = self._acquire_sync(tried)
+            tried.add(backend.name)
+            start = time.perf_counter()
+            try:
+                result = backend.model._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                if self._should_failover(backend, e, tried):
+                    continue
+                raise
+            finally:
+                self._release_sync(backend)
+            backend.record_success()
+            MODEL_BACKEND_REQUESTS.inc(backend=backend.name, outcome="ok")
+            MODEL_BACKEND_LATENCY.observe(time.perf_counter() - start, backend=backend.name)
+            return result
+
+    def stats(self) -> dict:
+        """
+        各后端的在途请求数、熔断状态和累计请求数
+        """
+        return {backend.name: backend.stats() for backend in self.backends}
+
+
+# 当前进程使用的路由模型，由 create_model_from_config 在配置了多个后端时设置，用于导出指标
+_active_router: Optional[ModelRouter] = None
+
+
+def set_active_router(router: Optional[ModelRouter]) -> None:
+    global _active_router
+    _active_router = router
+
+
+def active_router_stats() -> Optional[dict]:
+    """
+    当前路由模型的后端状态，未启用模型路由时为None
+    """
+    return _active_router.stats() if _active_router is not None else None
+
+
+def _backend_stat(key: Callable[[ModelBackend], float]) -> Callable[[], list[Sample]]:
+    def collect() -> list[Sample]:
+        if _active_router is None:
+            return []
+        return [({"backend": backend.name}, key(backend)) for backend in _active_router.backends]
+
+    return collect
+
+
+CallbackMetric("model_backend_outstanding_requests", "Model calls currently in flight, by backend",
+               _backend_stat(lambda backend: backend.outstanding))
+CallbackMetric("model_backend_circuit_open", "1 when the backend's circuit breaker is open or half-open",
+               _backend_stat(lambda backend: 0 if backend.state == CircuitState.CLOSED else 1))
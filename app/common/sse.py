@@ -0,0 +1,229 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:13
+@Desc    : sse.py Server-Sent Events 编码与token合并
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from app.common.constants import (
+    SSE_COALESCE_MAX_LATENCY_MS, SSE_COALESCE_MAX_BYTES, SSE_HEARTBEAT_INTERVAL, SSE_DISCONNECT_POLL_INTERVAL
+)
+
+# 事件类型
+EVENT_TOKEN = "token"
+EVENT_TOOL_CALL = "tool_call"
+EVENT_TOOL_RESULT = "tool_result"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+# 续传时部分事件已被淘汰，无法重放
+EVENT_REPLAY_GAP = "replay_gap"
+
+# 心跳为SSE注释行，客户端会忽略，仅用于保持连接和穿透代理的空闲超时
+HEARTBEAT = ": ping\n\n"
+
+# 定时器可能略早于截止时间唤醒
+_TIMER_TOLERANCE = 0.001
+
+# 上游事件队列容量，上游比下游快时形成背压
+_QUEUE_SIZE = 256
+
+# 上游结束标记
+_END = object()
+
+# 正在执行清理的上游任务，保留强引用防止被回收
+_pending_producers: set[asyncio.Task] = set()
+
+
+@dataclass
+class SseEvent:
+    """单个SSE事件，data 会被编码为JSON"""
+    event: str
+    data: Any
+    id: Optional[int] = None
+
+    def encode(self) -> str:
+        lines = []
+        if self.id is not None:
+            lines.append(f"id: {self.id}")
+        lines.append(f"event: {self.event}")
+        lines.append(f"data: {json.dumps(self.data, ensure_ascii=False, default=str)}")
+        return "\n".join(lines) + "\n\n"
+
+
+@dataclass
+class SseStreamConfig:
+    """SSE流配置"""
+    # token在缓冲区中停留的最长时间，超过后立即发送
+    max_latency: float = 0.05
+    # 缓冲区达到该字节数后立即发送
+    max_bytes: int = 1024
+    # 连续多长时间没有输出时发送一次心跳，0 表示不发送
+    heartbeat_interval: float = 15.0
+    # 检查客户端是否断开的间隔
+    disconnect_poll_interval: float = 0.5
+
+    @classmethod
+    def from_config(cls) -> "SseStreamConfig":
+        """
+        从.env文件读取SSE流配置
+        """
+        return cls(
+            max_latency=float(os.getenv(SSE_COALESCE_MAX_LATENCY_MS, "50")) / 1000,
+            max_bytes=int(os.getenv(SSE_COALESCE_MAX_BYTES, "1024")),
+            heartbeat_interval=float(os.getenv(SSE_HEARTBEAT_INTERVAL, "15")),
+            disconnect_poll_interval=float(os.getenv(SSE_DISCONNECT_POLL_INTERVAL, "0.5")),
+        )
+
+
+class SseEncoder:
+    """
+    把上游事件编码为SSE帧
+
+    连续的token事件会被合并：缓冲区中最早的token停留超过 max_latency，或缓冲区达到 max_bytes 时
+    才作为一个事件发送；其他类型的事件会先冲刷缓冲区再发送，保证顺序。
+    长时间没有输出时发送心跳注释；提供断开检测函数时，客户端断开后立即停止并取消上游。
+    提供 on_event 时，每个编码后的事件（不含心跳）连同事件ID一起交给该回调，用于保存可重放的事件。
+    """
+
+    def __init__(self,
+                 config: Optional[SseStreamConfig] = None,
+                 start_id: int = 0,
+                 on_event: Optional[Callable[[int, str], None]] = None):
+        self._config = config or SseStreamConfig.from_config()
+        self._next_id = start_id
+        self._on_event = on_event
+        self._buffer: list[str] = []
+        self._buffer_bytes = 0
+        self._buffer_since: Optional[float] = None
+        self.events_sent = 0
+        self.tokens_received = 0
+        self.disconnected = False
+
+    def _event(self, event: str, data: Any) -> str:
+        self._next_id += 1
+        self.events_sent += 1
+        frame = SseEvent(event=event, data=data, id=self._next_id).encode()
+        if self._on_event is not None:
+            self._on_event(self._next_id, frame)
+        return frame
+
+    def _flush(self) -> Optional[str]:
+        if not self._buffer:
+            return None
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffer_bytes = 0
+        self._buffer_since = None
+        return self._event(EVENT_TOKEN, {"content": text})
+
+    def _flush_deadline(self) -> Optional[float]:
+        if self._buffer_since is None:
+            return None
+        return self._buffer_since + self._config.max_latency
+
+    def _accept(self, item: SseEvent) -> list[str]:
+        if item.event != EVENT_TOKEN:
+            return [frame for frame in (self._flush(), self._event(item.event, item.data)) if frame]
+        text = item.data
+        if not text:
+            return []
+        self.tokens_received += 1
+        self._buffer.append(text)
+        self._buffer_bytes += len(text.encode("utf-8"))
+        if self._buffer_since is None:
+            self._buffer_since = time.monotonic()
+        if self._buffer_bytes >= self._config.max_bytes or self._config.max_latency <= 0:
+            return [self._flush()]
+        return []
+
+    def _next_timeout(self, last_output: float, next_poll: Optional[float]) -> Optional[float]:
+        deadlines = [deadline for deadline in (
+            self._flush_deadline(),
+            last_output + self._config.heartbeat_interval if self._config.heartbeat_interval > 0 else None,
+            next_poll,
+        ) if deadline is not None]
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    @staticmethod
+    async def _produce(source: AsyncIterator[SseEvent], queue: asyncio.Queue) -> None:
+        try:
+            async with aclosing(source) as events:
+                async for item in events:
+                    await queue.put(item)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    async def stream(self,
+                     source: AsyncIterator[SseEvent],
+                     is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator[str]:
+        """
+        消费上游事件并输出编码后的SSE帧
+
+        上游由独立任务读取并放入有界队列；每次唤醒时取出队列中全部已就绪的事件，合并为一次写入。
+        token事件的 data 为字符串片段，其他事件的 data 为任意可JSON序列化的对象。
+        输出端被关闭或检测到客户端断开时会取消上游任务。
+        :param source: 上游事件
+        :param is_disconnected: 客户端断开检测函数，例如 Request.is_disconnected
+        :return: SSE帧
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+        producer = asyncio.create_task(self._produce(source, queue))
+        last_output = time.monotonic()
+        poll_interval = self._config.disconnect_poll_interval
+        next_poll = last_output + poll_interval if is_disconnected is not None else None
+        finished = False
+        try:
+            while not finished:
+                frames: list[str] = []
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    try:
+                        item = await asyncio.wait_for(queue.get(),
+                                                      timeout=self._next_timeout(last_output, next_poll))
+                    except asyncio.TimeoutError:
+                        item = None
+                if next_poll is not None and time.monotonic() >= next_poll - _TIMER_TOLERANCE:
+                    if await is_disconnected():
+                        self.disconnected = True
+                        return
+                    next_poll = time.monotonic() + poll_interval
+                while item is not None:
+                    if item is _END:
+                        finished = True
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    frames.extend(self._accept(item))
+                    try:
+                        item = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        item = None
+                now = time.monotonic()
+                deadline = self._flush_deadline()
+                if finished or (deadline is not None and now >= deadline - _TIMER_TOLERANCE):
+                    tail = self._flush()
+                    if tail:
+                        frames.append(tail)
+                if frames:
+                    last_output = now
+                    yield "".join(frames)
+                elif (self._config.heartbeat_interval > 0
+                      and now - last_output >= self._config.heartbeat_interval - _TIMER_TOLERANCE):
+                    last_output = now
+                    yield HEARTBEAT
+        finally:
+            if not producer.done():
+                producer.cancel()
+                # 使用 wait 而非 gather：外层再次被取消时不会打断上游的清理逻辑
+                _pending_producers.add(producer)
+                producer.add_done_callback(_pending_producers.discard)
+                await asyncio.wait({producer})
@@ -0,0 +1,190 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:19
+@Desc    : tracing.py Langfuse链路追踪：按路由开关、请求入口采样、调试请求头强制追踪
+"""
+import contextvars
+import logging
+import os
+import random
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, Mapping, Optional
+
+from app.common.constants import (
+    TRACING_ENABLED, TRACING_SAMPLE_RATE, TRACING_ROUTES, TRACING_DEBUG_HEADER, TRACING_FLUSH_AT,
+    TRACING_FLUSH_INTERVAL, LANGFUSE_SECRET_KEY, LANGFUSE_PUBLIC_KEY
+)
+from app.common.metrics import Counter
+
+TRACING_DECISIONS = Counter(
+    "tracing_decisions_total",
+    "Head-based tracing decisions by route (sampled, forced, dropped, disabled)",
+    ("route", "decision"),
+)
+
+_TRUTHY = {"1", "true", "yes", "on"}
+
+# 当前请求的图执行回调，未被采样的请求为空列表
+_callbacks: contextvars.ContextVar[list] = contextvars.ContextVar("tracing_callbacks", default=[])
+
+
+@dataclass(frozen=True)
+class TracingConfig:
+    """链路追踪配置"""
+    enabled: bool = True
+    # 请求入口的采样率，0 表示只追踪带调试请求头的请求
+    sample_rate: float = 1.0
+    # 允许追踪的路由名，None 表示全部路由
+    routes: Optional[frozenset[str]] = None
+    # 带有该请求头（值为 1/true/yes/on）的请求总是被追踪
+    debug_header: str = "X-Trace-Debug"
+    # 后台导出线程每批导出的span数量和导出间隔（秒），导出不在请求路径上执行
+    flush_at: int = 512
+    flush_interval: float = 5.0
+
+    @classmethod
+    def from_config(cls) -> "TracingConfig":
+        """
+        从.env文件读取链路追踪配置
+        """
+        routes = os.getenv(TRACING_ROUTES, "").strip()
+        return cls(
+            enabled=os.getenv(TRACING_ENABLED, "true").lower() in _TRUTHY,
+            sample_rate=float(os.getenv(TRACING_SAMPLE_RATE, "1.0")),
+            routes=frozenset(r.strip() for r in routes.split(",") if r.strip()) if routes else None,
+            debug_header=os.getenv(TRACING_DEBUG_HEADER, "X-Trace-Debug"),
+            flush_at=int(os.getenv(TRACING_FLUSH_AT, "512")),
+            flush_interval=float(os.getenv(TRACING_FLUSH_INTERVAL, "5")),
+        )
+
+
+class Tracing:
+    """
+    Langfuse链路追踪
+
+    Langfuse客户端和LangChain回调在 start() 时才创建，缺少密钥或未启用时整体关闭，导入本模块没有副作用。
+    每个请求在入口处做一次采样决定（head-based）：未被采样的请求不挂载回调、不创建span，
+    开销只有一次随机数判断；被采样的请求在 trace_request() 范围内通过 callbacks() 取得回调。
+    """
+
+    def __init__(self, config: Optional[TracingConfig] = None):
+        self.config = config or TracingConfig()
+        self._client = None
+        self._handler = None
+
+    @property
+    def active(self) -> bool:
+        return self._handler is not None
+
+    def start(self, client: Any = None) -> None:
+        """
+        创建Langfuse客户端和回调处理器
+        :param client: 已创建的Langfuse客户端（进程内唯一的客户端），为None时从.env文件创建
+        """
+        if self.active:
+            return
+        if not self.config.enabled:
+            logging.info("链路追踪未启用")
+            return
+        public_key = None
+        if client is None:
+            public_key = os.getenv(LANGFUSE_PUBLIC_KEY)
+            if not public_key or not os.getenv(LANGFUSE_SECRET_KEY):
+                logging.warning("未配置Langfuse密钥，链路追踪已关闭")
+                return
+            from app.config import create_langfuse_from_config
+            client = create_langfuse_from_config(flush_at=self.config.flush_at,
+                                                 flush_interval=self.config.flush_interval)
+        from langfuse.langchain import CallbackHandler
+        self._client = client
+        self._handler = CallbackHandler(public_key=public_key)
+        logging.info("链路追踪已启用，采样率: %s，路由: %s", self.config.sample_rate,
+                     ",".join(sorted(self.config.routes)) if self.config.routes is not None else "全部")
+
+    def stop(self) -> None:
+        """
+        导出剩余的span并关闭客户端
+        """
+        client, self._client, self._handler = self._client, None, None
+        if client is not None:
+            try:
+                client.shutdown()
+            except Exception as e:
+                logging.warning("关闭Langfuse客户端失败: %r", e)
+            # 丢弃已关闭的客户端，运行时重新启动时 start() 重新创建
+            from app.config import create_langfuse_from_config
+            create_langfuse_from_config.cache_clear()
+
+    def _decide(self, route: str, headers: Optional[Mapping[str, str]]) -> str:
+        if not self.active or (self.config.routes is not None and route not in self.config.routes):
+            return "disabled"
+        if headers is not None and headers.get(self.config.debug_header, "").lower() in _TRUTHY:
+            return "forced"
+        rate = self.config.sample_rate
+        if rate >= 1.0 or (rate > 0.0 and random.random() < rate):
+            return "sampled"
+        return "dropped"
+
+    @contextmanager
+    def trace_request(self,
+                      route: str,
+                      headers: Optional[Mapping[str, str]] = None,
+                      user_id: Optional[str] = None,
+                      session_id: Optional[str] = None,
+                      root_span: bool = False) -> Iterator[bool]:
+        """
+        在请求入口做采样决定，被采样时在该范围内挂载回调并传播用户和会话属性
+        :param route: 路由名，与 TRACING_ROUTES 中的名称对应
+        :param headers: 请求头，用于识别调试请求头
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        :param root_span: 为True时以路由名创建根span，图执行的span作为其子节点
+        :return: 是否被追踪
+        """
+        decision = self._decide(route, headers)
+        TRACING_DECISIONS.inc(route=route, decision=decision)
+        if decision in ("disabled", "dropped"):
+            token = _callbacks.set([])
+            try:
+                yield False
+            finally:
+                _callbacks.reset(token)
+            return
+
+        from langfuse import propagate_attributes
+        with ExitStack() as stack:
+            if root_span:
+                stack.enter_context(self._client.start_as_current_observation(name=route))
+            stack.enter_context(propagate_attributes(user_id=user_id, session_id=session_id))
+            token = _callbacks.set([self._handler])
+            try:
+                yield True
+            finally:
+                _callbacks.reset(token)
+
+    @staticmethod
+    def callbacks() -> list:
+        """
+        当前请求的图执行回调，需要在 trace_request() 范围内读取；未被采样或不在请求范围内时为空列表
+        """
+        return list(_callbacks.get())
+
+    def stats(self) -> dict:
+        """
+        采样配置与各路由的采样结果计数
+        """
+        decisions: dict[str, dict[str, float]] = {}
+        for labels, value in TRACING_DECISIONS.samples():
+            decisions.setdefault(labels["route"], {})[labels["decision"]] = value
+        return {
+            "active": self.active,
+            "sample_rate": self.config.sample_rate,
+            "routes": sorted(self.config.routes) if self.config.routes is not None else None,
+            "decisions": decisions,
+        }
+
+
+# 进程级单例，由 AgentRuntime 负责启动与停止
+tracing = Tracing(TracingConfig.from_config())
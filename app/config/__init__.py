@@ -1,11 +1,17 @@
 from app.config.common_config import (
+    create_llm_http_client_from_config,
+    create_router_http_client_from_config,
     create_model_from_config,
+    create_embeddings_from_config,
     create_postgres_pool_from_config,
     create_langfuse_from_config
 )
 
 __all__ = [
+    "create_llm_http_client_from_config",
+    "create_router_http_client_from_config",
     "create_model_from_config",
+    "create_embeddings_from_config",
     "create_postgres_pool_from_config",
     "create_langfuse_from_config"
 ]
@@ -5,14 +5,21 @@
 @Desc    : common_config.py
 """
 import os
+from dataclasses import replace
 from functools import lru_cache
+from typing import Optional
 
+import httpx
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from langchain_core.language_models import BaseChatModel
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langfuse import Langfuse
 from psycopg_pool import AsyncConnectionPool
 from pydantic import SecretStr
 
+from app.checkpoint.pool import PostgresPoolConfig
+from app.common.http_client import LlmHttpConfig
+from app.common.model_router import ModelRouter, ModelRouterConfig, set_active_router
 from app.common.constants import *
 
 # 加载.env文件
@@ -20,44 +27,114 @@ load_dotenv()
 
 
 @lru_cache(maxsize=1)
-def create_model_from_config() -> ChatOpenAI:
+def create_llm_http_client_from_config() -> httpx.AsyncClient:
     """
-    从.env文件创建OpenAI实例
+    从.env文件创建模型服务共享的异步HTTP客户端
 
-    Returns:
-        ChatOpenAI: 配置好的OpenAI实例
+    对话模型和向量模型共用该客户端的连接池，重试由客户端统一处理，由 AgentRuntime 在应用停止时关闭
     """
-    # 直接从环境变量读取配置
-    api_key = os.getenv(OPENAI_API_KEY)
-    base_url = os.getenv(OPENAI_BASE_URL)
-    model_name = os.getenv(OPENAI_MODEL_NAME, 'deepseek-v3')
+    return LlmHttpConfig.from_config().create_client()
+
+
+@lru_cache(maxsize=1)
+def create_router_http_client_from_config() -> httpx.AsyncClient:
+    """
+    从.env文件创建模型路由各后端共享的异步HTTP客户端
+
+    与 create_llm_http_client_from_config 的连接池和超时配置相同，但不重试：429、5xx 和连接失败直接交给
+    ModelRouter 计入熔断并切换后端，避免在同一个故障后端上退避重试；由 AgentRuntime 在应用停止时关闭
+    """
+    return replace(LlmHttpConfig.from_config(), max_retries=0).create_client()
 
-    # 创建ChatOpenAI实例
-    model = ChatOpenAI(
+
+def _create_chat_model(base_url: Optional[str], model_name: str, api_key: Optional[str],
+                       http_client: httpx.AsyncClient) -> ChatOpenAI:
+    return ChatOpenAI(
         api_key=SecretStr(api_key),
         base_url=base_url,
         model=model_name,
+        http_async_client=http_client,
+        timeout=http_client.timeout,
+        # 重试由共享客户端的传输层（或模型路由）完成，关闭SDK自身的重试，避免重试次数叠加
+        max_retries=0,
+    )
+
+
+@lru_cache(maxsize=1)
+def create_model_from_config() -> BaseChatModel:
+    """
+    从.env文件创建聊天模型
+
+    配置了 MODEL_BACKENDS 时返回在多个后端之间路由的 ModelRouter（各后端使用不重试的HTTP客户端，由路由负责故障转移），
+    否则返回指向 OPENAI_BASE_URL 的 ChatOpenAI
+
+    Returns:
+        BaseChatModel: 配置好的聊天模型
+    """
+    # 直接从环境变量读取配置
+    api_key = os.getenv(OPENAI_API_KEY)
+    router_config = ModelRouterConfig.from_config()
+    if not router_config.backends:
+        return _create_chat_model(os.getenv(OPENAI_BASE_URL), os.getenv(OPENAI_MODEL_NAME, 'deepseek-v3'), api_key,
+                                  create_llm_http_client_from_config())
+
+    http_client = create_router_http_client_from_config()
+    router = ModelRouter.from_config(
+        router_config,
+        lambda backend: _create_chat_model(backend.base_url, backend.model, backend.api_key or api_key, http_client)
     )
-    return model
+    set_active_router(router)
+    return router
 
 
 @lru_cache(maxsize=1)
-def create_postgres_pool_from_config():
+def create_embeddings_from_config() -> OpenAIEmbeddings:
+    """
+    从.env文件创建OpenAI向量模型实例
+
+    Returns:
+        OpenAIEmbeddings: 配置好的向量模型实例
+    """
+    http_client = create_llm_http_client_from_config()
+    return OpenAIEmbeddings(
+        api_key=SecretStr(os.getenv(OPENAI_API_KEY)),
+        base_url=os.getenv(OPENAI_BASE_URL),
+        model=os.getenv(OPENAI_EMBEDDINGS, 'text-embedding-3-small'),
+        http_async_client=http_client,
+        timeout=http_client.timeout,
+        max_retries=0,
+        # 本地推理服务通常不兼容按token切分后的输入，直接发送原始文本
+        check_embedding_ctx_length=False,
+    )
+
+
+@lru_cache(maxsize=1)
+def create_postgres_pool_from_config() -> AsyncConnectionPool:
+    """
+    从.env文件创建Postgres异步连接池
+
+    连接池大小、超时和连接寿命见 PostgresPoolConfig，连接池以未打开状态返回，
+    由 AgentRuntime 在应用启动时通过 open_pool() 打开并预热
+    """
     db_uri = f"postgresql://{os.getenv(POSTGRES_USER)}:{os.getenv(POSTGRES_PASSWORD)}@{os.getenv(POSTGRES_HOST)}:{os.getenv(POSTGRES_PORT)}/{os.getenv(POSTGRES_DB)}?sslmode=disable"
-    connection_kwargs = {"autocommit": True, "prepare_threshold": 0}
 
-    pool = AsyncConnectionPool(conninfo=db_uri, max_size=20, kwargs=connection_kwargs)
+    pool = PostgresPoolConfig.from_config().create_pool(db_uri, autocommit=True, prepare_threshold=0)
     return pool
 
 
 @lru_cache(maxsize=1)
-def create_langfuse_from_config():
+def create_langfuse_from_config(flush_at: Optional[int] = None, flush_interval: Optional[float] = None) -> Langfuse:
     """
     从.env文件创建Langfuse实例
+
+    :param flush_at: 后台导出线程每批导出的span数量
+    :param flush_interval: 后台导出线程的导出间隔（秒）
     """
     langfuse = Langfuse(
         secret_key=os.getenv(LANGFUSE_SECRET_KEY),
         public_key=os.getenv(LANGFUSE_PUBLIC_KEY),
-        host=os.getenv(LANGFUSE_HOST, 'https://cloud.langfuse.com')
+        host=os.getenv(LANGFUSE_HOST, 'https://cloud.langfuse.com'),
+        flush_at=flush_at,
+        flush_interval=flush_interval,
     )
     return langfuse
@@ -4,9 +4,29 @@
 @Time    : 2025/11/18 00:13
 @Desc    : response_config.py
 """
-from typing import Dict, AsyncIterator
+from typing import Callable, Dict, AsyncIterator, Optional
 
 from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    发送结束后一定会调用 on_close 的流式响应
+
+    BackgroundTask 只在响应成功发送后执行，响应体生成器的 finally 只在开始迭代后执行；
+    客户端在响应头发出前断开时两者都不会运行，on_close 在 ASGI 调用的 finally 中执行，不受影响
+    """
+
+    def __init__(self, *args, on_close: Callable[[], None], **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._on_close()
 
 
 class ResponseConfig:
@@ -21,12 +41,30 @@ class ResponseConfig:
     JSON_MEDIA_TYPE = f"application/json; charset={DEFAULT_CHARSET}"
     JSON_HEADERS = {"Content-Type": JSON_MEDIA_TYPE}
 
+    # NDJSON流式响应配置
+    NDJSON_MEDIA_TYPE = f"application/x-ndjson; charset={DEFAULT_CHARSET}"
+    NDJSON_HEADERS = {"Content-Type": NDJSON_MEDIA_TYPE, "Cache-Control": "no-cache"}
+
+    # SSE响应配置
+    SSE_MEDIA_TYPE = f"text/event-stream; charset={DEFAULT_CHARSET}"
+    SSE_HEADERS = {
+        "Content-Type": SSE_MEDIA_TYPE,
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        # 禁止反向代理缓冲，保证事件及时送达
+        "X-Accel-Buffering": "no"
+    }
+
+    # Prometheus文本格式
+    PROMETHEUS_MEDIA_TYPE = f"text/plain; version=0.0.4; charset={DEFAULT_CHARSET}"
+
     @classmethod
     def create_streaming_response(
             cls,
             content: AsyncIterator[str],
             media_type: str = None,
-            headers: Dict[str, str] = None
+            headers: Dict[str, str] = None,
+            on_close: Optional[Callable[[], None]] = None
     ) -> StreamingResponse:
         """
         创建统一配置的流式响应
@@ -35,6 +73,7 @@ class ResponseConfig:
             content: 流式内容生成器
             media_type: 媒体类型，默认使用text/plain; charset=utf-8
             headers: 额外的响应头，会与默认头合并
+            on_close: 响应结束（包括发送失败）后执行的回调，用于释放响应期间持有的资源
 
         Returns:
             配置好的StreamingResponse
@@ -47,21 +86,11 @@ class ResponseConfig:
         if headers:
             final_headers.update(headers)
 
+        if on_close is not None:
+            return ClosingStreamingResponse(content=content, media_type=final_media_type, headers=final_headers,
+                                            on_close=on_close)
         return StreamingResponse(
             content=content,
             media_type=final_media_type,
             headers=final_headers
         )
-
-    @classmethod
-    def encode_content(cls, content: str) -> str:
-        """
-        统一编码内容
-
-        Args:
-            content: 要编码的内容
-
-        Returns:
-            编码后的内容
-        """
-        return str(content).encode(cls.DEFAULT_CHARSET).decode(cls.DEFAULT_CHARSET)
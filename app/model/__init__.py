@@ -1,7 +1,21 @@
+from app.model.batch import (
+    BatchConfig,
+    ChatBatchItem,
+    ChatBatchRequest
+)
+from app.model.snapshot import (
+    SnapshotProjection,
+    snapshot_to_json
+)
 from app.model.state import (
     MyState
 )
 
 __all__ = [
-    "MyState"
+    "BatchConfig",
+    "ChatBatchItem",
+    "ChatBatchRequest",
+    "MyState",
+    "SnapshotProjection",
+    "snapshot_to_json"
 ]
@@ -0,0 +1,54 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:24
+@Desc    : batch.py 批量聊天的请求结构与限制配置
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from app.common.constants import BATCH_MAX_ITEMS, BATCH_MAX_CONCURRENCY
+
+
+class ChatBatchItem(BaseModel):
+    """批量聊天中的一个条目"""
+    message: str
+    # 会话ID，为空时为该条目创建一个新会话
+    session_id: Optional[str] = None
+    # 为False时不经过图、不读写会话，直接调用模型的批量接口，适合分类等无状态任务
+    tools: bool = True
+
+
+class ChatBatchRequest(BaseModel):
+    """批量聊天请求"""
+    items: list[ChatBatchItem] = Field(min_length=1)
+    # 同时执行的条目数，为空时使用 BATCH_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+
+
+@dataclass(frozen=True)
+class BatchConfig:
+    """批量聊天的限制"""
+    # 单次请求最多包含的条目数
+    max_items: int = 1000
+    # 单次请求同时执行的条目数上限
+    max_concurrency: int = 8
+
+    @classmethod
+    def from_config(cls) -> "BatchConfig":
+        """
+        从.env文件读取批量聊天的限制
+        """
+        return cls(
+            max_items=int(os.getenv(BATCH_MAX_ITEMS, "1000")),
+            max_concurrency=int(os.getenv(BATCH_MAX_CONCURRENCY, "8")),
+        )
+
+    def concurrency_for(self, requested: Optional[int]) -> int:
+        """
+        请求实际使用的并发数，不超过 max_concurrency
+        """
+        return min(requested or self.max_concurrency, self.max_concurrency)
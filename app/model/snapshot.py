@@ -0,0 +1,77 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:13
+@Desc    : snapshot.py 状态快照的JSON序列化与字段投影
+"""
+from enum import Enum
+from typing import Any, Iterable, Optional
+
+from langchain_core.messages import BaseMessage, message_to_dict
+from langgraph.types import StateSnapshot
+
+
+class SnapshotProjection(str, Enum):
+    """状态快照的字段投影"""
+    # 完整状态
+    FULL = "full"
+    # 只包含检查点元数据
+    METADATA = "metadata"
+    # 元数据 + 相对父检查点新增的消息
+    MESSAGES_DELTA = "messages_delta"
+
+
+def checkpoint_id_of(snapshot: StateSnapshot) -> Optional[str]:
+    """
+    获取快照对应的检查点ID
+    """
+    return (snapshot.config or {}).get("configurable", {}).get("checkpoint_id")
+
+
+def message_ids_of(snapshot: StateSnapshot) -> set[str]:
+    """
+    获取快照中全部消息的ID
+    """
+    return {message.id for message in snapshot.values.get("messages", [])}
+
+
+def messages_to_json(messages: Iterable[BaseMessage]) -> list[dict[str, Any]]:
+    return [message_to_dict(message) for message in messages]
+
+
+def snapshot_metadata(snapshot: StateSnapshot) -> dict[str, Any]:
+    """
+    快照的检查点元数据
+    """
+    parent_config = snapshot.parent_config or {}
+    return {
+        "checkpoint_id": checkpoint_id_of(snapshot),
+        "parent_checkpoint_id": parent_config.get("configurable", {}).get("checkpoint_id"),
+        "created_at": snapshot.created_at,
+        "next": list(snapshot.next),
+        "metadata": snapshot.metadata,
+    }
+
+
+def snapshot_to_json(snapshot: StateSnapshot,
+                     projection: SnapshotProjection = SnapshotProjection.FULL,
+                     parent_message_ids: Optional[set[str]] = None) -> dict[str, Any]:
+    """
+    按投影把状态快照转换为可JSON序列化的字典
+    :param snapshot: 状态快照
+    :param projection: 字段投影
+    :param parent_message_ids: 父检查点中的消息ID，MESSAGES_DELTA 投影下用于计算新增消息，为None时视为全部新增
+    :return: 可JSON序列化的字典
+    """
+    data = snapshot_metadata(snapshot)
+    if projection == SnapshotProjection.METADATA:
+        return data
+    messages = snapshot.values.get("messages", [])
+    if projection == SnapshotProjection.MESSAGES_DELTA:
+        parent_message_ids = parent_message_ids or set()
+        data["messages"] = messages_to_json(m for m in messages if m.id not in parent_message_ids)
+        return data
+    values = {key: value for key, value in snapshot.values.items() if key != "messages"}
+    values["messages"] = messages_to_json(messages)
+    data["values"] = values
+    return data
@@ -14,3 +14,5 @@ from pydantic import BaseModel
 class MyState(BaseModel):
     messages: Annotated[list[BaseMessage], add_messages]
     thread_id: Optional[str] = None
+    # 已折叠出上下文窗口的历史轮次的滚动摘要
+    summary: Optional[str] = None
@@ -5,16 +5,17 @@
 @Desc    : ai_chat.py
 """
 import logging
-from functools import lru_cache
+from typing import Optional
 
-from fastapi import APIRouter, Depends
-from fastapi.responses import StreamingResponse
-from langfuse import observe, propagate_attributes
-from langgraph.graph.state import CompiledStateGraph
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 
-from app.agent.agent import my_agent
+from app.agent.runtime import agent_runtime
+from app.common.admission import AdmissionRejected
+from app.common.log import PAYLOAD, summarize
+from app.common.tracing import tracing
+from app.model import ChatBatchRequest, SnapshotProjection
 from app.service import AiChatService
-from app.service.impl import OpenAiChatServiceImpl
 
 router = APIRouter()
 
@@ -22,23 +23,28 @@ tags = ["ai_chat"]
 
 
 # 依赖注入
-@lru_cache(maxsize=1)
-def get_chat_service(graph: CompiledStateGraph = Depends(my_agent)):
-    return OpenAiChatServiceImpl(graph=graph)
+def get_chat_service() -> AiChatService:
+    """
+    获取共享的聊天服务实例，服务和图实例由应用启动时的 AgentRuntime 统一构建
+    """
+    if not agent_runtime.ready:
+        raise HTTPException(status_code=503, detail=f"Agent运行时未就绪: {agent_runtime.status.value}")
+    return agent_runtime.chat_service
 
 
-@observe()
 @router.get(path="/ai/chat", tags=tags)
-async def ai_chat_controller(message: str = "介绍一下自己",
+async def ai_chat_controller(request: Request,
+                             message: str = "介绍一下自己",
                              user_id: str = "Yang-yang Miao",
                              session_id: str = "1",
                              ai_chat_service: AiChatService = Depends(get_chat_service)) -> str:
     """
     AI聊天接口控制器
 
-    接收用户消息并返回AI回复
+    接收用户消息并返回AI回复，按采样结果决定是否追踪本次请求
 
     Args:
+        :param request: 请求对象，用于读取调试追踪请求头
         :param message: 用户输入的消息，默认为"介绍一下自己"
         :param ai_chat_service: 依赖注入
         :param user_id: 用户ID，默认为"Yang-yang Miao"
@@ -47,76 +53,126 @@ async def ai_chat_controller(message: str = "介绍一下自己",
     Returns:
         AI的回复内容
     """
-    with propagate_attributes(user_id=user_id):
-        logging.info(f"收到聊天请求: {message}")
+    with tracing.trace_request("chat", request.headers, user_id=user_id, session_id=session_id, root_span=True):
+        logging.info("收到聊天请求: %s", summarize(message))
         try:
             response = await ai_chat_service.chat(message, session_id)
-            logging.info(f"聊天响应成功，response: {response}")
+            logging.info("聊天响应成功，response: %s", summarize(response), extra=PAYLOAD)
             return response
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            logging.error(f"聊天处理失败: {str(e)}")
+            logging.error("聊天处理失败: %s", e)
             raise
 
 
 @router.get(path="/ai/chat-stream", tags=tags)
-async def ai_chat_stream_controller(message: str = "介绍一下自己",
+async def ai_chat_stream_controller(request: Request,
+                                    message: str = "介绍一下自己",
                                     user_id: str = "Yang-yang Miao",
                                     session_id: str = "1",
-                                    ai_chat_service: AiChatService = Depends(get_chat_service)) -> StreamingResponse:
+                                    run_id: Optional[str] = Query(default=None,
+                                                                  description="续传的运行ID，来自 X-Run-Id 响应头"),
+                                    last_event_id: Optional[str] = Header(default=None),
+                                    ai_chat_service: AiChatService = Depends(get_chat_service)) -> Response:
     """
     AI聊天流式接口控制器
 
-    接收用户消息并返回AI回复
+    接收用户消息并返回AI回复，客户端断开连接时取消图执行，按采样结果决定是否追踪本次请求。
+    带 Last-Event-ID 请求头或 run_id 参数重连时，重放断开期间错过的事件后继续接收实时事件；
+    带 Last-Event-ID 但没有可续传的运行时返回204，不会重新提交消息
     Args:
+        :param request: 请求对象，用于检测客户端断开和读取调试追踪请求头
         :param message: 用户输入的消息，默认为"介绍一下自己"
         :param user_id: 用户ID，默认为"Yang-yang Miao"
         :param session_id: 会话ID，默认为"1"
+        :param run_id: 续传的运行ID，为空时续传会话最近的运行
+        :param last_event_id: 客户端最后收到的事件ID，EventSource 重连时自动携带
         :param ai_chat_service: 依赖注入
 
     Returns:
         AI的回复内容
     """
-    with propagate_attributes(user_id=user_id):
-        logging.info(f"收到流式聊天请求: {message}")
+    with tracing.trace_request("chat_stream", request.headers, user_id=user_id, session_id=session_id):
+        logging.info("收到流式聊天请求: %s", summarize(message))
         try:
             # 获取流式响应并确保编码正确
-            response = await ai_chat_service.chat_stream(message, session_id)
-            logging.info(f"流式聊天响应成功，response: {response}")
+            response = await ai_chat_service.chat_stream(message, session_id,
+                                                         is_disconnected=request.is_disconnected,
+                                                         run_id=run_id, last_event_id=last_event_id)
+            logging.info("流式聊天响应已创建，会话: %s", session_id)
             return response
+        except (AdmissionRejected, HTTPException):
+            raise
         except Exception as e:
-            logging.error(f"流式聊天处理失败: {str(e)}")
+            logging.error("流式聊天处理失败: %s", e)
             raise
 
 
+@router.post(path="/ai/chat/batch", tags=tags)
+async def ai_chat_batch_controller(batch: ChatBatchRequest,
+                                   ai_chat_service: AiChatService = Depends(get_chat_service)) -> StreamingResponse:
+    """
+    AI批量聊天接口控制器
+
+    一次提交多个相互独立的 {message, session_id} 条目，以NDJSON按完成顺序逐行返回结果，
+    单个条目失败只在对应的行中返回错误，不影响其他条目
+    Args:
+        :param batch: 批量请求，包含条目列表和可选的并发数
+        :param ai_chat_service: 依赖注入
+
+    Returns:
+        StreamingResponse: NDJSON格式的条目结果
+    """
+    logging.info("收到批量聊天请求，条目 %d 个", len(batch.items))
+    return await ai_chat_service.chat_batch(batch.items, max_concurrency=batch.max_concurrency)
+
+
 @router.get(path="/ai/get-current-state", tags=tags)
 async def get_current_state(session_id: str = "1",
-                            ai_chat_service: AiChatService = Depends(get_chat_service)) -> str:
+                            since: Optional[str] = Query(default=None,
+                                                         description="检查点ID，只返回该检查点之后新增的消息"),
+                            if_none_match: Optional[str] = Header(default=None),
+                            ai_chat_service: AiChatService = Depends(get_chat_service)) -> Response:
     """
     获取AI聊天服务的当前状态
 
+    以JSON返回最新检查点的状态，ETag 为检查点ID。轮询时带上 If-None-Match，状态未变化时返回304；
+    带上 since（上次收到的检查点ID）时只返回之后新增的消息
+
     Args:
         :param session_id: 会话ID，默认为"1"
+        :param since: 检查点ID，增量模式
+        :param if_none_match: 上次响应的 ETag
         :param ai_chat_service: AI聊天服务实例，通过依赖注入获取
 
     Returns:
-        str: 返回AI聊天服务的当前状态信息
+        Response: 当前状态的JSON，或304
     """
-    return await ai_chat_service.get_current_state(session_id)
+    return await ai_chat_service.get_current_state(session_id, since=since, if_none_match=if_none_match)
 
 
 @router.get(path="/ai/get-history-state", tags=tags)
 async def get_history_state(session_id: str = "1",
-                            ai_chat_service: AiChatService = Depends(get_chat_service)) -> str:
+                            limit: Optional[int] = Query(default=None, ge=1, description="最多返回的快照数量"),
+                            before: Optional[str] = Query(default=None, description="检查点ID游标，只返回该检查点之前的快照"),
+                            fields: SnapshotProjection = Query(default=SnapshotProjection.FULL,
+                                                               description="字段投影：full/metadata/messages_delta"),
+                            ai_chat_service: AiChatService = Depends(get_chat_service)) -> StreamingResponse:
     """
     获取AI聊天历史状态的异步接口函数
 
-    该函数通过FastAPI路由装饰器定义了一个GET请求接口，用于获取当前AI聊天服务的历史状态信息。
+    以NDJSON流式返回状态快照历史（从新到旧，每行一个快照），支持分页和字段投影。
+    翻页时把上一页最后一行的 checkpoint_id 作为 before 传入。
 
     Args:
         :param session_id: 会话ID，默认为"1"
+        :param limit: 最多返回的快照数量，默认不限制
+        :param before: 检查点ID游标
+        :param fields: 字段投影，默认返回完整状态
         :param ai_chat_service: AI聊天服务实例，通过依赖注入方式获取
 
     Returns:
-        str: 返回AI聊天服务的历史状态信息字符串
+        StreamingResponse: NDJSON格式的状态快照历史
     """
-    return await ai_chat_service.get_history_state(session_id)
+    return await ai_chat_service.get_history_state(session_id, limit=limit, before=before, projection=fields)
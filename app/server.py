@@ -0,0 +1,135 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:23
+@Desc    : server.py 生产环境入口：多worker进程、按worker分配Postgres连接数、可选uvloop/httptools、优雅停机
+
+每个worker是独立启动的子进程，各自执行 main.py 中的 lifespan，分别构建图、连接池和MCP会话，
+父进程只负责读取配置和管理worker，不导入应用代码。
+收到SIGTERM/SIGINT后worker停止接收新连接，最多等待 SERVER_GRACEFUL_TIMEOUT 秒让进行中的请求（包括流式响应）结束，
+再由 lifespan 等待已准入的图执行结束后关闭MCP会话和连接池。
+运行方式: python -m app.server
+"""
+import importlib.util
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.common.constants import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_LOOP, SERVER_HTTP, SERVER_GRACEFUL_TIMEOUT,
+    SERVER_KEEP_ALIVE_TIMEOUT, SERVER_BACKLOG, SERVER_LOG_LEVEL, POSTGRES_MAX_CONNECTIONS, POSTGRES_POOL_MIN_SIZE,
+    POSTGRES_POOL_MAX_SIZE
+)
+
+# uvicorn 的 loop/http 选项与对应的可选依赖
+_OPTIONAL_IMPLEMENTATIONS = {"loop": ("uvloop", "uvloop"), "http": ("httptools", "httptools")}
+
+
+def _resolve_implementation(kind: str, value: str) -> str:
+    """
+    请求的 uvloop/httptools 未安装时退回 auto，并输出警告
+    :param kind: loop 或 http
+    :param value: 配置的实现
+    """
+    name, module = _OPTIONAL_IMPLEMENTATIONS[kind]
+    if value == name and importlib.util.find_spec(module) is None:
+        logging.warning("未安装 %s，%s 使用默认实现", module, kind)
+        return "auto"
+    return value
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    """生产环境服务配置，时间单位均为秒"""
+    host: str = "0.0.0.0"
+    port: int = 8001
+    # worker进程数，0 表示使用CPU核数
+    workers: int = 0
+    # 事件循环实现: auto / asyncio / uvloop
+    loop: str = "auto"
+    # HTTP协议实现: auto / h11 / httptools
+    http: str = "auto"
+    # 停机时等待进行中请求结束的时间，超时后强制关闭连接
+    graceful_timeout: int = 30
+    keep_alive_timeout: int = 5
+    backlog: int = 2048
+    log_level: str = "info"
+    # 所有worker合计可使用的Postgres连接数，0 表示不限制（每个worker使用 POSTGRES_POOL_MAX_SIZE）
+    postgres_max_connections: int = 0
+
+    @classmethod
+    def from_config(cls) -> "ServerConfig":
+        """
+        从.env文件读取服务配置
+        """
+        workers = int(os.getenv(SERVER_WORKERS, "0"))
+        return cls(
+            host=os.getenv(SERVER_HOST, "0.0.0.0"),
+            port=int(os.getenv(SERVER_PORT, "8001")),
+            workers=workers if workers > 0 else (os.cpu_count() or 1),
+            loop=_resolve_implementation("loop", os.getenv(SERVER_LOOP, "auto").lower()),
+            http=_resolve_implementation("http", os.getenv(SERVER_HTTP, "auto").lower()),
+            graceful_timeout=int(os.getenv(SERVER_GRACEFUL_TIMEOUT, "30")),
+            keep_alive_timeout=int(os.getenv(SERVER_KEEP_ALIVE_TIMEOUT, "5")),
+            backlog=int(os.getenv(SERVER_BACKLOG, "2048")),
+            log_level=os.getenv(SERVER_LOG_LEVEL, "info").lower(),
+            postgres_max_connections=int(os.getenv(POSTGRES_MAX_CONNECTIONS, "0")),
+        )
+
+    def worker_pool_sizes(self, min_size: int, max_size: int) -> Optional[tuple[int, int]]:
+        """
+        按总连接数预算计算每个worker的连接池大小，保证所有worker合计不超过 postgres_max_connections
+        :param min_size: 配置的 POSTGRES_POOL_MIN_SIZE
+        :param max_size: 配置的 POSTGRES_POOL_MAX_SIZE
+        :return: (min_size, max_size)，未设置预算时为None
+        :raises ValueError: 预算不足以给每个worker分配一个连接
+        """
+        if self.postgres_max_connections <= 0:
+            return None
+        per_worker = self.postgres_max_connections // self.workers
+        if per_worker < 1:
+            raise ValueError(f"POSTGRES_MAX_CONNECTIONS={self.postgres_max_connections} "
+                             f"不足以给 {self.workers} 个worker各分配一个连接")
+        max_size = min(max_size, per_worker)
+        return min(min_size, max_size), max_size
+
+
+def run(config: ServerConfig) -> None:
+    """
+    按配置启动 main:app，worker进程通过环境变量继承连接池大小
+    :param config: 服务配置
+    """
+    import uvicorn
+
+    sizes = config.worker_pool_sizes(int(os.getenv(POSTGRES_POOL_MIN_SIZE, "4")),
+                                     int(os.getenv(POSTGRES_POOL_MAX_SIZE, "20")))
+    if sizes is not None:
+        # worker中的 load_dotenv() 不会覆盖已存在的环境变量
+        os.environ[POSTGRES_POOL_MIN_SIZE], os.environ[POSTGRES_POOL_MAX_SIZE] = map(str, sizes)
+        logging.info("每个worker的Postgres连接池: min_size=%d, max_size=%d（%d 个worker，连接预算 %d）",
+                     sizes[0], sizes[1], config.workers, config.postgres_max_connections)
+    logging.info("启动 %d 个worker，监听 %s:%d，loop=%s，http=%s",
+                 config.workers, config.host, config.port, config.loop, config.http)
+    uvicorn.run(
+        "main:app",
+        host=config.host,
+        port=config.port,
+        workers=config.workers,
+        loop=config.loop,
+        http=config.http,
+        timeout_graceful_shutdown=config.graceful_timeout,
+        timeout_keep_alive=config.keep_alive_timeout,
+        backlog=config.backlog,
+        log_level=config.log_level,
+        access_log=False,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    run(ServerConfig.from_config())
@@ -5,8 +5,12 @@
 @Desc    : ai_chat_service.py
 """
 from abc import abstractmethod, ABC
+from typing import Awaitable, Callable, Optional
 
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+
+from app.model.batch import ChatBatchItem
+from app.model.snapshot import SnapshotProjection
 
 
 class AiChatService(ABC):
@@ -15,13 +19,31 @@ class AiChatService(ABC):
         pass
 
     @abstractmethod
-    async def chat_stream(self, user_input: str, session_id: str) -> StreamingResponse:
+    async def chat_stream(self,
+                          user_input: str,
+                          session_id: str,
+                          is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                          run_id: Optional[str] = None,
+                          last_event_id: Optional[str] = None) -> Response:
+        pass
+
+    @abstractmethod
+    async def chat_batch(self,
+                         items: list[ChatBatchItem],
+                         max_concurrency: Optional[int] = None) -> StreamingResponse:
         pass
 
     @abstractmethod
-    async def get_current_state(self, session_id: str) -> str:
+    async def get_current_state(self,
+                                session_id: str,
+                                since: Optional[str] = None,
+                                if_none_match: Optional[str] = None) -> Response:
         pass
 
     @abstractmethod
-    async def get_history_state(self, session_id: str) -> str:
+    async def get_history_state(self,
+                                session_id: str,
+                                limit: Optional[int] = None,
+                                before: Optional[str] = None,
+                                projection: SnapshotProjection = SnapshotProjection.FULL) -> StreamingResponse:
         pass
\ No newline at end of file
@@ -4,16 +4,39 @@
 @Time    : 2025/11/18 00:15
 @Desc    : openai_chat_service_impl.py
 """
+import asyncio
+import json
 import logging
-from typing import AsyncIterator
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
-from fastapi.responses import StreamingResponse
-from langchain_core.messages import HumanMessage, BaseMessage, SystemMessage, AIMessage
+import numpy as np
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from langchain_core.messages import HumanMessage, BaseMessage, SystemMessage, AIMessage, ToolMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.types import StateSnapshot
 
+from app.agent.instrumentation import track_graph_run
+from app.checkpoint.head import latest_checkpoint_id
+from app.common.admission import AdmissionController, AdmissionTicket, admission_controller
+from app.cache.semantic_cache import SemanticCache, CacheHit
+from app.cache.snapshot_cache import SnapshotCache, SnapshotEntry, SNAPSHOT_CACHE_REQUESTS
+from app.cache.stream_runs import StreamRun, StreamRunStore, STREAM_RESUMES
+from app.common.constants import LLM_NODE, TOOL_NODE
+from app.common.log import PAYLOAD, summarize
+from app.common.metrics import BATCH_ITEMS, STREAM_ABORTS, STREAM_TTFT, STREAM_TOKENS_PER_SECOND, STREAM_TOKENS
+from app.common.sse import (
+    SseEncoder, SseEvent, EVENT_TOKEN, EVENT_TOOL_CALL, EVENT_TOOL_RESULT, EVENT_DONE, EVENT_ERROR
+)
+from app.common.tracing import tracing
+from app.config import create_model_from_config
 from app.config.response_config import ResponseConfig
+from app.model.batch import BatchConfig, ChatBatchItem
+from app.model.snapshot import SnapshotProjection, checkpoint_id_of, snapshot_to_json, message_ids_of
 from app.model.state import MyState
 from app.service.ai_chat_service import AiChatService
 
@@ -23,87 +46,608 @@ class OpenAiChatServiceImpl(AiChatService):
     AI聊天服务实现类，负责初始化AI代理并处理用户聊天请求。
     """
     _graph: CompiledStateGraph
+    _semantic_cache: Optional[SemanticCache]
+    _admission: AdmissionController
+    _batch_config: BatchConfig
+    _stream_runs: Optional[StreamRunStore]
+    _snapshot_cache: SnapshotCache
+
+    # 流式响应中返回运行ID的响应头，重连时作为 run_id 参数传回
+    RUN_ID_HEADER = "X-Run-Id"
 
-    def __init__(self, graph: CompiledStateGraph):
+    def __init__(self,
+                 graph: CompiledStateGraph,
+                 semantic_cache: Optional[SemanticCache] = None,
+                 admission: Optional[AdmissionController] = None,
+                 batch_config: Optional[BatchConfig] = None,
+                 stream_runs: Optional[StreamRunStore] = None,
+                 snapshot_cache: Optional[SnapshotCache] = None):
         # 获取单例图实例
         self._graph = graph
+        self._semantic_cache = semantic_cache
+        self._admission = admission or admission_controller
+        self._batch_config = batch_config or BatchConfig.from_config()
+        self._stream_runs = stream_runs
+        self._snapshot_cache = snapshot_cache or SnapshotCache.from_config()
 
     async def chat(self, user_input: str, session_id: str) -> str:
         """
         处理用户聊天输入并返回AI的响应。
 
+        同一会话的请求串行执行，全局并发受准入控制限制
         :param user_input: 用户输入
         :param session_id: 会话ID
         :return: AI的响应结果
+        :raises AdmissionRejected: 排队已满或等待超时
         """
-        # 配置
-        config = RunnableConfig(configurable={"thread_id": session_id})
+        ticket = await self._admission.enter(session_id)
+        try:
+            return await self._chat(user_input, session_id)
+        finally:
+            ticket.release()
 
+    async def _chat(self, user_input: str, session_id: str) -> str:
+        # 配置，被采样的请求挂载链路追踪回调
+        config = RunnableConfig(configurable={"thread_id": session_id}, callbacks=tracing.callbacks())
+        hit, vector = await self._semantic_lookup(user_input, config)
+        if hit is not None:
+            await self._record_cached_turn(config, user_input, hit)
+            return hit.answer
+
+        start = time.perf_counter()
         chat_state = MyState(messages=[HumanMessage(content=user_input)], thread_id=session_id)
-        response = await self._graph.ainvoke(chat_state, config)
-        logging.info(f"response 结果:{response}")
+        try:
+            with track_graph_run("chat"):
+                response = await self._graph.ainvoke(chat_state, config)
+        finally:
+            self._snapshot_cache.invalidate(session_id)
+        logging.info("response 结果:%s", summarize(response), extra=PAYLOAD)
         ai_message = response.get("messages")[-1]
-        return str(ai_message.content)
+        answer = str(ai_message.content)
+        if vector is not None:
+            self._semantic_cache.record_miss_latency(time.perf_counter() - start)
+            self._semantic_cache.store(user_input, answer, vector)
+        return answer
+
+    async def _semantic_lookup(self,
+                               user_input: str,
+                               config: RunnableConfig) -> tuple[Optional[CacheHit], Optional[np.ndarray]]:
+        """
+        查询语义缓存，只对没有历史上下文的会话生效
 
-    async def chat_stream(self, user_input: str, session_id: str) -> StreamingResponse:
+        :return: (命中结果, 问题向量)，未启用缓存、会话已有上下文或查询失败时均为None
+        """
+        if self._semantic_cache is None:
+            return None, None
+        state_snapshot: StateSnapshot = await self._graph.aget_state(config=config)
+        if state_snapshot.values.get("messages"):
+            self._semantic_cache.record_bypass()
+            return None, None
+        try:
+            return await self._semantic_cache.lookup(user_input)
+        except Exception as e:
+            logging.warning("语义缓存查询失败，跳过缓存: %r", e)
+            return None, None
+
+    async def _record_cached_turn(self, config: RunnableConfig, user_input: str, hit: CacheHit) -> None:
+        """
+        把命中缓存的问答写入会话，保证后续轮次的上下文完整
+        """
+        logging.info("语义缓存命中，相似度: %.4f", hit.score)
+        cached_message = AIMessage(content=hit.answer, response_metadata={"semantic_cache_score": hit.score})
+        await self._graph.aupdate_state(
+            config,
+            {"messages": [HumanMessage(content=user_input), cached_message],
+             "thread_id": config["configurable"]["thread_id"]},
+            as_node=LLM_NODE
+        )
+        self._snapshot_cache.invalidate(config["configurable"]["thread_id"])
+
+    async def chat_stream(self,
+                          user_input: str,
+                          session_id: str,
+                          is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                          run_id: Optional[str] = None,
+                          last_event_id: Optional[str] = None) -> Response:
         """
         处理用户聊天输入并返回AI的响应。
 
+        启用续传时，带 run_id 或 Last-Event-ID 的请求视为重连：重放该运行中 last_event_id 之后的事件，
+        运行仍在执行时继续接收实时事件。带 Last-Event-ID 的请求是 EventSource 的自动重连（URL与上一次相同），
+        不会开始新的运行：没有可续传的运行时（未启用续传、运行已结束并过期）返回204，EventSource 收到后停止重连，
+        否则上一轮的用户输入会被再次提交
         :param user_input: 用户输入
-        :return: AI的响应结果
+        :param session_id: 会话ID
+        :param is_disconnected: 客户端断开检测函数，断开后取消图执行（启用续传时在分离超时后取消）
+        :param run_id: 要续传的运行ID，为空时续传会话最近的运行
+        :param last_event_id: 客户端最后收到的事件ID
+        :return: AI的响应结果，没有可续传的运行时为204响应
+        :raises AdmissionRejected: 排队已满或等待超时，此时尚未开始流式输出
+        :raises HTTPException: 404，指定的运行不存在、已过期或不属于该会话
+        """
+        if self._stream_runs is not None and (run_id is not None or last_event_id is not None):
+            return await self._resume_stream(session_id, run_id, last_event_id, is_disconnected)
+        if last_event_id is not None:
+            return self._no_stream_to_resume(session_id)
+        # 准入名额一直持有到流式输出结束，期间同一会话的其他请求排队等待
+        ticket = await self._admission.enter(session_id)
+        try:
+            return await self._chat_stream(user_input, session_id, is_disconnected, ticket)
+        except BaseException:
+            ticket.release()
+            raise
+
+    async def _resume_stream(self,
+                             session_id: str,
+                             run_id: Optional[str],
+                             last_event_id: Optional[str],
+                             is_disconnected: Optional[Callable[[], Awaitable[bool]]]) -> Response:
+        """
+        续传一个流式运行，未指定 run_id 且会话没有可续传的运行时返回204
         """
+        try:
+            after = max(int(last_event_id or 0), 0)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的 Last-Event-ID: {last_event_id}")
+        run = self._stream_runs.get(run_id) if run_id is not None else self._stream_runs.latest(session_id)
+        if run is not None and run.session_id != session_id:
+            run = None
+        if run is None:
+            if run_id is None:
+                return self._no_stream_to_resume(session_id)
+            frames = await self._stream_runs.replay_evicted(run_id, after)
+            if frames is None:
+                STREAM_RESUMES.inc(result="missing")
+                raise HTTPException(status_code=404, detail=f"流式运行不存在或已过期: {run_id}")
+            # 运行已从内存中淘汰，只能重放已写入Postgres的事件
+            STREAM_RESUMES.inc(result="evicted")
+            content = self._replay_frames(frames)
+        else:
+            STREAM_RESUMES.inc(result="finished" if run.done else "live")
+            run_id = run.run_id
+            content = self._stream_runs.subscribe(run, after, is_disconnected)
+        logging.info("续传会话 %s 的流式运行 %s，Last-Event-ID: %d", session_id, run_id, after)
+        return ResponseConfig.create_streaming_response(
+            content=content,
+            media_type=ResponseConfig.SSE_MEDIA_TYPE,
+            headers={**ResponseConfig.SSE_HEADERS, self.RUN_ID_HEADER: run_id}
+        )
+
+    @staticmethod
+    def _no_stream_to_resume(session_id: str) -> Response:
+        STREAM_RESUMES.inc(result="missing")
+        logging.info("会话 %s 没有可续传的流式运行，返回204", session_id)
+        return Response(status_code=204)
+
+    @staticmethod
+    async def _replay_frames(frames: list[str]) -> AsyncIterator[str]:
+        yield "".join(frames)
+
+    async def _chat_stream(self,
+                           user_input: str,
+                           session_id: str,
+                           is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+                           ticket: AdmissionTicket) -> StreamingResponse:
         chat_messages: list[BaseMessage] = [
             SystemMessage(content="你是一个全能的人工智能助手，你的名字叫糯米,你可以调用工具来解决用户的问题"),
             HumanMessage(content=user_input)
         ]
         chat_state = MyState(messages=chat_messages, thread_id=session_id)
+        config = RunnableConfig(configurable={"thread_id": session_id})
+        hit, vector = await self._semantic_lookup(user_input, config)
+        if hit is not None:
+            await self._record_cached_turn(config, user_input, hit)
+            events = self.cached_events(hit, session_id)
+        else:
+            cache_entry = (user_input, vector) if vector is not None else None
+            # 事件流在路由函数返回后才执行，需要在此处取得当前请求的追踪回调
+            events = self.graph_events(chat_state, cache_entry=cache_entry, callbacks=tracing.callbacks())
         logging.info("开始流式输出...")
+        if self._stream_runs is not None:
+            # 图执行与响应解耦：运行在后台任务中执行，响应只是运行的一个订阅者
+            run = self._stream_runs.create(session_id)
+            run.task = asyncio.create_task(self._run_stream(run, events, ticket), name=f"stream-run-{run.run_id}")
+            return ResponseConfig.create_streaming_response(
+                content=self._stream_runs.subscribe(run, 0, is_disconnected),
+                media_type=ResponseConfig.SSE_MEDIA_TYPE,
+                headers={**ResponseConfig.SSE_HEADERS, self.RUN_ID_HEADER: run.run_id}
+            )
         # 使用ResponseConfig创建流式响应，确保浏览器兼容性
         return ResponseConfig.create_streaming_response(
-            content=self.response_streamer(chat_state=chat_state),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream; charset=utf-8"
-            }
+            content=self.response_streamer(events=events, session_id=session_id, is_disconnected=is_disconnected,
+                                           ticket=ticket),
+            media_type=ResponseConfig.SSE_MEDIA_TYPE,
+            headers=ResponseConfig.SSE_HEADERS,
+            # 响应体未被迭代时（例如发送响应头前客户端已断开）在响应结束时兜底释放名额
+            on_close=ticket.release
         )
 
-    async def response_streamer(self, chat_state: MyState) -> AsyncIterator[str]:
-        config = RunnableConfig(configurable={"thread_id": chat_state.thread_id})
-        async for chunk in self._graph.astream(input=chat_state, config=config, stream_mode="messages"):
-            # chunk 是一个元组 (message_chunk, metadata)
-            message_chunk, metadata = chunk
-            # logging.info(f"消息类型: {type(message_chunk)}")
-            # logging.info(f"元数据: {metadata}")
-            if not isinstance(message_chunk, AIMessage):
-                continue
-            if hasattr(message_chunk, 'content'):
-                content = message_chunk.content
-                # 使用统一的编码配置
-                if isinstance(content, str):
-                    # logging.info(f"输出内容: {content}")
-                    yield ResponseConfig.encode_content(content)
-                else:
-                    content_str = str(content)
-                    # logging.info(f"输出内容(转换): {content_str}")
-                    yield ResponseConfig.encode_content(content_str)
+    async def _run_stream(self, run: StreamRun, events: AsyncIterator[SseEvent], ticket: AdmissionTicket) -> None:
+        """
+        在后台执行一次流式运行，编码后的事件写入运行的缓冲区；结束或被取消后释放准入名额
+        """
+        encoder = SseEncoder(on_event=lambda event_id, frame: self._stream_runs.append(run, event_id, frame))
+        try:
+            async for _ in encoder.stream(events):
+                pass
+        except asyncio.CancelledError:
+            logging.info("会话 %s 的流式运行 %s 已取消", run.session_id, run.run_id)
+        except Exception:
+            logging.exception("会话 %s 的流式运行 %s 失败", run.session_id, run.run_id)
+        finally:
+            ticket.release()
+            self._stream_runs.finish(run)
+
+    async def response_streamer(self,
+                                events: AsyncIterator[SseEvent],
+                                session_id: str,
+                                is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                                ticket: Optional[AdmissionTicket] = None) -> AsyncIterator[str]:
+        """
+        把事件编码为SSE事件流，连续的token按配置的延迟和字节数合并发送
+
+        客户端断开（或响应被关闭）时取消图执行，进行中的模型请求和工具调用随之取消；
+        输出结束或被取消后释放准入名额
+        """
+        encoder = SseEncoder()
+        try:
+            async for frame in encoder.stream(events, is_disconnected=is_disconnected):
+                yield frame
+        finally:
+            if ticket is not None:
+                ticket.release()
+        if encoder.disconnected:
+            logging.info("客户端已断开，取消会话 %s 的流式输出", session_id)
+
+    @staticmethod
+    async def cached_events(hit: CacheHit, session_id: str) -> AsyncIterator[SseEvent]:
+        """
+        语义缓存命中时的事件：完整回答作为一个token事件，随后是结束事件
+        """
+        yield SseEvent(event=EVENT_TOKEN, data=hit.answer)
+        yield SseEvent(event=EVENT_DONE, data={"session_id": session_id, "cached": True})
+
+    async def graph_events(self,
+                           chat_state: MyState,
+                           cache_entry: Optional[tuple[str, np.ndarray]] = None,
+                           callbacks: Optional[list] = None) -> AsyncIterator[SseEvent]:
+        """
+        把图的流式输出转换为事件：llm节点的token、完整的工具调用、工具结果以及结束事件
+
+        工具调用参数的增量片段不会转发，工具调用在llm节点输出完整消息后作为一个事件发送
+        :param chat_state: 输入状态
+        :param cache_entry: (问题, 问题向量)，不为None时在正常结束后把最终回答写入语义缓存
+        :param callbacks: 图执行的回调，例如链路追踪回调
+        """
+        config = RunnableConfig(configurable={"thread_id": chat_state.thread_id}, callbacks=callbacks or [])
+        # 当前模型调用已输出的文本，以及图执行所处的阶段，用于中止时保存部分结果
+        partial: list[str] = []
+        stage = "before_first_token"
+        final_answer = ""
+        start = time.perf_counter()
+        first_token_at: Optional[float] = None
+        token_count = 0
+        try:
+            with track_graph_run("chat_stream"):
+                async for mode, payload in self._graph.astream(input=chat_state, config=config,
+                                                               stream_mode=["messages", "updates"]):
+                    if mode == "messages":
+                        # payload 是一个元组 (message_chunk, metadata)
+                        message_chunk, metadata = payload
+                        if isinstance(message_chunk, AIMessage) and metadata.get("langgraph_node") == LLM_NODE:
+                            text = message_chunk.text
+                            if text:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    STREAM_TTFT.observe(first_token_at - start)
+                                token_count += 1
+                                partial.append(text)
+                                stage = "llm"
+                                yield SseEvent(event=EVENT_TOKEN, data=text)
+                        continue
+                    for node_name, update in payload.items():
+                        if node_name == LLM_NODE:
+                            partial.clear()
+                        messages = (update or {}).get("messages") or []
+                        for message in messages if isinstance(messages, list) else [messages]:
+                            if isinstance(message, AIMessage):
+                                final_answer = message.text
+                                for tool_call in message.tool_calls:
+                                    stage = "tool"
+                                    yield SseEvent(event=EVENT_TOOL_CALL, data=tool_call)
+                            elif isinstance(message, ToolMessage):
+                                yield SseEvent(event=EVENT_TOOL_RESULT, data={
+                                    "tool_call_id": message.tool_call_id,
+                                    "name": message.name,
+                                    "status": message.status,
+                                    "content": message.text,
+                                })
+        except asyncio.CancelledError:
+            await asyncio.shield(self._checkpoint_aborted_run(config, "".join(partial), stage))
+            raise
+        except Exception as e:
+            logging.exception("流式输出失败")
+            yield SseEvent(event=EVENT_ERROR, data={"message": str(e)})
+            return
+        finally:
+            STREAM_TOKENS.inc(token_count)
+            # 正常结束、出错和中止补写都会改变会话状态
+            self._snapshot_cache.invalidate(chat_state.thread_id)
+        if first_token_at is not None:
+            elapsed = time.perf_counter() - first_token_at
+            if elapsed > 0:
+                STREAM_TOKENS_PER_SECOND.observe(token_count / elapsed)
+        if cache_entry is not None:
+            self._semantic_cache.record_miss_latency(time.perf_counter() - start)
+            self._semantic_cache.store(cache_entry[0], final_answer, cache_entry[1])
+        yield SseEvent(event=EVENT_DONE, data={"session_id": chat_state.thread_id})
+
+    async def _checkpoint_aborted_run(self, config: RunnableConfig, partial_text: str, stage: str) -> None:
+        """
+        图执行被取消后补齐检查点，使会话状态保持一致
+
+        被取消的超步不会写入检查点，最后一个检查点停留在上一个完成的超步：
+        - 停在工具调用阶段时，为未完成的工具调用补写取消结果，避免下一轮出现没有结果的工具调用
+        - 停在模型输出阶段时，把已经输出给客户端的部分文本保存为一条助手消息
+        """
+        STREAM_ABORTS.inc(stage=stage)
+        try:
+            state_snapshot: StateSnapshot = await self._graph.aget_state(config=config)
+            messages = state_snapshot.values.get("messages", [])
+            last_message = messages[-1] if messages else None
+            if isinstance(last_message, AIMessage) and last_message.tool_calls:
+                tool_messages = [
+                    ToolMessage(content="工具调用已取消：客户端断开连接", tool_call_id=tool_call["id"],
+                                name=tool_call["name"], status="error")
+                    for tool_call in last_message.tool_calls
+                ]
+                await self._graph.aupdate_state(config, {"messages": tool_messages}, as_node=TOOL_NODE)
+            elif partial_text:
+                aborted_message = AIMessage(content=partial_text,
+                                            response_metadata={"finish_reason": "client_disconnected"})
+                await self._graph.aupdate_state(config, {"messages": [aborted_message]}, as_node=LLM_NODE)
+            logging.info("会话 %s 的流式输出已中止，阶段: %s", config["configurable"]["thread_id"], stage)
+        except Exception:
+            logging.exception("保存中止会话的检查点失败")
+
+    async def chat_batch(self,
+                         items: list[ChatBatchItem],
+                         max_concurrency: Optional[int] = None) -> StreamingResponse:
+        """
+        批量处理相互独立的聊天条目，以NDJSON按完成顺序逐行返回结果
+
+        :param items: 条目列表
+        :param max_concurrency: 同时执行的条目数，不超过 BATCH_MAX_CONCURRENCY
+        :return: NDJSON流式响应，每行对应一个条目，index 为条目在请求中的位置
+        :raises HTTPException: 条目数超过 BATCH_MAX_ITEMS 时返回413
+        """
+        if len(items) > self._batch_config.max_items:
+            raise HTTPException(status_code=413,
+                                detail=f"批量请求最多包含 {self._batch_config.max_items} 个条目，实际 {len(items)} 个")
+        return ResponseConfig.create_streaming_response(
+            content=self.batch_streamer(items, self._batch_config.concurrency_for(max_concurrency)),
+            media_type=ResponseConfig.NDJSON_MEDIA_TYPE,
+            headers=ResponseConfig.NDJSON_HEADERS
+        )
+
+    async def batch_streamer(self, items: list[ChatBatchItem], concurrency: int) -> AsyncIterator[str]:
+        """
+        执行批量条目并按完成顺序输出结果
+
+        - tools 为True的条目按会话分组，同一会话内按提交顺序依次执行 chat()，与单条请求使用相同的图、
+          检查点和准入控制；不同会话之间最多 concurrency 个同时执行
+        - tools 为False的条目不读写会话，通过模型的批量接口一起提交，最多 concurrency 个同时请求
+        单个条目失败只在对应的行中返回错误；客户端断开时取消全部未完成的条目
+        """
+        results: asyncio.Queue[dict] = asyncio.Queue()
+        batch_id = uuid.uuid4().hex[:8]
+        sessions: dict[str, list[tuple[int, ChatBatchItem]]] = {}
+        stateless: list[tuple[int, ChatBatchItem]] = []
+        for index, item in enumerate(items):
+            if item.tools:
+                session_id = item.session_id or f"batch-{batch_id}-{index}"
+                sessions.setdefault(session_id, []).append((index, item))
+            elif item.session_id:
+                results.put_nowait(self._batch_error(index, item.session_id, "model", time.perf_counter(),
+                                                     ValueError("tools=false 的条目不读写会话，不能指定 session_id")))
             else:
-                content_str = str(message_chunk)
-                # logging.info(f"输出消息: {content_str}")
-                yield ResponseConfig.encode_content(content_str)
+                stateless.append((index, item))
+        groups = iter(sessions.items())
+
+        async def run_sessions() -> None:
+            # 多个任务共享同一个迭代器，每个会话只会被一个任务取走
+            for group_session_id, group in groups:
+                for group_index, group_item in group:
+                    await results.put(await self._run_batch_item(group_index, group_session_id, group_item))
+
+        tasks = [asyncio.create_task(run_sessions()) for _ in range(min(concurrency, len(sessions)))]
+        if stateless:
+            tasks.append(asyncio.create_task(self._run_stateless_items(stateless, concurrency, results)))
+        logging.info("批量聊天开始，条目 %d 个（会话 %d 个，无状态 %d 个），并发 %d",
+                     len(items), len(sessions), len(stateless), concurrency)
+        try:
+            for _ in range(len(items)):
+                yield self._ndjson_line(await results.get())
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_batch_item(self, index: int, session_id: str, item: ChatBatchItem) -> dict:
+        start = time.perf_counter()
+        try:
+            answer = await self.chat(item.message, session_id)
+        except Exception as e:
+            return self._batch_error(index, session_id, "graph", start, e)
+        BATCH_ITEMS.inc(mode="graph", status="ok")
+        return {"index": index, "session_id": session_id, "ok": True, "answer": answer,
+                "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+    @staticmethod
+    async def _run_stateless_items(entries: list[tuple[int, ChatBatchItem]],
+                                   concurrency: int,
+                                   results: asyncio.Queue) -> None:
+        """
+        通过模型的批量接口执行无状态条目，每完成一个就放入结果队列
+
+        创建模型或批量调用本身失败时，为尚未输出的条目放入错误结果，保证 batch_streamer 能收齐每个条目的结果
+        """
+        start = time.perf_counter()
+        finished: set[int] = set()
+        try:
+            inputs = [[HumanMessage(content=item.message)] for _, item in entries]
+            outputs = create_model_from_config().abatch_as_completed(
+                inputs, RunnableConfig(max_concurrency=concurrency), return_exceptions=True
+            )
+            async for position, output in outputs:
+                index = entries[position][0]
+                finished.add(index)
+                if isinstance(output, Exception):
+                    await results.put(OpenAiChatServiceImpl._batch_error(index, None, "model", start, output))
+                    continue
+                BATCH_ITEMS.inc(mode="model", status="ok")
+                await results.put({"index": index, "session_id": None, "ok": True, "answer": output.text,
+                                   "elapsed_ms": (time.perf_counter() - start) * 1000})
+        except Exception as e:
+            for index, _ in entries:
+                if index not in finished:
+                    await results.put(OpenAiChatServiceImpl._batch_error(index, None, "model", start, e))
+
+    @staticmethod
+    def _batch_error(index: int, session_id: Optional[str], mode: str, start: float, error: Exception) -> dict:
+        BATCH_ITEMS.inc(mode=mode, status="error")
+        logging.warning("批量聊天条目 %d 失败: %r", index, error)
+        detail = {"type": type(error).__name__,
+                  "message": error.detail if isinstance(error, HTTPException) else str(error)}
+        if isinstance(error, HTTPException):
+            detail["status_code"] = error.status_code
+        return {"index": index, "session_id": session_id, "ok": False, "error": detail,
+                "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+    async def get_current_state(self,
+                                session_id: str,
+                                since: Optional[str] = None,
+                                if_none_match: Optional[str] = None) -> Response:
+        """
+        以JSON返回会话的当前状态，ETag 为检查点ID
 
-    async def get_current_state(self, session_id: str) -> str:
+        先只读取最新的检查点ID：与 If-None-Match 相同时直接返回304，不加载状态；
+        检查点的序列化结果按会话和检查点ID缓存，轮询未变化或刚变化的状态时不重复序列化
+        :param session_id: 会话ID
+        :param since: 检查点ID，不为空时只返回该检查点之后新增的消息
+        :param if_none_match: 请求头 If-None-Match
+        :return: JSON响应；since 模式下 delta 为False表示无法计算增量，messages 为完整消息列表
+        """
         config: RunnableConfig = RunnableConfig(configurable={"thread_id": session_id})
+        checkpoint_id = await latest_checkpoint_id(self._graph.checkpointer, session_id)
+        if checkpoint_id is not None and self._etag_matches(if_none_match, checkpoint_id):
+            SNAPSHOT_CACHE_REQUESTS.inc(result="not_modified")
+            return Response(status_code=304, headers=self._state_headers(checkpoint_id))
+        entry = self._snapshot_cache.get(session_id, checkpoint_id)
+        if entry is None:
+            SNAPSHOT_CACHE_REQUESTS.inc(result="miss")
+            state_snapshot: StateSnapshot = await self._graph.aget_state(config=config)
+            logging.info("state_snapshot 状态快照:%s", summarize(state_snapshot), extra=PAYLOAD)
+            entry = self._snapshot_cache.put(session_id, SnapshotEntry.from_snapshot(state_snapshot))
+            if entry.checkpoint_id is not None and self._etag_matches(if_none_match, entry.checkpoint_id):
+                return Response(status_code=304, headers=self._state_headers(entry.checkpoint_id))
+        else:
+            SNAPSHOT_CACHE_REQUESTS.inc(result="hit")
+        headers = self._state_headers(entry.checkpoint_id)
+        if since is None:
+            return Response(content=entry.body, media_type=ResponseConfig.JSON_MEDIA_TYPE, headers=headers)
+        messages = None
+        if since == entry.checkpoint_id:
+            messages = []
+        else:
+            base = await self._snapshot_at(session_id, since)
+            if base is not None:
+                messages = entry.messages_after(base)
+        data = {**entry.header, "since": since, "delta": messages is not None,
+                "messages": messages if messages is not None else entry.messages}
+        return Response(content=json.dumps(data, ensure_ascii=False, default=str),
+                        media_type=ResponseConfig.JSON_MEDIA_TYPE, headers=headers)
+
+    async def _snapshot_at(self, session_id: str, checkpoint_id: str) -> Optional[SnapshotEntry]:
+        """
+        指定检查点的序列化状态，检查点不存在时返回None
+        """
+        entry = self._snapshot_cache.get(session_id, checkpoint_id)
+        if entry is not None:
+            return entry
+        config = RunnableConfig(configurable={"thread_id": session_id, "checkpoint_id": checkpoint_id})
         state_snapshot: StateSnapshot = await self._graph.aget_state(config=config)
-        logging.info(f"state_snapshot 状态快照:{state_snapshot}")
-        return str(state_snapshot)
+        # 检查点不存在时返回的是空快照，config 原样带回请求的检查点ID
+        if state_snapshot.created_at is None or checkpoint_id_of(state_snapshot) != checkpoint_id:
+            return None
+        return self._snapshot_cache.put(session_id, SnapshotEntry.from_snapshot(state_snapshot))
+
+    @staticmethod
+    def _etag_matches(if_none_match: Optional[str], checkpoint_id: str) -> bool:
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")}
+        return "*" in tags or checkpoint_id in tags
+
+    @staticmethod
+    def _state_headers(checkpoint_id: Optional[str]) -> dict[str, str]:
+        # no-cache：客户端和代理可以缓存，但每次使用前都要带 If-None-Match 重新验证
+        headers = {"Cache-Control": "no-cache"}
+        if checkpoint_id is not None:
+            headers["ETag"] = f'"{checkpoint_id}"'
+        return headers
+
+    async def get_history_state(self,
+                                session_id: str,
+                                limit: Optional[int] = None,
+                                before: Optional[str] = None,
+                                projection: SnapshotProjection = SnapshotProjection.FULL) -> StreamingResponse:
+        """
+        以NDJSON流式返回状态快照历史（从新到旧），每行一个快照
+
+        :param session_id: 会话ID
+        :param limit: 最多返回的快照数量
+        :param before: 只返回该检查点之前的快照，用于翻页
+        :param projection: 字段投影
+        :return: NDJSON流式响应
+        """
+        return ResponseConfig.create_streaming_response(
+            content=self.history_streamer(session_id, limit, before, projection),
+            media_type=ResponseConfig.NDJSON_MEDIA_TYPE,
+            headers=ResponseConfig.NDJSON_HEADERS
+        )
+
+    async def history_streamer(self,
+                               session_id: str,
+                               limit: Optional[int],
+                               before: Optional[str],
+                               projection: SnapshotProjection) -> AsyncIterator[str]:
+        """
+        边遍历检查点边输出，内存中最多只保留相邻的两个快照
 
-    async def get_history_state(self, session_id: str) -> str:
+        MESSAGES_DELTA 投影需要父快照才能计算新增消息，因此多读取一个快照且不输出
+        """
         config: RunnableConfig = RunnableConfig(configurable={"thread_id": session_id})
-        async_iterator: AsyncIterator[StateSnapshot] = self._graph.aget_state_history(config=config)
-        state_snapshots: list[StateSnapshot] = []
+        before_config = RunnableConfig(configurable={"thread_id": session_id, "checkpoint_id": before}) \
+            if before else None
+        delta = projection == SnapshotProjection.MESSAGES_DELTA
+        fetch_limit = limit + 1 if delta and limit is not None else limit
+        async_iterator: AsyncIterator[StateSnapshot] = self._graph.aget_state_history(
+            config=config, before=before_config, limit=fetch_limit
+        )
+        pending: Optional[StateSnapshot] = None
+        emitted = 0
         async for state_snapshot in async_iterator:
-            state_snapshots.append(state_snapshot)
-        logging.info(f"state_snapshots 状态快照历史记录:{state_snapshots}")
-        return str(state_snapshots)
+            if not delta:
+                yield self._ndjson_line(snapshot_to_json(state_snapshot, projection))
+                continue
+            if pending is not None:
+                yield self._ndjson_line(snapshot_to_json(pending, projection, message_ids_of(state_snapshot)))
+                emitted += 1
+            pending = state_snapshot
+        if pending is not None and (limit is None or emitted < limit):
+            yield self._ndjson_line(snapshot_to_json(pending, projection))
+
+    @staticmethod
+    def _ndjson_line(data: dict) -> str:
+        return json.dumps(data, ensure_ascii=False, default=str) + "\n"
@@ -4,13 +4,260 @@
 @Time    : 2025/11/18 00:16
 @Desc    : my_mcp_client.py
 """
+import asyncio
+import json
+import logging
 import os
+import time
+from typing import Optional
 
+from dotenv import load_dotenv
 from langchain_core.tools import BaseTool
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain_mcp_adapters.sessions import SSEConnection
+from langchain_mcp_adapters.sessions import SSEConnection, Connection
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp import ClientSession
 
-from app.common.constants import MCP_BASE_URL, MCP_ENDPOINT
+from app.common.constants import MCP_BASE_URL, MCP_ENDPOINT, MCP_SERVERS, MCP_TOOLS_TTL, MCP_CONNECT_TIMEOUT
+from app.common.metrics import Histogram
+
+# 加载.env文件
+load_dotenv()
+
+MCP_DISCOVERY_DURATION = Histogram(
+    "mcp_tool_discovery_seconds",
+    "Latency of loading the tool list from one MCP server, including reconnects",
+    ("server", "result"),
+)
+
+
+def create_mcp_connections_from_config() -> dict[str, Connection]:
+    """
+    从.env文件读取MCP服务器配置
+
+    优先读取 MCP_SERVERS（JSON，键为服务器名称，值为 langchain-mcp-adapters 的连接配置），
+    未配置时回退到 MCP_BASE_URL + MCP_ENDPOINT 的单服务器配置
+    :return: 服务器名称到连接配置的映射
+    """
+    servers = os.getenv(MCP_SERVERS)
+    if servers:
+        return json.loads(servers)
+    return {
+        "mcp_server": SSEConnection(
+            url=os.getenv(MCP_BASE_URL) + os.getenv(MCP_ENDPOINT),
+            transport="sse",
+            timeout=60,
+            headers={
+                "Authorization": "Bearer xxx",
+                "Content-Type": "application/json"
+            },
+        )
+    }
+
+
+class McpServerSession:
+    """
+    单个MCP服务器的长连接会话
+
+    会话由独立的后台任务持有（SSE客户端的上下文必须在同一个任务内进入和退出），
+    工具列表通过该会话加载，工具调用也复用该会话，不再为每次调用重新握手。
+    """
+    name: str
+    tools: list[BaseTool]
+    refreshed_at: Optional[float]
+    last_error: Optional[str]
+
+    def __init__(self, name: str, client: MultiServerMCPClient, connect_timeout: float):
+        self.name = name
+        self.tools = []
+        self.refreshed_at = None
+        self.last_error = None
+        self._client = client
+        self._connect_timeout = connect_timeout
+        self._session: Optional[ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self._session is not None and self._task is not None and not self._task.done()
+
+    async def _hold_session(self, connected: asyncio.Future) -> None:
+        try:
+            async with self._client.session(self.name) as session:
+                self._session = session
+                connected.set_result(session)
+                await self._closing.wait()
+        except BaseException as e:
+            if not connected.done():
+                connected.set_exception(e)
+            raise
+        finally:
+            self._session = None
+
+    async def connect(self) -> ClientSession:
+        """
+        建立长连接会话
+        """
+        await self.close()
+        self._closing = asyncio.Event()
+        connected = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._hold_session(connected), name=f"mcp-session-{self.name}")
+        return await asyncio.wait_for(connected, timeout=self._connect_timeout)
+
+    async def refresh(self) -> list[BaseTool]:
+        """
+        通过长连接会话刷新工具列表，会话断开时自动重连
+        """
+        start = time.perf_counter()
+        try:
+            session = self._session if self.connected else await self.connect()
+            tools = await load_mcp_tools(session, server_name=self.name)
+        except Exception:
+            MCP_DISCOVERY_DURATION.observe(time.perf_counter() - start, server=self.name, result="error")
+            await self.close()
+            raise
+        MCP_DISCOVERY_DURATION.observe(time.perf_counter() - start, server=self.name, result="success")
+        self.tools = tools
+        self.refreshed_at = time.monotonic()
+        self.last_error = None
+        return tools
+
+    async def close(self) -> None:
+        """
+        关闭长连接会话
+        """
+        if self._task is None:
+            return
+        self._closing.set()
+        try:
+            await self._task
+        except BaseException as e:
+            logging.debug("MCP服务器 %s 会话关闭异常: %r", self.name, e)
+        self._task = None
+
+
+class McpToolRegistry:
+    """
+    进程级MCP工具注册表
+
+    为每个服务器维护一个长连接会话，并按TTL缓存工具列表、在后台定期刷新。
+    某个服务器不可达时继续使用它最后一次成功加载的工具。
+    """
+
+    def __init__(self, connections: dict[str, Connection], ttl: float = 300.0, connect_timeout: float = 10.0):
+        self._ttl = ttl
+        self._client = MultiServerMCPClient(connections)
+        self._servers = {
+            name: McpServerSession(name, self._client, connect_timeout) for name in connections
+        }
+        self._tools: list[BaseTool] = []
+        self._loaded = False
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls) -> "McpToolRegistry":
+        """
+        从.env文件创建工具注册表
+        """
+        return cls(
+            connections=create_mcp_connections_from_config(),
+            ttl=float(os.getenv(MCP_TOOLS_TTL, "300")),
+            connect_timeout=float(os.getenv(MCP_CONNECT_TIMEOUT, "10")),
+        )
+
+    @property
+    def stale(self) -> bool:
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self._ttl
+
+    async def start(self) -> None:
+        """
+        启动注册表：加载一次工具并开启后台刷新任务
+        """
+        await self.refresh()
+        self._background_task = asyncio.create_task(self._refresh_periodically(), name="mcp-tool-refresh")
+
+    async def stop(self) -> None:
+        """
+        停止后台刷新并关闭全部长连接会话
+        """
+        for task in (self._background_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._background_task = None
+        self._refresh_task = None
+        for server in self._servers.values():
+            await server.close()
+
+    async def get_tools(self) -> list[BaseTool]:
+        """
+        获取当前缓存的MCP工具
+
+        首次调用时同步加载；缓存过期时在后台刷新，本次调用直接返回最近一次成功的工具集
+        """
+        if not self._loaded:
+            await self.refresh()
+        elif self.stale and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self.refresh(), name="mcp-tool-refresh-once")
+        return self._tools
+
+    async def refresh(self) -> list[BaseTool]:
+        """
+        刷新所有服务器的工具列表，失败的服务器保留最后一次成功的工具
+        """
+        async with self._refresh_lock:
+            start = time.perf_counter()
+            servers = list(self._servers.values())
+            results = await asyncio.gather(*(server.refresh() for server in servers), return_exceptions=True)
+            for server, result in zip(servers, results):
+                if isinstance(result, BaseException):
+                    server.last_error = repr(result)
+                    logging.warning("MCP服务器 %s 工具刷新失败，继续使用 %d 个缓存工具: %r",
+                                    server.name, len(server.tools), result)
+            self._tools = [tool for server in servers for tool in server.tools]
+            self._loaded = True
+            self._refreshed_at = time.monotonic()
+            logging.info("MCP工具刷新完成，共 %d 个工具，耗时 %.1fms",
+                         len(self._tools), (time.perf_counter() - start) * 1000)
+            return self._tools
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._ttl)
+            try:
+                await self.refresh()
+            except Exception:
+                logging.exception("MCP工具后台刷新失败")
+
+    def stats(self) -> dict:
+        """
+        注册表状态
+        """
+        now = time.monotonic()
+        return {
+            "tool_count": len(self._tools),
+            "ttl": self._ttl,
+            "servers": {
+                name: {
+                    "connected": server.connected,
+                    "tool_count": len(server.tools),
+                    "age": None if server.refreshed_at is None else now - server.refreshed_at,
+                    "last_error": server.last_error,
+                }
+                for name, server in self._servers.items()
+            },
+        }
+
+
+# 进程级单例，由 AgentRuntime 负责启动与停止
+mcp_tool_registry = McpToolRegistry.from_config()
 
 
 async def get_mcp_tools() -> list[BaseTool]:
@@ -18,18 +265,4 @@ async def get_mcp_tools() -> list[BaseTool]:
     获取MCP工具
     :return: MCP工具
     """
-    multi_server_mcp_client = MultiServerMCPClient(
-        {
-            "mcp_server": SSEConnection(
-                url=os.getenv(MCP_BASE_URL) + os.getenv(MCP_ENDPOINT),
-                transport="sse",
-                timeout=60,
-                headers={
-                    "Authorization": "Bearer xxx",
-                    "Content-Type": "application/json"
-                },
-            )
-        }
-    )
-    mcp_tools = await multi_server_mcp_client.get_tools()
-    return mcp_tools
+    return await mcp_tool_registry.get_tools()
@@ -0,0 +1,229 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:16
+@Desc    : tool_executor.py 工具调用的并发控制、超时与故障隔离
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+from langgraph.errors import GraphBubbleUp
+from langgraph.prebuilt.tool_node import ToolCallRequest
+from langgraph.types import Command
+
+from app.common.constants import (
+    TOOL_TIMEOUT, TOOL_MAX_CONCURRENCY, TOOL_GLOBAL_MAX_CONCURRENCY, TOOL_THREAD_POOL_SIZE, TOOL_LIMITS
+)
+from app.common.metrics import Counter
+
+TOOL_CALLS = Counter(
+    "tool_calls_total",
+    "Tool calls by tool and status (success, error, timeout, cancelled)",
+    ("tool", "status"),
+)
+TOOL_CALL_SECONDS = Counter(
+    "tool_call_seconds_total",
+    "Total tool call latency including time spent waiting for a concurrency slot",
+    ("tool",),
+)
+
+TOOL_ERROR_TEMPLATE = "Error: {error}\n Please fix your mistakes."
+
+
+@dataclass(frozen=True)
+class ToolLimits:
+    """单个工具的执行限制"""
+    # 单次调用的超时时间（秒），包含等待并发名额的时间
+    timeout: float = 30.0
+    # 该工具同时执行的最大调用数
+    max_concurrency: int = 4
+
+
+@dataclass
+class _ToolLatency:
+    count: int = 0
+    max_seconds: float = 0.0
+    last_seconds: float = 0.0
+
+
+class ToolExecutor:
+    """
+    工具执行器
+
+    作为ToolNode的 awrap_tool_call 拦截器使用。ToolNode会把同一条AIMessage中的多个工具调用并发执行，
+    执行器在此基础上为每次调用加上：
+    - 全局并发上限和按工具的并发上限，先获取工具名额再获取全局名额，避免排队中的调用占用全局名额
+    - 按工具的超时，超时或抛出异常的调用转换为 status="error" 的工具消息，不影响同一轮的其他调用
+    - 同步的 StructuredTool 在独立的有界线程池中执行，不占用事件循环的默认线程池
+    注意：超时只能停止等待，已经在线程中运行的同步工具会继续运行直到返回。
+    """
+
+    def __init__(self,
+                 default_limits: Optional[ToolLimits] = None,
+                 limits: Optional[dict[str, ToolLimits]] = None,
+                 max_concurrency: int = 16,
+                 thread_pool_size: int = 8):
+        self.default_limits = default_limits or ToolLimits()
+        self._limits = limits or {}
+        self.max_concurrency = max_concurrency
+        self.thread_pool_size = thread_pool_size
+        self._global_semaphore = asyncio.Semaphore(max_concurrency)
+        self._tool_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        # 工具对象身份 -> (原工具, 在线程池中执行的副本)，保留原工具引用防止 id 被复用
+        self._threaded_tools: dict[int, tuple[BaseTool, BaseTool]] = {}
+        self._latency: dict[str, _ToolLatency] = {}
+
+    @classmethod
+    def from_config(cls) -> "ToolExecutor":
+        """
+        从.env文件创建工具执行器
+
+        TOOL_LIMITS 为JSON，例如 {"get_weather": {"timeout": 5, "max_concurrency": 2}}
+        """
+        default_limits = ToolLimits(
+            timeout=float(os.getenv(TOOL_TIMEOUT, "30")),
+            max_concurrency=int(os.getenv(TOOL_MAX_CONCURRENCY, "4")),
+        )
+        overrides = json.loads(os.getenv(TOOL_LIMITS) or "{}")
+        return cls(
+            default_limits=default_limits,
+            limits={
+                name: ToolLimits(**{"timeout": default_limits.timeout,
+                                    "max_concurrency": default_limits.max_concurrency, **override})
+                for name, override in overrides.items()
+            },
+            max_concurrency=int(os.getenv(TOOL_GLOBAL_MAX_CONCURRENCY, "16")),
+            thread_pool_size=int(os.getenv(TOOL_THREAD_POOL_SIZE, "8")),
+        )
+
+    def limits_for(self, tool_name: str) -> ToolLimits:
+        return self._limits.get(tool_name, self.default_limits)
+
+    def _semaphore_for(self, tool_name: str) -> asyncio.Semaphore:
+        semaphore = self._tool_semaphores.get(tool_name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limits_for(tool_name).max_concurrency)
+            self._tool_semaphores[tool_name] = semaphore
+        return semaphore
+
+    def _get_thread_pool(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_pool_size, thread_name_prefix="tool")
+        return self._thread_pool
+
+    def _offload(self, func: Callable) -> Callable[..., Awaitable]:
+        @functools.wraps(func)
+        async def run_in_thread_pool(*args, **kwargs):
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_thread_pool(), functools.partial(context.run, func, *args, **kwargs)
+            )
+
+        return run_in_thread_pool
+
+    def _threaded(self, tool: Optional[BaseTool]) -> Optional[BaseTool]:
+        """
+        同步的 StructuredTool 替换为在专用线程池中执行的副本，其他工具原样返回
+        """
+        if not isinstance(tool, StructuredTool) or tool.coroutine is not None or tool.func is None:
+            return tool
+        cached = self._threaded_tools.get(id(tool))
+        if cached is None:
+            cached = (tool, tool.model_copy(update={"coroutine": self._offload(tool.func)}))
+            self._threaded_tools[id(tool)] = cached
+        return cached[1]
+
+    def _record(self, tool_name: str, status: str, seconds: float) -> None:
+        TOOL_CALLS.inc(tool=tool_name, status=status)
+        TOOL_CALL_SECONDS.inc(seconds, tool=tool_name)
+        latency = self._latency.setdefault(tool_name, _ToolLatency())
+        latency.count += 1
+        latency.last_seconds = seconds
+        latency.max_seconds = max(latency.max_seconds, seconds)
+
+    async def _execute_limited(self,
+                               request: ToolCallRequest,
+                               execute: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]]
+                               ) -> ToolMessage | Command:
+        async with self._semaphore_for(request.tool_call["name"]), self._global_semaphore:
+            return await execute(request.override(tool=self._threaded(request.tool)))
+
+    async def awrap(self,
+                    request: ToolCallRequest,
+                    execute: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]]) -> ToolMessage | Command:
+        """
+        ToolNode的异步工具调用拦截器
+        :param request: 工具调用请求
+        :param execute: 实际执行工具调用的函数
+        :return: 工具消息，失败或超时时为错误状态的工具消息
+        """
+        tool_name = request.tool_call["name"]
+        limits = self.limits_for(tool_name)
+        start = time.perf_counter()
+        status = "success"
+        try:
+            result = await asyncio.wait_for(self._execute_limited(request, execute), timeout=limits.timeout)
+            if isinstance(result, ToolMessage) and result.status == "error":
+                status = "error"
+            return result
+        except GraphBubbleUp:
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logging.warning("工具 %s 执行超过 %.1fs，已放弃等待", tool_name, limits.timeout)
+            return self._error_message(request, f"工具 {tool_name} 执行超时（{limits.timeout:g}s）")
+        except Exception as e:
+            status = "error"
+            logging.warning("工具 %s 执行失败: %r", tool_name, e)
+            return self._error_message(request, repr(e))
+        finally:
+            self._record(tool_name, status, time.perf_counter() - start)
+
+    @staticmethod
+    def _error_message(request: ToolCallRequest, error: str) -> ToolMessage:
+        return ToolMessage(content=TOOL_ERROR_TEMPLATE.format(error=error), name=request.tool_call["name"],
+                           tool_call_id=request.tool_call["id"], status="error")
+
+    def shutdown(self) -> None:
+        """
+        关闭线程池，下次执行同步工具时会重新创建
+        """
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+
+    def stats(self) -> dict:
+        """
+        按工具统计调用次数与耗时
+        """
+        return {
+            "max_concurrency": self.max_concurrency,
+            "thread_pool_size": self.thread_pool_size,
+            "tools": {
+                name: {
+                    "calls": latency.count,
+                    "errors": TOOL_CALLS.value(tool=name, status="error"),
+                    "timeouts": TOOL_CALLS.value(tool=name, status="timeout"),
+                    "avg_ms": TOOL_CALL_SECONDS.value(tool=name) / latency.count * 1000,
+                    "max_ms": latency.max_seconds * 1000,
+                    "last_ms": latency.last_seconds * 1000,
+                    "timeout": self.limits_for(name).timeout,
+                    "max_concurrency": self.limits_for(name).max_concurrency,
+                }
+                for name, latency in sorted(self._latency.items())
+            },
+        }
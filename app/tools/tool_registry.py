@@ -0,0 +1,151 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:16
+@Desc    : tool_registry.py 按工具集指纹缓存绑定工具后的模型，按工具对象缓存ToolNode实例
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
+from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt.tool_node import AsyncToolCallWrapper
+
+
+def chain_tool_call_wrappers(wrappers: Sequence[AsyncToolCallWrapper]) -> Optional[AsyncToolCallWrapper]:
+    """
+    把多个工具调用拦截器组合为一个，列表中靠前的拦截器位于外层
+    """
+    if not wrappers:
+        return None
+
+    def compose(outer: AsyncToolCallWrapper, inner: AsyncToolCallWrapper) -> AsyncToolCallWrapper:
+        async def wrapper(request, execute):
+            return await outer(request, lambda req: inner(req, execute))
+
+        return wrapper
+
+    composed = wrappers[-1]
+    for outer in reversed(wrappers[:-1]):
+        composed = compose(outer, composed)
+    return composed
+
+
+def _tool_schema_digest(tool: BaseTool) -> str:
+    """
+    计算单个工具的名称和参数结构摘要
+    """
+    schema = tool.args_schema if isinstance(tool.args_schema, dict) else tool.args
+    payload = json.dumps([tool.name, tool.description, schema], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ToolBindingRegistry:
+    """
+    工具绑定注册表
+
+    根据当前工具集（名称 + 参数结构摘要）计算指纹，每个指纹只保留一个绑定了工具的模型，
+    只有工具集真正变化时才会重新绑定；绑定模型只用到工具的结构，MCP重连后结构相同的新工具对象可以复用。
+    ToolNode 会调用工具对象本身（MCP工具绑定在建立它的会话上），因此按工具对象身份缓存，
+    工具对象被替换后创建新的ToolNode。两种缓存超过容量时都按LRU淘汰。
+    提供 tool_call_wrappers 时，创建的ToolNode会用它们依次拦截每一次工具调用（例如结果缓存、并发控制）。
+    """
+
+    def __init__(self,
+                 model_factory: Callable[[], BaseChatModel],
+                 max_entries: int = 8,
+                 tool_call_wrappers: Sequence[AsyncToolCallWrapper] = ()):
+        self._model_factory = model_factory
+        self._max_entries = max_entries
+        self._tool_call_wrapper = chain_tool_call_wrappers(tool_call_wrappers)
+        # 工具对象身份 -> 指纹，工具注册表返回的工具对象在刷新之前保持不变，命中时无需重新计算摘要
+        # 值中保留工具引用，防止对象被回收后 id 被复用
+        self._fingerprints: dict[tuple[int, ...], tuple[list[BaseTool], str]] = {}
+        self._bound_models: OrderedDict[str, Runnable] = OrderedDict()
+        # 工具对象身份 -> ToolNode，ToolNode 持有工具引用，条目存在期间 id 不会被复用
+        self._tool_nodes: OrderedDict[tuple[int, ...], ToolNode] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, tools: list[BaseTool]) -> str:
+        """
+        计算工具集指纹
+        :param tools: 工具列表
+        :return: 指纹
+        """
+        identity = tuple(id(tool) for tool in tools)
+        cached = self._fingerprints.get(identity)
+        if cached is not None:
+            return cached[1]
+        digests = sorted(_tool_schema_digest(tool) for tool in tools)
+        fingerprint = hashlib.sha256("".join(digests).encode("utf-8")).hexdigest()[:16]
+        if len(self._fingerprints) >= self._max_entries * 4:
+            self._fingerprints.clear()
+        self._fingerprints[identity] = (list(tools), fingerprint)
+        return fingerprint
+
+    def _lookup(self, cache: OrderedDict, key: Hashable) -> Optional[Runnable]:
+        entry = cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        cache.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _store(self, cache: OrderedDict, key: Hashable, entry: Runnable) -> None:
+        cache[key] = entry
+        while len(cache) > self._max_entries:
+            evicted, _ = cache.popitem(last=False)
+            logging.info("工具集 %s 的缓存已被淘汰", evicted if isinstance(evicted, str) else "ToolNode")
+
+    def get_bound_model(self, tools: list[BaseTool]) -> Runnable:
+        """
+        获取绑定了给定工具集的模型
+        :param tools: 工具列表
+        :return: 绑定工具后的模型
+        """
+        fingerprint = self.fingerprint(tools)
+        bound_model = self._lookup(self._bound_models, fingerprint)
+        if bound_model is None:
+            bound_model = self._model_factory().bind_tools(tools)
+            self._store(self._bound_models, fingerprint, bound_model)
+            logging.info("工具集变化，重新绑定模型，指纹: %s，工具数: %d", fingerprint, len(tools))
+        return bound_model
+
+    def get_tool_node(self, tools: list[BaseTool]) -> ToolNode:
+        """
+        获取包含给定工具集的ToolNode
+        :param tools: 工具列表
+        :return: ToolNode实例
+        """
+        identity = tuple(id(tool) for tool in tools)
+        tool_node = self._lookup(self._tool_nodes, identity)
+        if tool_node is None:
+            tool_node = ToolNode(tools, awrap_tool_call=self._tool_call_wrapper)
+            self._store(self._tool_nodes, identity, tool_node)
+        return tool_node
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        self._fingerprints.clear()
+        self._bound_models.clear()
+        self._tool_nodes.clear()
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        """
+        return {
+            "bound_models": len(self._bound_models),
+            "tool_nodes": len(self._tool_nodes),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -8,9 +8,12 @@ import logging
 
 from langchain_core.tools import tool
 
+from app.cache.tool_cache import cacheable
+
 TOOL_GET_ALL_USERS = "get_all_users"
 
 
+@cacheable(ttl=30)
 @tool(name_or_callable=TOOL_GET_ALL_USERS, description="获取全部用户")
 def get_all_users() -> dict[str, list[dict[str, str | int]]]:
     logging.info("工具调用 => get_all_users")
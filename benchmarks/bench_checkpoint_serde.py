@@ -0,0 +1,128 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:28
+@Desc    : bench_checkpoint_serde.py 比较检查点压缩前后每个检查点写入的字节数和读取延迟
+
+用合成的长对话（每轮包含问题、工具调用、较长的工具结果和回答）驱动一个只追加消息的图，
+检查点保存在内存中，分别使用不压缩、zlib、zstd（可用时）的序列化器。
+写入字节数为序列化器输出的blob大小，即写入Postgres checkpoint_blobs/checkpoint_writes 的数据量；
+读取延迟为每轮结束后 aget_state 的耗时，包含解压和反序列化，不包含网络和数据库的开销。
+运行方式: python -m benchmarks.bench_checkpoint_serde [--turns 100] [--threads 3] [--threshold 1024]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from app.checkpoint.serde import CompressedSerializer, zstd_available
+
+
+class _CountingSerializer(SerializerProtocol):
+    """统计写入字节数的序列化器包装"""
+
+    def __init__(self, serde: SerializerProtocol):
+        self.serde = serde
+        self.bytes_written = 0
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        self.bytes_written += len(data or b"")
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        return self.serde.loads_typed(data)
+
+
+def _make_turn(index: int, tool_result_repeat: int) -> list[BaseMessage]:
+    call_id = f"call_{index}"
+    users = ",".join(f'{{"id": "{uuid.uuid4().hex}", "name": "user_{i}", "age": {20 + i % 40}, '
+                     f'"email": "user_{i}@example.com"}}'
+                     for i in range(tool_result_repeat))
+    return [
+        HumanMessage(content=f"第{index}轮问题：请帮我查询用户列表并分析年龄分布。", id=str(uuid.uuid4())),
+        AIMessage(content="", tool_calls=[{"name": "get_all_users", "args": {"page": index}, "id": call_id}],
+                  id=str(uuid.uuid4())),
+        ToolMessage(content=f'{{"users": [{users}]}}', tool_call_id=call_id, name="get_all_users",
+                    id=str(uuid.uuid4())),
+        AIMessage(content=f"第{index}轮回答：用户年龄集中在25到35岁之间，其中邮箱域名均为 example.com。" * 3,
+                  id=str(uuid.uuid4())),
+    ]
+
+
+def _build_graph(serde: SerializerProtocol):
+    builder = StateGraph(MessagesState)
+    builder.add_node("append", lambda state: {})
+    builder.add_edge(START, "append")
+    builder.add_edge("append", END)
+    return builder.compile(checkpointer=InMemorySaver(serde=serde))
+
+
+async def _run_variant(serde: SerializerProtocol, args: argparse.Namespace) -> dict:
+    counting = _CountingSerializer(serde)
+    graph = _build_graph(counting)
+    write_seconds: list[float] = []
+    read_seconds: list[float] = []
+    checkpoints = 0
+    for _ in range(args.threads):
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        for index in range(args.turns):
+            start = time.perf_counter()
+            await graph.ainvoke({"messages": _make_turn(index, args.tool_result_size)}, config)
+            write_seconds.append(time.perf_counter() - start)
+            # 每次 ainvoke 写入 input、append 两个超步的检查点
+            checkpoints += 2
+            start = time.perf_counter()
+            await graph.aget_state(config)
+            read_seconds.append(time.perf_counter() - start)
+    return {
+        "bytes_per_checkpoint": counting.bytes_written / checkpoints,
+        "total_mb": counting.bytes_written / 1024 / 1024,
+        "write_ms": statistics.mean(write_seconds) * 1000,
+        "read_p50_ms": statistics.median(read_seconds) * 1000,
+        "read_last_ms": statistics.mean(read_seconds[-args.threads:]) * 1000,
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    variants: list[tuple[str, Optional[SerializerProtocol]]] = [("不压缩", JsonPlusSerializer())]
+    variants.append(("zlib", CompressedSerializer(codec="zlib", threshold=args.threshold, level=args.level)))
+    if zstd_available():
+        variants.append(("zstd", CompressedSerializer(codec="zstd", threshold=args.threshold, level=args.level)))
+    else:
+        print("未安装 zstandard（或 Python < 3.14），跳过 zstd")
+
+    print(f"{'序列化':<8} {'字节/检查点':>12} {'总写入(MB)':>11} {'压缩比':>7} "
+          f"{'每轮写入(ms)':>12} {'读取p50(ms)':>12} {'末轮读取(ms)':>12}")
+    baseline = None
+    for name, serde in variants:
+        result = await _run_variant(serde, args)
+        baseline = baseline or result["bytes_per_checkpoint"]
+        print(f"{name:<8} {result['bytes_per_checkpoint']:>15.0f} {result['total_mb']:>13.2f} "
+              f"{baseline / result['bytes_per_checkpoint']:>9.2f} {result['write_ms']:>15.2f} "
+              f"{result['read_p50_ms']:>14.3f} {result['read_last_ms']:>15.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=100, help="每个会话的轮数")
+    parser.add_argument("--threads", type=int, default=3, help="会话数")
+    parser.add_argument("--tool-result-size", type=int, default=50, help="每个工具结果包含的用户条数")
+    parser.add_argument("--threshold", type=int, default=1024, help="压缩阈值（字节）")
+    parser.add_argument("--level", type=int, default=None, help="压缩级别，默认使用算法的默认级别")
+    args = parser.parse_args()
+
+    print(f"会话: {args.threads}，每个会话 {args.turns} 轮，压缩阈值: {args.threshold} 字节")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
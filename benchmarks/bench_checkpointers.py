@@ -0,0 +1,180 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:30
+@Desc    : bench_checkpointers.py 比较不同检查点后端（及异步写回）下每轮对话的延迟
+
+用一个不调用模型的三节点图（agent -> tools -> agent，每轮写入4个检查点和3组写入）模拟一轮带工具调用的对话，
+多个会话并发执行，统计每轮 ainvoke 的延迟，即检查点读写在每轮中增加的开销。
+序列化器与服务一致（CHECKPOINT_COMPRESSION），SQLite文件写在临时目录。
+异步写回只把检查点写入移出请求路径，不减少CPU开销：单会话或写入受磁盘/网络延迟限制时降低每轮延迟，
+CPU已经饱和时（例如单核上多会话并发）反而会因为额外的任务调度略微变慢。
+--postgres 时额外使用 .env 中的Postgres配置（会在库中写入测试会话，结束后删除）。
+运行方式: python -m benchmarks.bench_checkpointers [--turns 30] [--threads 4] [--postgres]
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from typing import AsyncContextManager, AsyncIterator, Callable
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from app.checkpoint.backends import (
+    AsyncSqliteSaver, CheckpointBackendConfig, WriteBehindSaver, close_checkpointer, create_memory_saver,
+    open_sqlite_saver
+)
+from app.checkpoint.serde import create_checkpoint_serde_from_config
+
+SaverFactory = Callable[[], AsyncContextManager[BaseCheckpointSaver]]
+
+
+def _build_graph(checkpointer: BaseCheckpointSaver, tool_result_size: int):
+    def agent(state: MessagesState) -> dict:
+        if isinstance(state["messages"][-1], ToolMessage):
+            return {"messages": [AIMessage(content="根据查询结果，用户年龄集中在25到35岁之间。")]}
+        call_id = f"call_{uuid.uuid4().hex[:8]}"
+        return {"messages": [AIMessage(content="", tool_calls=[{"name": "get_all_users", "args": {},
+                                                                  "id": call_id}])]}
+
+    def tools(state: MessagesState) -> dict:
+        call_id = state["messages"][-1].tool_calls[0]["id"]
+        users = ",".join(f'{{"id": "{uuid.uuid4().hex}", "name": "user_{i}", "age": {20 + i % 40}}}'
+                         for i in range(tool_result_size))
+        return {"messages": [ToolMessage(content=f'{{"users": [{users}]}}', tool_call_id=call_id)]}
+
+    def route(state: MessagesState) -> str:
+        return "tools" if getattr(state["messages"][-1], "tool_calls", None) else END
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("agent", agent)
+    builder.add_node("tools", tools)
+    builder.add_edge(START, "agent")
+    builder.add_conditional_edges("agent", route, ["tools", END])
+    builder.add_edge("tools", "agent")
+    return builder.compile(checkpointer=checkpointer)
+
+
+@asynccontextmanager
+async def _local_saver(config: CheckpointBackendConfig) -> AsyncIterator[BaseCheckpointSaver]:
+    serde = create_checkpoint_serde_from_config()
+    if config.backend == "sqlite":
+        saver = await open_sqlite_saver(config, serde=serde)
+    else:
+        saver = create_memory_saver(config, serde=serde)
+        if config.memory_snapshot_path:
+            await saver.start()
+    if config.write_behind:
+        saver = WriteBehindSaver(saver, max_pending=config.write_behind_max_pending)
+    try:
+        yield saver
+    finally:
+        await close_checkpointer(saver)
+
+
+@asynccontextmanager
+async def _postgres_saver(write_behind: bool) -> AsyncIterator[BaseCheckpointSaver]:
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+    from app.checkpoint.pool import PostgresPoolConfig, open_pool, close_pool
+    from app.config import create_postgres_pool_from_config
+
+    pool_config = PostgresPoolConfig.from_config()
+    pool = create_postgres_pool_from_config()
+    await open_pool(pool, pool_config)
+    saver = AsyncPostgresSaver(pool, serde=create_checkpoint_serde_from_config())
+    await saver.setup()
+    if write_behind:
+        saver = WriteBehindSaver(saver)
+    try:
+        yield saver
+    finally:
+        await close_checkpointer(saver)
+        await close_pool(pool, pool_config)
+        create_postgres_pool_from_config.cache_clear()
+
+
+async def _run_variant(saver: BaseCheckpointSaver, args: argparse.Namespace) -> dict:
+    graph = _build_graph(saver, args.tool_result_size)
+    thread_ids = [f"bench-{uuid.uuid4().hex}" for _ in range(args.threads)]
+
+    async def run_thread(thread_id: str) -> list[float]:
+        config = {"configurable": {"thread_id": thread_id}}
+        latencies = []
+        for index in range(args.turns):
+            start = time.perf_counter()
+            await graph.ainvoke({"messages": [HumanMessage(content=f"第{index}轮：查询用户年龄分布")]}, config)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_thread(thread_id) for thread_id in thread_ids))
+    elapsed = time.perf_counter() - start
+    flush_start = time.perf_counter()
+    if isinstance(saver, WriteBehindSaver):
+        await saver.barrier()
+    flush = time.perf_counter() - flush_start
+    for thread_id in thread_ids:
+        await saver.adelete_thread(thread_id)
+    latencies = sorted(latency for thread in results for latency in thread)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "turns_per_s": len(latencies) / elapsed,
+        "flush_ms": flush * 1000,
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        base = CheckpointBackendConfig(sqlite_path=f"{directory}/checkpoints.sqlite")
+        variants: list[tuple[str, SaverFactory]] = [
+            ("memory", lambda: _local_saver(replace(base, backend="memory"))),
+            ("memory+快照", lambda: _local_saver(replace(base, backend="memory", memory_snapshot_interval=1.0,
+                                                       memory_snapshot_path=f"{directory}/snapshot.pkl"))),
+        ]
+        if AsyncSqliteSaver is not None:
+            variants += [
+                ("sqlite NORMAL", lambda: _local_saver(replace(base, backend="sqlite"))),
+                ("sqlite FULL", lambda: _local_saver(replace(base, backend="sqlite", sqlite_synchronous="FULL"))),
+                ("sqlite FULL+写回", lambda: _local_saver(replace(base, backend="sqlite", sqlite_synchronous="FULL",
+                                                                write_behind=True))),
+            ]
+        else:
+            print("未安装 langgraph-checkpoint-sqlite，跳过 sqlite")
+        if args.postgres:
+            variants += [
+                ("postgres", lambda: _postgres_saver(write_behind=False)),
+                ("postgres+写回", lambda: _postgres_saver(write_behind=True)),
+            ]
+
+        print(f"{'后端':<16} {'p50(ms)':>9} {'p95(ms)':>9} {'轮/秒':>9} {'写回收尾(ms)':>13}")
+        for name, factory in variants:
+            async with factory() as saver:
+                # 预热：建表、首次序列化等一次性开销不计入结果
+                await _run_variant(saver, argparse.Namespace(**{**vars(args), "turns": 1}))
+                result = await _run_variant(saver, args)
+            print(f"{name:<16} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                  f"{result['turns_per_s']:>10.1f} {result['flush_ms']:>15.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=30, help="每个会话的轮数")
+    parser.add_argument("--threads", type=int, default=4, help="并发的会话数")
+    parser.add_argument("--tool-result-size", type=int, default=20, help="每个工具结果包含的用户条数")
+    parser.add_argument("--postgres", action="store_true", help="同时测试 .env 中配置的Postgres")
+    args = parser.parse_args()
+
+    print(f"会话: {args.threads}，每个会话 {args.turns} 轮")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
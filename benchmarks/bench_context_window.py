@@ -0,0 +1,94 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:18
+@Desc    : bench_context_window.py 统计上下文窗口管理在长对话中节省的提示词token
+
+运行方式: python -m benchmarks.bench_context_window [--turns 50] [--budget 4000] [--threshold 6000]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from app.agent.context import ContextWindowManager, with_summary
+
+SUMMARY_MAX_CHARS = 1500
+
+
+async def _stub_summarizer(summary: Optional[str], messages: list[BaseMessage]) -> str:
+    """离线摘要函数：只截取每条消息的开头，模拟一个长度受限的增量摘要"""
+    lines = [f"{message.type}: {message.text[:60]}" for message in messages]
+    return ((summary or "") + "\n" + "\n".join(lines))[-SUMMARY_MAX_CHARS:]
+
+
+def _make_turn(index: int) -> list[BaseMessage]:
+    call_id = f"call_{index}"
+    return [
+        HumanMessage(content=f"第{index}轮问题：请帮我查询用户列表并分析年龄分布。" * 4, id=str(uuid.uuid4())),
+        AIMessage(content="", tool_calls=[{"name": "get_all_users", "args": {}, "id": call_id}],
+                  id=str(uuid.uuid4())),
+        ToolMessage(content='{"users": [{"name": "Alice", "age": 25}, {"name": "Bob", "age": 30}]}' * 10,
+                    tool_call_id=call_id, name="get_all_users", id=str(uuid.uuid4())),
+        AIMessage(content=f"第{index}轮回答：用户年龄集中在25到35岁之间。" * 12, id=str(uuid.uuid4())),
+    ]
+
+
+async def run(turns: int, manager: ContextWindowManager) -> None:
+    system = SystemMessage(content="你是一个全能的人工智能助手，你的名字叫糯米", id=str(uuid.uuid4()))
+    full_history: list[BaseMessage] = [system]
+    windowed_history: list[BaseMessage] = [system]
+    summary: Optional[str] = None
+    full_tokens = windowed_tokens = 0
+    compact_seconds = 0.0
+    compactions = 0
+
+    for index in range(turns):
+        turn = _make_turn(index)
+        human, tool_call, tool_result, answer = turn
+        full_history.append(human)
+        windowed_history.append(human)
+
+        start = time.perf_counter()
+        update = await manager.compact(windowed_history, summary)
+        compact_seconds += time.perf_counter() - start
+        if update is not None:
+            removed = {message.id for message in update["messages"]}
+            windowed_history = [message for message in windowed_history if message.id not in removed]
+            summary = update["summary"]
+            compactions += 1
+
+        # 每轮两次模型调用：发起工具调用、根据工具结果回答
+        for produced in ([tool_call], [tool_result, answer]):
+            full_tokens += manager.count_tokens(full_history)
+            windowed_tokens += manager.count_tokens(with_summary(windowed_history, summary))
+            full_history.extend(produced)
+            windowed_history.extend(produced)
+
+    saved = full_tokens - windowed_tokens
+    print(f"轮次: {turns}，预算: {manager.token_budget}，阈值: {manager.summary_threshold}，最大轮次: {manager.max_turns}")
+    print(f"不做窗口管理的提示词token总量: {full_tokens}")
+    print(f"窗口管理后的提示词token总量:   {windowed_tokens}")
+    print(f"节省: {saved} ({saved / full_tokens:.1%})")
+    print(f"最终历史消息数: 全量 {len(full_history)} / 窗口 {len(windowed_history)}")
+    print(f"摘要模型调用次数: {compactions}（每次都在该轮第一次模型调用之前同步执行）")
+    print(f"压缩阶段平均耗时（不含摘要模型调用）: {compact_seconds / turns * 1e3:.2f} ms/轮")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--budget", type=int, default=4000)
+    parser.add_argument("--threshold", type=int, default=6000)
+    parser.add_argument("--max-turns", type=int, default=10)
+    args = parser.parse_args()
+    manager = ContextWindowManager(token_budget=args.budget, max_turns=args.max_turns,
+                                   summary_threshold=args.threshold, summarizer=_stub_summarizer)
+    asyncio.run(run(args.turns, manager))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:18
+@Desc    : bench_logging.py 对比不同日志配置下长对话请求的延迟和CPU开销
+
+使用真实的图和节点代码，模型替换为离线的固定回复模型，MCP工具为空，检查点保存在内存中。
+每个会话预先写入 --history 条消息，日志写入临时文件。
+运行方式: python -m benchmarks.bench_logging [--history 200] [--sessions 8] [--requests 20]
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from typing import Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import InMemorySaver
+
+from app.agent import node
+from app.agent.agent import build_graph
+from app.common.log import setup_logging, shutdown_logging
+from app.model.state import MyState
+from app.tools.mcp_client import my_mcp_client
+from app.tools.mcp_client.my_mcp_client import McpToolRegistry
+from app.tools.tool_registry import ToolBindingRegistry
+
+CONTENT = "这是一段用于基准测试的较长对话内容，模拟真实会话中的历史消息。" * 8
+
+
+class _FakeToolModel(BaseChatModel):
+    """支持 bind_tools 的固定回复模型，每次返回新的消息对象"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=CONTENT))])
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def _install_offline_runtime() -> None:
+    """把模型替换为离线模型，关闭MCP工具和上下文压缩"""
+    model = _FakeToolModel()
+    node.tool_binding_registry = ToolBindingRegistry(lambda: model)
+    node.context_window_manager.enabled = False
+    my_mcp_client.mcp_tool_registry = McpToolRegistry({})
+
+
+async def _run(history: int, sessions: int, requests: int) -> tuple[list[float], float]:
+    graph = build_graph(InMemorySaver())
+    for session in range(sessions):
+        seed = [HumanMessage(content=CONTENT) if i % 2 == 0 else AIMessage(content=CONTENT) for i in range(history)]
+        await graph.aupdate_state({"configurable": {"thread_id": f"bench-{session}"}},
+                                  {"messages": seed, "thread_id": f"bench-{session}"})
+    latencies: list[float] = []
+
+    async def _session(session: int) -> None:
+        config = {"configurable": {"thread_id": f"bench-{session}"}}
+        for _ in range(requests):
+            start = time.perf_counter()
+            await graph.ainvoke(MyState(messages=[HumanMessage(content="继续")], thread_id=f"bench-{session}"), config)
+            latencies.append(time.perf_counter() - start)
+
+    cpu_start = time.process_time()
+    await asyncio.gather(*(_session(i) for i in range(sessions)))
+    return latencies, time.process_time() - cpu_start
+
+
+def _scenario(label: str, args: argparse.Namespace, level: str, blocking: bool = False,
+              payload_sample_rate: float = 1.0, summary_max_chars: int = 500) -> Optional[float]:
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as output:
+        setup_logging(level=level, stream=output, blocking=blocking,
+                      payload_sample_rate=payload_sample_rate, summary_max_chars=summary_max_chars)
+        latencies, cpu = asyncio.run(_run(args.history, args.sessions, args.requests))
+        shutdown_logging()
+        output.flush()
+        log_bytes = output.tell()
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{label:<30} p50 {p50:>8.2f} ms  p95 {p95:>8.2f} ms  CPU {cpu:>6.2f} s  日志 {log_bytes / 1024:>9.1f} KB")
+    return p50
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=200, help="每个会话的历史消息数")
+    parser.add_argument("--sessions", type=int, default=8, help="并发会话数")
+    parser.add_argument("--requests", type=int, default=20, help="每个会话的请求数")
+    args = parser.parse_args()
+
+    _install_offline_runtime()
+    print(f"历史消息: {args.history}，并发会话: {args.sessions}，每会话请求: {args.requests}")
+    _scenario("同步输出 + 完整状态（改造前）", args, "INFO", blocking=True, summary_max_chars=0)
+    _scenario("队列输出 + 摘要 + 详细日志开启", args, "INFO", payload_sample_rate=1.0)
+    _scenario("队列输出 + 摘要 + 详细日志关闭", args, "INFO", payload_sample_rate=0.0)
+    _scenario("仅WARNING", args, "WARNING")
+
+
+if __name__ == "__main__":
+    main()
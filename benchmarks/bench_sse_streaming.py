@@ -0,0 +1,106 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:18
+@Desc    : bench_sse_streaming.py 对比逐token原样输出与SSE token合并输出的写入次数和CPU开销
+
+每个输出帧通过 socketpair 发送一次（即一次 send 系统调用），接收端同时读取并丢弃数据。
+运行方式: python -m benchmarks.bench_sse_streaming [--tokens 5000] [--interval-ms 1] [--streams 20]
+"""
+import argparse
+import asyncio
+import socket
+import time
+from typing import AsyncIterator
+
+from app.common.sse import SseEncoder, SseEvent, SseStreamConfig, EVENT_TOKEN, EVENT_DONE
+
+CHARSET = "utf-8"
+
+
+async def _token_source(tokens: int, interval: float) -> AsyncIterator[str]:
+    for index in range(tokens):
+        if interval:
+            await asyncio.sleep(interval)
+        yield f"词{index % 10}"
+
+
+async def legacy_stream(tokens: int, interval: float) -> AsyncIterator[str]:
+    """改造前的路径：每个token做一次编码/解码往返后原样输出"""
+    async for token in _token_source(tokens, interval):
+        yield str(token).encode(CHARSET).decode(CHARSET)
+
+
+async def sse_stream(tokens: int, interval: float, config: SseStreamConfig) -> AsyncIterator[str]:
+    """改造后的路径：SSE帧 + token合并"""
+
+    async def events() -> AsyncIterator[SseEvent]:
+        async for token in _token_source(tokens, interval):
+            yield SseEvent(event=EVENT_TOKEN, data=token)
+        yield SseEvent(event=EVENT_DONE, data={})
+
+    async for frame in SseEncoder(config).stream(events()):
+        yield frame
+
+
+async def _drain(sock: socket.socket) -> int:
+    loop = asyncio.get_running_loop()
+    received = 0
+    while True:
+        data = await loop.sock_recv(sock, 65536)
+        if not data:
+            return received
+        received += len(data)
+
+
+async def _send_all(stream: AsyncIterator[str]) -> tuple[int, int]:
+    loop = asyncio.get_running_loop()
+    writer, reader = socket.socketpair()
+    writer.setblocking(False)
+    reader.setblocking(False)
+    drain = asyncio.create_task(_drain(reader))
+    sends = 0
+    sent_bytes = 0
+    async for frame in stream:
+        payload = frame.encode(CHARSET)
+        await loop.sock_sendall(writer, payload)
+        sends += 1
+        sent_bytes += len(payload)
+    writer.close()
+    await drain
+    reader.close()
+    return sends, sent_bytes
+
+
+async def _run(label: str, factory, streams: int, tokens: int) -> None:
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(*(_send_all(factory()) for _ in range(streams)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    sends = sum(result[0] for result in results)
+    sent_bytes = sum(result[1] for result in results)
+    total_tokens = tokens * streams
+    print(f"{label:<10} send调用: {sends:>8}  字节: {sent_bytes:>9}  "
+          f"CPU: {cpu * 1e6 / total_tokens:>7.2f} us/token  墙钟: {wall:.2f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=5000, help="每个流的token数量")
+    parser.add_argument("--interval-ms", type=float, default=1.0, help="token产生间隔，0 表示尽可能快")
+    parser.add_argument("--streams", type=int, default=20, help="并发流数量")
+    parser.add_argument("--max-latency-ms", type=float, default=50)
+    parser.add_argument("--max-bytes", type=int, default=1024)
+    args = parser.parse_args()
+    interval = args.interval_ms / 1000
+    config = SseStreamConfig(max_latency=args.max_latency_ms / 1000, max_bytes=args.max_bytes, heartbeat_interval=0)
+
+    print(f"并发流: {args.streams}，每流token: {args.tokens}，token间隔: {args.interval_ms}ms，"
+          f"合并延迟: {args.max_latency_ms}ms，合并字节: {args.max_bytes}")
+    asyncio.run(_run("逐token", lambda: legacy_stream(args.tokens, interval), args.streams, args.tokens))
+    asyncio.run(_run("SSE合并", lambda: sse_stream(args.tokens, interval, config), args.streams, args.tokens))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:18
+@Desc    : bench_tool_binding.py 对比每次调用都绑定工具与按指纹缓存绑定结果的耗时
+
+运行方式: python -m benchmarks.bench_tool_binding [--tools 20] [--iterations 2000]
+"""
+import argparse
+import time
+
+from langchain_core.tools import StructuredTool
+from langchain_openai import ChatOpenAI
+from langgraph.prebuilt import ToolNode
+from pydantic import SecretStr
+
+from app.tools import user_tools
+from app.tools.tool_registry import ToolBindingRegistry
+
+
+def _make_tools(count: int) -> list:
+    """构造参数结构各不相同的模拟工具"""
+
+    def _make(index: int):
+        def _func(city: str, days: int = 1, unit: str = "celsius") -> str:
+            return f"{city}:{days}:{unit}"
+
+        return StructuredTool.from_function(
+            func=_func,
+            name=f"mock_tool_{index}",
+            description=f"模拟工具 {index}，用于基准测试",
+        )
+
+    return [_make(i) for i in range(count)]
+
+
+def _measure(label: str, iterations: int, func) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / iterations * 1e6
+    print(f"{label:<28} {per_call_us:>10.1f} us/call")
+    return per_call_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tools", type=int, default=20, help="模拟工具数量")
+    parser.add_argument("--iterations", type=int, default=2000, help="每个场景的调用次数")
+    args = parser.parse_args()
+
+    model = ChatOpenAI(api_key=SecretStr("sk-bench"), base_url="http://localhost:1/v1", model="bench")
+    mock_tools = _make_tools(args.tools)
+    registry = ToolBindingRegistry(lambda: model)
+
+    print(f"工具数: {len(user_tools) + len(mock_tools)}，迭代次数: {args.iterations}")
+    per_call_bind = _measure("bind_tools (每次调用)", args.iterations,
+                             lambda: model.bind_tools(user_tools + mock_tools))
+    cached_bind = _measure("bind_tools (指纹缓存)", args.iterations,
+                           lambda: registry.get_bound_model(user_tools + mock_tools))
+    per_call_node = _measure("ToolNode (每次调用)", args.iterations,
+                             lambda: ToolNode(user_tools + mock_tools))
+    cached_node = _measure("ToolNode (指纹缓存)", args.iterations,
+                           lambda: registry.get_tool_node(user_tools + mock_tools))
+    print(f"绑定加速比: {per_call_bind / cached_bind:.1f}x，ToolNode加速比: {per_call_node / cached_node:.1f}x")
+    print(f"缓存统计: {registry.stats()}")
+
+
+if __name__ == "__main__":
+    main()
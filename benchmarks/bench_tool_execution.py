@@ -0,0 +1,109 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:18
+@Desc    : bench_tool_execution.py 对比逐个执行、ToolNode默认并发与加上ToolExecutor后的工具阶段耗时
+
+模拟一次模型回复中包含多个工具调用：若干异步慢工具、若干同步慢工具和一个长时间无响应的工具。
+运行方式: python -m benchmarks.bench_tool_execution [--async-tools 4] [--sync-tools 4] [--delay-ms 200] [--hang-ms 3000]
+"""
+import argparse
+import asyncio
+import time
+from typing import Optional
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
+from langgraph.graph import StateGraph, MessagesState, START
+from langgraph.prebuilt import ToolNode
+
+from app.tools.tool_executor import ToolExecutor, ToolLimits
+
+
+def _make_tools(async_tools: int, sync_tools: int, delay: float, hang: float) -> list[StructuredTool]:
+    """构造模拟的慢工具"""
+
+    def _async_tool(index: int) -> StructuredTool:
+        async def _coroutine(query: str) -> str:
+            await asyncio.sleep(delay)
+            return f"async-{index}:{query}"
+
+        return StructuredTool.from_function(coroutine=_coroutine, name=f"async_tool_{index}",
+                                            description="模拟的异步慢工具（例如MCP工具）")
+
+    def _sync_tool(index: int) -> StructuredTool:
+        def _func(query: str) -> str:
+            time.sleep(delay)
+            return f"sync-{index}:{query}"
+
+        return StructuredTool.from_function(func=_func, name=f"sync_tool_{index}",
+                                            description="模拟的同步慢工具")
+
+    async def _hung(query: str) -> str:
+        await asyncio.sleep(hang)
+        return f"hung:{query}"
+
+    hung_tool = StructuredTool.from_function(coroutine=_hung, name="hung_tool", description="模拟长时间无响应的工具")
+    return [_async_tool(i) for i in range(async_tools)] + [_sync_tool(i) for i in range(sync_tools)] + [hung_tool]
+
+
+def _compile(tool_node: ToolNode):
+    builder = StateGraph(MessagesState)
+    builder.add_node("tools", tool_node)
+    builder.add_edge(START, "tools")
+    return builder.compile()
+
+
+def _tool_calls(tools: list[StructuredTool]) -> list[dict]:
+    return [{"name": tool.name, "args": {"query": "bench"}, "id": f"call_{i}"} for i, tool in enumerate(tools)]
+
+
+async def _run_sequential(tools: list[StructuredTool]) -> float:
+    """逐个执行：每次只把一个工具调用交给ToolNode"""
+    graph = _compile(ToolNode(tools))
+    start = time.perf_counter()
+    for call in _tool_calls(tools):
+        await graph.ainvoke({"messages": [AIMessage(content="", tool_calls=[call])]})
+    return time.perf_counter() - start
+
+
+async def _run_concurrent(tools: list[StructuredTool], executor: Optional[ToolExecutor] = None) -> tuple[float, list]:
+    graph = _compile(ToolNode(tools, awrap_tool_call=executor.awrap if executor else None))
+    start = time.perf_counter()
+    result = await graph.ainvoke({"messages": [AIMessage(content="", tool_calls=_tool_calls(tools))]})
+    return time.perf_counter() - start, result["messages"][1:]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--async-tools", type=int, default=4, help="异步慢工具数量")
+    parser.add_argument("--sync-tools", type=int, default=4, help="同步慢工具数量")
+    parser.add_argument("--delay-ms", type=float, default=200, help="慢工具的耗时（毫秒）")
+    parser.add_argument("--hang-ms", type=float, default=3000, help="无响应工具的耗时（毫秒）")
+    parser.add_argument("--timeout-ms", type=float, default=1000, help="ToolExecutor的单次调用超时（毫秒）")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="ToolExecutor的全局并发上限")
+    args = parser.parse_args()
+
+    tools = _make_tools(args.async_tools, args.sync_tools, args.delay_ms / 1000, args.hang_ms / 1000)
+    executor = ToolExecutor(default_limits=ToolLimits(timeout=args.timeout_ms / 1000, max_concurrency=4),
+                            max_concurrency=args.max_concurrency, thread_pool_size=max(args.sync_tools, 1))
+    print(f"工具调用数: {len(tools)}（异步 {args.async_tools}，同步 {args.sync_tools}，无响应 1），"
+          f"慢工具耗时: {args.delay_ms:g}ms，无响应工具耗时: {args.hang_ms:g}ms")
+
+    sequential = asyncio.run(_run_sequential(tools))
+    print(f"{'逐个执行':<20} {sequential * 1000:>9.1f} ms")
+    concurrent, _ = asyncio.run(_run_concurrent(tools))
+    print(f"{'ToolNode默认并发':<20} {concurrent * 1000:>9.1f} ms")
+    limited, messages = asyncio.run(_run_concurrent(tools, executor))
+    print(f"{'ToolExecutor':<20} {limited * 1000:>9.1f} ms  "
+          f"（超时 {args.timeout_ms:g}ms，失败/超时调用: {sum(m.status == 'error' for m in messages)}）")
+    executor.shutdown()
+
+    print("ToolExecutor 各工具耗时:")
+    for name, stats in executor.stats()["tools"].items():
+        print(f"  {name:<16} avg {stats['avg_ms']:>8.1f} ms  max {stats['max_ms']:>8.1f} ms  "
+              f"超时 {stats['timeouts']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:19
+@Desc    : bench_tracing.py 测量不同采样率下链路追踪带来的单请求开销
+
+使用真实的图和节点代码，模型替换为离线的固定回复模型，检查点保存在内存中。
+Langfuse客户端使用丢弃span的导出器，只测量SDK在请求路径上的开销，不包含网络导出。
+运行方式: python -m benchmarks.bench_tracing [--sessions 8] [--requests 50] [--history 10]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from typing import Optional, Sequence
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langfuse import Langfuse
+from langgraph.checkpoint.memory import InMemorySaver
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from app.agent.agent import build_graph
+from app.common.tracing import Tracing, TracingConfig
+from app.model.state import MyState
+from benchmarks.bench_logging import CONTENT, _install_offline_runtime
+
+
+class _DiscardingExporter(SpanExporter):
+    """丢弃全部span的导出器，只统计数量"""
+
+    def __init__(self):
+        self.exported = 0
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        self.exported += len(spans)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+async def _run(tracing: Tracing, history: int, sessions: int, requests: int) -> tuple[list[float], float]:
+    graph = build_graph(InMemorySaver())
+    for session in range(sessions):
+        seed = [HumanMessage(content=CONTENT) if i % 2 == 0 else AIMessage(content=CONTENT) for i in range(history)]
+        await graph.aupdate_state({"configurable": {"thread_id": f"bench-{session}"}},
+                                  {"messages": seed, "thread_id": f"bench-{session}"})
+    latencies: list[float] = []
+
+    async def _session(session: int) -> None:
+        for _ in range(requests):
+            start = time.perf_counter()
+            with tracing.trace_request("chat", {}, user_id="bench", session_id=f"bench-{session}", root_span=True):
+                config = {"configurable": {"thread_id": f"bench-{session}"}, "callbacks": tracing.callbacks()}
+                await graph.ainvoke(MyState(messages=[HumanMessage(content="继续")], thread_id=f"bench-{session}"),
+                                    config)
+            latencies.append(time.perf_counter() - start)
+
+    cpu_start = time.process_time()
+    await asyncio.gather(*(_session(i) for i in range(sessions)))
+    return latencies, time.process_time() - cpu_start
+
+
+def _scenario(label: str, args: argparse.Namespace, client: Optional[Langfuse], exporter: _DiscardingExporter,
+              sample_rate: float, baseline: Optional[float] = None) -> float:
+    tracing = Tracing(TracingConfig(sample_rate=sample_rate))
+    if client is not None:
+        tracing.start(client)
+    exported_before = exporter.exported
+    latencies, cpu = asyncio.run(_run(tracing, args.history, args.sessions, args.requests))
+    if client is not None:
+        client.flush()
+    latencies.sort()
+    total = len(latencies)
+    mean = statistics.fmean(latencies) * 1000
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(total * 0.95) - 1] * 1000
+    cpu_per_request = cpu / total * 1000
+    overhead = f"  开销 {cpu_per_request - baseline:>+7.3f} ms/请求" if baseline is not None else ""
+    print(f"{label:<16} 平均 {mean:>7.2f} ms  p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms  "
+          f"CPU {cpu_per_request:>7.3f} ms/请求  span {exporter.exported - exported_before:>6}{overhead}")
+    return cpu_per_request
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=8, help="并发会话数")
+    parser.add_argument("--requests", type=int, default=50, help="每个会话的请求数")
+    parser.add_argument("--history", type=int, default=10, help="每个会话的历史消息数")
+    parser.add_argument("--flush-at", type=int, default=512, help="后台导出线程每批导出的span数量")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    # 离线模型没有模型名，屏蔽Langfuse对此输出的警告
+    logging.getLogger("langfuse").setLevel(logging.ERROR)
+    _install_offline_runtime()
+    exporter = _DiscardingExporter()
+    client = Langfuse(public_key="pk-bench", secret_key="sk-bench", base_url="http://127.0.0.1:9",
+                      flush_at=args.flush_at, flush_interval=5, span_exporter=exporter)
+    print(f"并发会话: {args.sessions}，每会话请求: {args.requests}，历史消息: {args.history}")
+    # 先执行一轮预热，避免首轮承担导入和初始化开销
+    _scenario("预热", args, client, exporter, 1.0)
+    baseline = _scenario("追踪关闭", args, None, exporter, 0.0)
+    for rate in (0.0, 0.1, 1.0):
+        _scenario(f"采样率 {rate:.0%}", args, client, exporter, rate, baseline)
+    client.shutdown()
+
+
+if __name__ == "__main__":
+    main()
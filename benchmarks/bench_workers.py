@@ -0,0 +1,106 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:23
+@Desc    : bench_workers.py 测量 python -m app.server 的吞吐随worker数的变化
+
+复用离线压测的模拟模型服务和MCP服务，模型延迟默认设得很低，使应用进程成为瓶颈。
+依次以 1..N 个worker启动 app.server（内存检查点），等待全部worker就绪后按固定并发压测，
+输出各worker数下的RPS、延迟和相对1个worker的加速比。吞吐的上限取决于机器的CPU核数。
+运行方式: python -m benchmarks.bench_workers [--max-workers 4] [--concurrency 32] [--requests 300]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.loadtest.runner import (
+    ENDPOINTS, app_env, drive, free_port, spawn, start_stubs, stop_processes, summarize, wait_ready
+)
+
+
+async def _wait_workers(log: Path, process: subprocess.Popen, workers: int, timeout: float) -> None:
+    """等待全部worker执行完 lifespan 启动，/health 只能反映其中一个worker"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app.server 启动失败，退出码 {process.returncode}")
+        if log.read_text(encoding="utf-8").count("Application startup complete") >= workers:
+            return
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{workers} 个worker在 {timeout:g}s 内未全部就绪")
+
+
+async def _run_workers(args: argparse.Namespace, log_dir: Path, env: dict, workers: int) -> dict:
+    port = free_port()
+    name = f"server-{workers}"
+    server = spawn(name, ["-m", "app.server"], log_dir,
+                   env={**env, "SERVER_HOST": "127.0.0.1", "SERVER_PORT": str(port),
+                        "SERVER_WORKERS": str(workers), "SERVER_LOG_LEVEL": "info"})
+    try:
+        await wait_ready(f"http://127.0.0.1:{port}/health", server, name, args.startup_timeout)
+        await _wait_workers(log_dir / f"{name}.log", server, workers, args.startup_timeout)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.request_timeout,
+                                     limits=limits) as client:
+            await drive(client, args.endpoint, args.warmup, args.concurrency, args.turns_per_session, args.message)
+            results, duration = await drive(client, args.endpoint, args.requests, args.concurrency,
+                                            args.turns_per_session, args.message)
+        return summarize(results, duration, {})
+    finally:
+        stop_processes([server])
+
+
+async def _run(args: argparse.Namespace, log_dir: Path) -> None:
+    processes: list[subprocess.Popen] = []
+    try:
+        openai_port, mcp_port = await start_stubs(log_dir, processes, args.tokens, args.first_token_latency_ms,
+                                                  args.token_latency_ms, 0.0, args.startup_timeout)
+        env = app_env(openai_port, mcp_port)
+        baseline = None
+        print(f"{'workers':>7} {'RPS':>8} {'加速比':>6} {'p50(ms)':>9} {'p95(ms)':>9} {'失败':>5}")
+        for workers in range(1, args.max_workers + 1):
+            result = await _run_workers(args, log_dir, env, workers)
+            baseline = baseline or result["rps"]
+            latency = result["latency_ms"] or {}
+            print(f"{workers:>7} {result['rps']:>8.1f} {result['rps'] / baseline if baseline else 0:>8.2f} "
+                  f"{latency.get('p50', 0):>9.1f} {latency.get('p95', 0):>9.1f} {result['errors']:>6}")
+    finally:
+        stop_processes(processes)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="最大worker数，默认为CPU核数")
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="chat", help="压测的接口")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发请求数")
+    parser.add_argument("--requests", type=int, default=300, help="每个worker数下的请求总数")
+    parser.add_argument("--warmup", type=int, default=32, help="正式计时前的预热请求数")
+    parser.add_argument("--message", default="你好", help="请求中的用户消息")
+    parser.add_argument("--turns-per-session", type=int, default=5, help="每个会话的轮数，之后切换到新会话")
+    parser.add_argument("--tokens", type=int, default=20, help="模拟模型每次回复的token数")
+    parser.add_argument("--first-token-latency-ms", type=float, default=1, help="模拟模型的首token延迟（毫秒）")
+    parser.add_argument("--token-latency-ms", type=float, default=0, help="模拟模型的token间隔（毫秒）")
+    parser.add_argument("--request-timeout", type=float, default=120, help="单个请求的超时（秒）")
+    parser.add_argument("--startup-timeout", type=float, default=60, help="各服务启动的超时（秒）")
+    args = parser.parse_args()
+
+    print(f"CPU核数: {os.cpu_count()}，并发: {args.concurrency}，每组请求: {args.requests}，接口: {args.endpoint}")
+    with tempfile.TemporaryDirectory(prefix="bench-workers-") as log_dir:
+        try:
+            asyncio.run(_run(args, Path(log_dir)))
+        except (RuntimeError, TimeoutError) as e:
+            print(f"基准测试失败: {e}")
+            for log in sorted(Path(log_dir).glob("*.log")):
+                print(f"--- {log.name} ---\n{log.read_text(encoding='utf-8')[-3000:]}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:20
+@Desc    : __main__.py 离线压测：使用本地模拟服务启动 main:app，按指定并发驱动聊天接口
+
+依次启动模拟的OpenAI兼容服务（stub_openai）、MCP SSE服务（stub_mcp）和使用内存检查点的 main:app，
+三者均为独立子进程。按 --concurrency 并发请求 /api/ai/chat 和 /api/ai/chat-stream，
+统计RPS、p50/p95/p99延迟、流式首token时间和应用进程内存，结果写入JSON，便于不同版本之间对比。
+运行方式: python -m benchmarks.loadtest [--concurrency 16] [--requests 200] [--endpoints chat,chat-stream]
+         [--output result.json] [--baseline 上次结果.json] [--app-env KEY=VALUE ...]
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from benchmarks.loadtest.runner import (
+    ROOT, ENDPOINTS, MemorySampler, app_env, drive, free_port, git_commit, spawn, start_stubs, stop_processes,
+    summarize, wait_ready
+)
+
+
+def _print_result(endpoint: str, result: dict) -> None:
+    latency, ttft, memory = result["latency_ms"] or {}, result["ttft_ms"], result["memory"]
+    line = (f"{endpoint:<12} 请求 {result['requests']:>5}  失败 {result['errors']:>4}  RPS {result['rps']:>7.1f}  "
+            f"p50 {latency.get('p50', 0):>7.1f} ms  p95 {latency.get('p95', 0):>7.1f} ms  "
+            f"p99 {latency.get('p99', 0):>7.1f} ms")
+    if ttft:
+        line += f"  TTFT p50 {ttft['p50']:>6.1f} ms  p95 {ttft['p95']:>6.1f} ms"
+    if memory.get("rss_peak_mb") is not None:
+        line += f"  内存峰值 {memory['rss_peak_mb']:.1f} MB"
+    print(line)
+
+
+def _print_comparison(report: dict, baseline_path: str) -> None:
+    """与之前的结果对比，输出各指标的变化百分比"""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    print(f"与基线对比（{baseline_path}，提交 {baseline.get('git_commit')}）:")
+
+    def change(new: Optional[float], old: Optional[float]) -> str:
+        if not new or not old:
+            return "    n/a"
+        return f"{(new - old) / old * 100:>+6.1f}%"
+
+    for endpoint, result in report["results"].items():
+        old = baseline.get("results", {}).get(endpoint)
+        if old is None:
+            continue
+        latency, old_latency = result["latency_ms"] or {}, old["latency_ms"] or {}
+        ttft, old_ttft = result["ttft_ms"] or {}, old["ttft_ms"] or {}
+        print(f"{endpoint:<12} RPS {change(result['rps'], old['rps'])}  "
+              f"p50 {change(latency.get('p50'), old_latency.get('p50'))}  "
+              f"p95 {change(latency.get('p95'), old_latency.get('p95'))}  "
+              f"p99 {change(latency.get('p99'), old_latency.get('p99'))}  "
+              f"TTFT p50 {change(ttft.get('p50'), old_ttft.get('p50'))}  "
+              f"内存峰值 {change(result['memory'].get('rss_peak_mb'), old['memory'].get('rss_peak_mb'))}")
+
+
+async def _run(args: argparse.Namespace, log_dir: Path) -> dict:
+    processes: list[subprocess.Popen] = []
+    try:
+        openai_port, mcp_port = await start_stubs(log_dir, processes, args.tokens, args.first_token_latency_ms,
+                                                  args.token_latency_ms, args.tool_call_rate, args.startup_timeout)
+        app_port = free_port()
+        app = spawn("app", ["-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                            "--log-level", "warning", "--no-access-log"],
+                    log_dir, env=app_env(openai_port, mcp_port, args.app_env))
+        processes.append(app)
+        await wait_ready(f"http://127.0.0.1:{app_port}/health", app, "main:app", args.startup_timeout)
+
+        report = {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "results": {},
+        }
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=args.request_timeout,
+                                     limits=limits) as client:
+            for endpoint in args.endpoints:
+                await drive(client, endpoint, args.warmup, min(args.concurrency, max(args.warmup, 1)),
+                            args.turns_per_session, args.message)
+                with MemorySampler(app.pid) as sampler:
+                    results, duration = await drive(client, endpoint, args.requests, args.concurrency,
+                                                    args.turns_per_session, args.message)
+                report["results"][endpoint] = summarize(results, duration, sampler.summary())
+                _print_result(endpoint, report["results"][endpoint])
+        return report
+    finally:
+        stop_processes(processes)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--requests", type=int, default=200, help="每个接口的请求总数")
+    parser.add_argument("--warmup", type=int, default=8, help="每个接口正式计时前的预热请求数")
+    parser.add_argument("--endpoints", type=lambda value: [e.strip() for e in value.split(",") if e.strip()],
+                        default=list(ENDPOINTS), help="要压测的接口，逗号分隔: chat,chat-stream")
+    parser.add_argument("--message", default="北京今天天气怎么样", help="请求中的用户消息")
+    parser.add_argument("--turns-per-session", type=int, default=5, help="每个会话的轮数，之后切换到新会话")
+    parser.add_argument("--tokens", type=int, default=50, help="模拟模型每次回复的token数")
+    parser.add_argument("--first-token-latency-ms", type=float, default=100, help="模拟模型的首token延迟（毫秒）")
+    parser.add_argument("--token-latency-ms", type=float, default=20, help="模拟模型的token间隔（毫秒）")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="模拟模型返回工具调用的概率")
+    parser.add_argument("--request-timeout", type=float, default=120, help="单个请求的超时（秒）")
+    parser.add_argument("--startup-timeout", type=float, default=60, help="各服务启动的超时（秒）")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="覆盖应用进程的环境变量，可重复，例如 --app-env SSE_COALESCE_MAX_LATENCY_MS=0")
+    parser.add_argument("--output", help="结果JSON路径，默认 benchmarks/results/loadtest-<时间>.json")
+    parser.add_argument("--baseline", help="之前的结果JSON，用于输出对比")
+    args = parser.parse_args()
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"未知接口: {','.join(sorted(unknown))}")
+
+    print(f"并发: {args.concurrency}，每接口请求: {args.requests}，模拟模型: {args.tokens} token，"
+          f"首token {args.first_token_latency_ms:g}ms，间隔 {args.token_latency_ms:g}ms，"
+          f"工具调用概率 {args.tool_call_rate:g}")
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as log_dir:
+        try:
+            report = asyncio.run(_run(args, Path(log_dir)))
+        except (RuntimeError, TimeoutError) as e:
+            print(f"压测失败: {e}")
+            for log in sorted(Path(log_dir).glob("*.log")):
+                print(f"--- {log.name} ---\n{log.read_text(encoding='utf-8')[-3000:]}")
+            sys.exit(1)
+
+    output = Path(args.output) if args.output else \
+        ROOT / "benchmarks" / "results" / f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已写入 {output}")
+    if args.baseline:
+        _print_comparison(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:20
+@Desc    : runner.py 压测公共逻辑：启动子进程和模拟服务、按并发发送请求、统计延迟与内存
+"""
+import asyncio
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[2]
+ENDPOINTS = {"chat": "/api/ai/chat", "chat-stream": "/api/ai/chat-stream"}
+
+
+@dataclass
+class RequestResult:
+    latency: float
+    ok: bool
+    ttft: Optional[float] = None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn(name: str, args: list[str], log_dir: Path, env: Optional[dict] = None) -> subprocess.Popen:
+    with open(log_dir / f"{name}.log", "w", encoding="utf-8") as log:
+        return subprocess.Popen([sys.executable, *args], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, process: subprocess.Popen, name: str, timeout: float, expect_ok: bool = True) -> None:
+    """轮询直到服务响应；expect_ok 为False时只要能建立HTTP连接即可"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} 启动失败，退出码 {process.returncode}")
+            try:
+                async with client.stream("GET", url) as response:
+                    if not expect_ok or response.status_code == 200:
+                        return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{name} 在 {timeout:g}s 内未就绪")
+
+
+def rss_mb(pid: int, field: str = "VmRSS") -> Optional[float]:
+    """读取进程的常驻内存（MB），非Linux平台返回None"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    """在压测期间定时采样应用进程的常驻内存"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.start_mb = rss_mb(pid)
+        self.peak_mb = self.start_mb
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            rss = rss_mb(self.pid)
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or 0.0, rss)
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self) -> "MemorySampler":
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._task.cancel()
+
+    def summary(self) -> dict:
+        end_mb = rss_mb(self.pid)
+        return {"rss_start_mb": self.start_mb, "rss_end_mb": end_mb,
+                "rss_peak_mb": max(filter(None, (self.peak_mb, end_mb)), default=None)}
+
+
+async def chat_once(client: httpx.AsyncClient, params: dict) -> RequestResult:
+    start = time.perf_counter()
+    try:
+        response = await client.get(ENDPOINTS["chat"], params=params)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return RequestResult(latency=time.perf_counter() - start, ok=ok)
+
+
+async def chat_stream_once(client: httpx.AsyncClient, params: dict) -> RequestResult:
+    """流式请求：首个token事件到达的时间为TTFT，收到done事件且没有error事件才算成功"""
+    start = time.perf_counter()
+    ttft = None
+    done = failed = False
+    try:
+        async with client.stream("GET", ENDPOINTS["chat-stream"], params=params) as response:
+            failed = response.status_code != 200
+            async for line in response.aiter_lines():
+                if not line.startswith("event: "):
+                    continue
+                event = line[len("event: "):]
+                if event == "token" and ttft is None:
+                    ttft = time.perf_counter() - start
+                elif event == "error":
+                    failed = True
+                elif event == "done":
+                    done = True
+    except httpx.HTTPError:
+        failed = True
+    return RequestResult(latency=time.perf_counter() - start, ok=done and not failed, ttft=ttft)
+
+
+async def drive(client: httpx.AsyncClient, endpoint: str, total: int, concurrency: int,
+                 turns_per_session: int, message: str) -> tuple[list[RequestResult], float]:
+    """
+    以固定并发发送 total 个请求；每个并发槽位使用独立会话，每 turns_per_session 轮切换到新会话
+    """
+    send = chat_once if endpoint == "chat" else chat_stream_once
+    results: list[RequestResult] = []
+    next_index = 0
+
+    async def _worker(worker: int) -> None:
+        nonlocal next_index
+        turn = 0
+        while next_index < total:
+            next_index += 1
+            session_id = f"load-{endpoint}-{worker}-{turn // turns_per_session}"
+            results.append(await send(client, {"message": message, "session_id": session_id,
+                                               "user_id": "loadtest"}))
+            turn += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_worker(i) for i in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def percentiles(values: list[float]) -> Optional[dict]:
+    """毫秒为单位的分位数，采用最近秩法"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] * 1000
+
+    return {"mean": statistics.fmean(ordered) * 1000, "p50": rank(0.50), "p95": rank(0.95),
+            "p99": rank(0.99), "max": ordered[-1] * 1000}
+
+
+def summarize(results: list[RequestResult], duration: float, memory: dict) -> dict:
+    succeeded = [r for r in results if r.ok]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "duration_s": duration,
+        "rps": len(succeeded) / duration if duration > 0 else 0.0,
+        "latency_ms": percentiles([r.latency for r in succeeded]),
+        "ttft_ms": percentiles([r.ttft for r in succeeded if r.ttft is not None]),
+        "memory": memory,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def app_env(openai_port: int, mcp_port: int, overrides: Iterable[str] = ()) -> dict:
+    """
+    应用子进程的环境变量：指向本地模拟服务，使用内存检查点，关闭语义缓存和链路追踪
+    :param overrides: KEY=VALUE 形式的覆盖项
+    """
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "OPENAI_API_KEY": "sk-stub",
+        "OPENAI_MODEL_NAME": "stub-model",
+        "MCP_BASE_URL": f"http://127.0.0.1:{mcp_port}/",
+        "MCP_ENDPOINT": "sse",
+        "MCP_SERVERS": "",
+        "CHECKPOINT_BACKEND": "memory",
+        "CHECKPOINT_RETENTION_ENABLED": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "TRACING_ENABLED": "false",
+        "LANGFUSE_TRACING_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    }
+    for item in overrides:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def start_stubs(log_dir: Path,
+                      processes: list[subprocess.Popen],
+                      tokens: int,
+                      first_token_latency_ms: float,
+                      token_latency_ms: float,
+                      tool_call_rate: float,
+                      timeout: float) -> tuple[int, int]:
+    """
+    启动模拟模型服务和MCP服务并等待就绪，子进程追加到 processes 中由调用方负责停止
+    :return: (模拟模型服务端口, MCP服务端口)
+    """
+    openai_port, mcp_port = free_port(), free_port()
+    stub_openai = spawn("stub_openai", [
+        "-m", "benchmarks.loadtest.stub_openai", "--port", str(openai_port), "--tokens", str(tokens),
+        "--first-token-latency-ms", str(first_token_latency_ms),
+        "--token-latency-ms", str(token_latency_ms), "--tool-call-rate", str(tool_call_rate),
+    ], log_dir)
+    processes.append(stub_openai)
+    stub_mcp = spawn("stub_mcp", ["-m", "benchmarks.loadtest.stub_mcp", "--port", str(mcp_port)], log_dir)
+    processes.append(stub_mcp)
+    await wait_ready(f"http://127.0.0.1:{openai_port}/v1/models", stub_openai, "stub_openai", timeout)
+    await wait_ready(f"http://127.0.0.1:{mcp_port}/sse", stub_mcp, "stub_mcp", timeout)
+    return openai_port, mcp_port
+
+
+def stop_processes(processes: list[subprocess.Popen], timeout: float = 10) -> None:
+    """
+    按启动的相反顺序发送SIGTERM，超时未退出的进程强制结束
+    """
+    for process in reversed(processes):
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
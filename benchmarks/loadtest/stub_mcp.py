@@ -0,0 +1,27 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:20
+@Desc    : stub_mcp.py 压测使用的MCP SSE服务，直接复用 app/tools/mcp_server/my_mcp_server.py 中的工具
+
+运行方式: python -m benchmarks.loadtest.stub_mcp [--port 9101]
+"""
+import argparse
+
+from app.tools.mcp_server.my_mcp_server import mcp
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    args = parser.parse_args()
+
+    mcp.settings.host = args.host
+    mcp.settings.port = args.port
+    mcp.settings.log_level = "WARNING"
+    mcp.run(transport="sse")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:20
+@Desc    : stub_openai.py 离线的OpenAI兼容模型服务，用于压测
+
+实现 /v1/chat/completions 的普通和流式响应，按配置的延迟逐个输出token，
+带工具定义且最后一条消息来自用户时，按 --tool-call-rate 的概率返回一次工具调用。
+运行方式: python -m benchmarks.loadtest.stub_openai [--port 9100] [--tokens 50] [--token-latency-ms 20]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_MODEL = "stub-model"
+
+
+@dataclass(frozen=True)
+class StubModelConfig:
+    """模拟模型的输出长度和速度"""
+    # 每次回复的token数
+    tokens: int = 50
+    # 首个token之前的延迟（秒），模拟prefill
+    first_token_latency: float = 0.1
+    # 相邻token之间的延迟（秒）
+    token_latency: float = 0.02
+    # 用户消息触发工具调用的概率
+    tool_call_rate: float = 0.0
+
+
+def _tool_call(tools: list[dict]) -> dict:
+    """选择一个工具并为必填的字符串参数填入固定值，优先选择 get_weather"""
+    functions = [tool.get("function", {}) for tool in tools]
+    function = next((f for f in functions if f.get("name") == "get_weather"), functions[0])
+    parameters = function.get("parameters") or {}
+    properties = parameters.get("properties") or {}
+    arguments = {name: "北京" for name in parameters.get("required", []) if
+                 properties.get(name, {}).get("type", "string") == "string"}
+    return {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+            "function": {"name": function.get("name"), "arguments": json.dumps(arguments, ensure_ascii=False)}}
+
+
+def _should_call_tool(body: dict, config: StubModelConfig) -> bool:
+    messages = body.get("messages") or []
+    if not body.get("tools") or not messages or messages[-1].get("role") != "user":
+        return False
+    return random.random() < config.tool_call_rate
+
+
+def _chunk(completion_id: str, delta: dict, finish_reason: Optional[str] = None) -> str:
+    data = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": STUB_MODEL, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _usage(config: StubModelConfig, tokens: int) -> dict:
+    return {"prompt_tokens": 100, "completion_tokens": tokens, "total_tokens": 100 + tokens}
+
+
+async def _stream(config: StubModelConfig, tool_call: Optional[dict]) -> AsyncIterator[str]:
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await asyncio.sleep(config.first_token_latency)
+    yield _chunk(completion_id, {"role": "assistant", "content": ""})
+    if tool_call is not None:
+        yield _chunk(completion_id, {"tool_calls": [{"index": 0, **tool_call}]})
+        yield _chunk(completion_id, {}, "tool_calls")
+    else:
+        for index in range(config.tokens):
+            if index:
+                await asyncio.sleep(config.token_latency)
+            yield _chunk(completion_id, {"content": f"词{index} "})
+        yield _chunk(completion_id, {}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+def create_app(config: StubModelConfig) -> FastAPI:
+    """
+    创建模拟的OpenAI兼容服务
+    :param config: 模拟模型配置
+    """
+    app = FastAPI(title="stub-openai")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        tool_call = _tool_call(body["tools"]) if _should_call_tool(body, config) else None
+        if body.get("stream"):
+            return StreamingResponse(_stream(config, tool_call), media_type="text/event-stream")
+
+        await asyncio.sleep(config.first_token_latency + config.token_latency * max(config.tokens - 1, 0))
+        if tool_call is not None:
+            message, finish_reason, tokens = {"role": "assistant", "content": None,
+                                              "tool_calls": [tool_call]}, "tool_calls", 1
+        else:
+            content = "".join(f"词{index} " for index in range(config.tokens))
+            message, finish_reason, tokens = {"role": "assistant", "content": content}, "stop", config.tokens
+        return JSONResponse({
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": STUB_MODEL, "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": _usage(config, tokens),
+        })
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": STUB_MODEL, "object": "model", "owned_by": "stub"}]}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=50, help="每次回复的token数")
+    parser.add_argument("--first-token-latency-ms", type=float, default=100, help="首个token之前的延迟（毫秒）")
+    parser.add_argument("--token-latency-ms", type=float, default=20, help="相邻token之间的延迟（毫秒）")
+    parser.add_argument("--tool-call-rate", type=float, default=0.0, help="用户消息触发工具调用的概率")
+    args = parser.parse_args()
+
+    config = StubModelConfig(tokens=args.tokens, first_token_latency=args.first_token_latency_ms / 1000,
+                             token_latency=args.token_latency_ms / 1000, tool_call_rate=args.tool_call_rate)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
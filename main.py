@@ -5,17 +5,37 @@
 @Desc    : main.py
 """
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 
+from app.agent.runtime import agent_runtime
+from app.common.http_metrics import HttpMetricsMiddleware
+from app.common.log import setup_logging_from_config
+from app.common.metrics import render_metrics
+from app.config.response_config import ResponseConfig
 from app.routers import ai_chat
+from app.service.impl import OpenAiChatServiceImpl
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """应用生命周期：启动时构建共享的Agent运行时，关闭时释放连接池"""
+    await agent_runtime.start()
+    try:
+        yield
+    finally:
+        await agent_runtime.stop()
+
 
 # 创建 FastAPI 应用实例
 app = FastAPI(
     title="LangGraph Demo API",
     description="A comprehensive demonstration project showcasing LangGraph and LangChain capabilities",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -25,18 +45,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 浏览器端需要读取运行ID才能在重连时续传
+    expose_headers=[OpenAiChatServiceImpl.RUN_ID_HEADER],
 )
 
+# 按路由统计请求数和耗时
+app.add_middleware(HttpMetricsMiddleware)
+
 # 注册路由
 app.include_router(ai_chat.router, prefix="/api")
 
-# 日志配置
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(module)s - %(funcName)s - line:%(lineno)d - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler()],
-    encoding="utf-8"
-)
+# 日志配置：记录经队列交给后台线程输出，不在事件循环线程上写流
+setup_logging_from_config()
 
 
 @app.get("/")
@@ -47,10 +67,23 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """健康检查端点"""
-    return {"status": "healthy", "service": "langgraph-demo"}
+    """健康检查端点，运行时未就绪时返回503"""
+    runtime_health = agent_runtime.health()
+    content = {
+        "status": "healthy" if agent_runtime.ready else "unavailable",
+        "service": "langgraph-demo",
+        "runtime": runtime_health
+    }
+    return JSONResponse(content=content, status_code=200 if agent_runtime.ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标端点"""
+    return Response(content=render_metrics(), media_type=ResponseConfig.PROMETHEUS_MEDIA_TYPE)
 
 
+# 本地开发入口（单进程、自动重载），生产环境使用 python -m app.server
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,178 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_admission.py 准入控制的排队、超时、取消与名额释放测试
+"""
+import asyncio
+import time
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from app.common.admission import AdmissionController, AdmissionRejected, FairLimiter
+from app.config.response_config import ResponseConfig
+
+
+async def _tokens():
+    yield "data: 1\n\n"
+
+
+def test_ticket_is_released_when_response_start_fails():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1)
+        ticket = await controller.enter("s1")
+        response = ResponseConfig.create_streaming_response(_tokens(), on_close=ticket.release)
+
+        async def receive():
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            # 客户端在响应头发出前断开
+            raise OSError("connection reset")
+
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        assert controller.stats()["active"] == 0
+        assert controller._sessions == {}
+
+    asyncio.run(scenario())
+
+
+def test_fair_limiter_hands_off_in_fifo_order():
+    async def scenario():
+        limiter = FairLimiter(max_concurrency=1, max_queue=10)
+        await limiter.acquire()
+        order: list[int] = []
+
+        async def worker(number: int) -> None:
+            await limiter.acquire()
+            order.append(number)
+            await asyncio.sleep(0)
+            limiter.release()
+
+        tasks = []
+        for number in range(5):
+            tasks.append(asyncio.create_task(worker(number)))
+            # 保证按编号依次进入队列
+            await asyncio.sleep(0)
+        assert limiter.queued == 5
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == [0, 1, 2, 3, 4]
+        assert limiter.idle
+
+    asyncio.run(scenario())
+
+
+def test_fair_limiter_timeout_racing_with_handoff_passes_slot_on():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        limiter = FairLimiter(max_concurrency=1, max_queue=10)
+        await limiter.acquire()
+        racing = asyncio.create_task(limiter.acquire(timeout=0.05))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # 释放和超时在同一轮事件循环中到期：名额先交给 racing，随后它的超时触发
+        loop.call_later(0.01, limiter.release)
+        time.sleep(0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await racing
+        # racing 放弃的名额必须转交给 follower，而不是丢失
+        await asyncio.wait_for(follower, 1)
+        assert limiter.active == 1 and limiter.queued == 0
+        limiter.release()
+        assert limiter.idle
+
+    asyncio.run(scenario())
+
+
+def test_fair_limiter_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = FairLimiter(max_concurrency=1, max_queue=10)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.queued == 0
+        limiter.release()
+        assert limiter.idle
+
+    asyncio.run(scenario())
+
+
+def test_session_queue_full_is_rejected_with_429_and_retry_after():
+    async def scenario():
+        controller = AdmissionController(session_max_pending=1, retry_after=2)
+        running = await controller.enter("s1")
+        queued = asyncio.create_task(controller.enter("s1"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.enter("s1")
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers["Retry-After"] == "2"
+        running.release()
+        (await queued).release()
+        assert controller._sessions == {}
+
+    asyncio.run(scenario())
+
+
+def test_global_queue_full_is_rejected_with_503_and_retry_after():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=0, retry_after=3)
+        running = await controller.enter("s1")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.enter("s2")
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers["Retry-After"] == "3"
+        # 被拒绝的会话不会留在会话表中
+        assert set(controller._sessions) == {"s1"}
+        running.release()
+        assert controller._sessions == {}
+
+    asyncio.run(scenario())
+
+
+def test_sessions_are_dropped_after_release_timeout_and_cancel():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, queue_timeout=0.01, session_timeout=0.01)
+        tickets = [await controller.enter("s1")]
+        # 全局名额已满：s2 在全局队列中超时
+        with pytest.raises(AdmissionRejected):
+            await controller.enter("s2")
+        # s1 的第二个请求在会话队列中超时
+        with pytest.raises(AdmissionRejected):
+            await controller.enter("s1")
+        controller.queue_timeout = controller.session_timeout = 10
+        cancelled = asyncio.create_task(controller.enter("s3"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        for ticket in tickets:
+            ticket.release()
+            # 重复释放不会多释放名额
+            ticket.release()
+        assert controller._sessions == {}
+        assert controller.stats()["active"] == 0 and controller.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_resume_admits_again_after_drain():
+    async def scenario():
+        controller = AdmissionController(retry_after=1)
+        assert await controller.drain(timeout=0.1)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.enter("s1")
+        assert rejected.value.status_code == 503
+        controller.resume()
+        assert controller.stats()["draining"] is False
+        (await controller.enter("s1")).release()
+
+    asyncio.run(scenario())
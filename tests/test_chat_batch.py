@@ -0,0 +1,29 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_chat_batch.py 批量聊天无状态条目的错误处理测试
+"""
+import asyncio
+import json
+
+from app.model import ChatBatchItem
+from app.service.impl import OpenAiChatServiceImpl
+from app.service.impl import openai_chat_service_impl
+
+
+def test_stateless_items_report_errors_when_model_creation_fails(monkeypatch):
+    def broken_model_factory():
+        raise RuntimeError("模型配置错误")
+
+    monkeypatch.setattr(openai_chat_service_impl, "create_model_from_config", broken_model_factory)
+    service = OpenAiChatServiceImpl(graph=None)
+    items = [ChatBatchItem(message="你好", tools=False), ChatBatchItem(message="再见", tools=False)]
+
+    async def collect() -> list[dict]:
+        lines = [line async for line in service.batch_streamer(items, concurrency=2)]
+        return [json.loads(line) for line in lines]
+
+    results = asyncio.run(asyncio.wait_for(collect(), timeout=5))
+    assert sorted(result["index"] for result in results) == [0, 1]
+    assert all(not result["ok"] and result["error"]["type"] == "RuntimeError" for result in results)
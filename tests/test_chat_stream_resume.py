@@ -0,0 +1,34 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_chat_stream_resume.py 流式接口重连（Last-Event-ID）的测试
+"""
+import asyncio
+
+from app.cache.stream_runs import StreamRunStore, STREAM_RESUMES
+from app.common.admission import AdmissionController
+from app.common.sse import SseStreamConfig
+from app.service.impl import OpenAiChatServiceImpl
+
+
+class _NoRunAdmission(AdmissionController):
+    async def enter(self, session_id: str):
+        raise AssertionError("带 Last-Event-ID 的请求不应开始新的运行")
+
+
+def _service(stream_runs=None) -> OpenAiChatServiceImpl:
+    return OpenAiChatServiceImpl(graph=None, admission=_NoRunAdmission(), stream_runs=stream_runs)
+
+
+def test_last_event_id_without_resumable_run_returns_204():
+    store = StreamRunStore(stream_config=SseStreamConfig())
+    before = STREAM_RESUMES.value(result="missing")
+    response = asyncio.run(_service(store).chat_stream("上一轮的问题", "s1", last_event_id="12"))
+    assert response.status_code == 204
+    assert STREAM_RESUMES.value(result="missing") == before + 1
+
+
+def test_last_event_id_with_resume_disabled_returns_204():
+    response = asyncio.run(_service().chat_stream("上一轮的问题", "s1", last_event_id="12"))
+    assert response.status_code == 204
@@ -0,0 +1,122 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_checkpoint_backends.py 检查点异步写回与内存快照的测试
+"""
+import asyncio
+import gc
+import warnings
+from typing import Any, Sequence
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from app.checkpoint.backends import SnapshotMemorySaver, WriteBehindSaver
+
+
+class _SlowSaver(InMemorySaver):
+    """按给定延迟执行 aput_writes，并记录写入完成的顺序"""
+
+    def __init__(self, delays: dict[str, float]):
+        super().__init__()
+        self.delays = delays
+        self.completed: list[tuple[str, str]] = []
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.sleep(self.delays.get(task_id, 0))
+        self.completed.append((config["configurable"]["thread_id"], task_id))
+        await super().aput_writes(config, writes, task_id, task_path)
+
+
+def _config(thread_id: str) -> RunnableConfig:
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": "", "checkpoint_id": "1"}}
+
+
+def test_write_behind_keeps_per_thread_order_without_blocking_other_threads():
+    async def scenario():
+        # 同一会话中先提交的写入更慢，仍然必须先完成；其他会话的写入不受影响
+        inner = _SlowSaver({"a1": 0.05, "a2": 0.02, "a3": 0.0, "b1": 0.0})
+        saver = WriteBehindSaver(inner)
+        for task_id in ("a1", "a2", "a3"):
+            await saver.aput_writes(_config("a"), [("messages", task_id)], task_id)
+        await saver.aput_writes(_config("b"), [("messages", "b1")], "b1")
+        assert inner.completed == []
+        await saver.barrier("b")
+        assert inner.completed == [("b", "b1")]
+        await saver.barrier()
+        assert [task_id for thread_id, task_id in inner.completed if thread_id == "a"] == ["a1", "a2", "a3"]
+        assert saver.stats()["pending"] == 0 and saver.stats()["threads_pending"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_write_behind_reads_wait_for_queued_writes():
+    async def scenario():
+        inner = _SlowSaver({"slow": 0.05})
+        saver = WriteBehindSaver(inner)
+        builder = StateGraph(MessagesState)
+        builder.add_node("reply", lambda state: {"messages": [AIMessage(content="你好")]})
+        builder.add_edge(START, "reply")
+        builder.add_edge("reply", END)
+        graph = builder.compile(checkpointer=saver)
+        config = {"configurable": {"thread_id": "t"}}
+        await graph.ainvoke({"messages": [HumanMessage(content="hi")]}, config)
+        await saver.aput_writes(_config("t"), [("messages", "x")], "slow")
+        # aget_tuple 先等待该会话积压的写入，因此能读到刚提交的写入
+        checkpoint = await saver.aget_tuple(config)
+        assert ("t", "slow") in inner.completed
+        assert checkpoint is not None
+        state = await graph.aget_state(config)
+        assert [message.content for message in state.values["messages"]] == ["hi", "你好"]
+
+    asyncio.run(scenario())
+
+
+def test_write_behind_cancelled_before_running_leaves_no_unawaited_coroutine():
+    async def scenario():
+        saver = WriteBehindSaver(_SlowSaver({}))
+        await saver.aput_writes(_config("t"), [("messages", "x")], "lost")
+        tasks = list(saver._tails.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        await asyncio.sleep(0)
+        assert saver.stats()["pending"] == 0 and saver.stats()["threads_pending"] == 0
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        asyncio.run(scenario())
+        gc.collect()
+    assert not [warning for warning in caught if "never awaited" in str(warning.message)]
+
+
+def test_snapshot_memory_saver_round_trip(tmp_path):
+    async def scenario():
+        path = tmp_path / "checkpoints.pkl"
+        saver = SnapshotMemorySaver(str(path), interval=3600)
+        await saver.start()
+        builder = StateGraph(MessagesState)
+        builder.add_node("reply", lambda state: {"messages": [AIMessage(content="第一轮回答")]})
+        builder.add_edge(START, "reply")
+        builder.add_edge("reply", END)
+        config = {"configurable": {"thread_id": "t"}}
+        await builder.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content="问题")]}, config)
+        assert saver.stats()["unsaved_writes"] > 0
+        await saver.stop()
+        assert path.exists() and saver.stats()["unsaved_writes"] == 0
+
+        restored = SnapshotMemorySaver(str(path), interval=3600)
+        await restored.start()
+        try:
+            state = await builder.compile(checkpointer=restored).aget_state(config)
+            assert [message.content for message in state.values["messages"]] == ["问题", "第一轮回答"]
+            assert len([item async for item in restored.alist(config)]) == \
+                len([item async for item in saver.alist(config)])
+        finally:
+            await restored.stop()
+
+    asyncio.run(scenario())
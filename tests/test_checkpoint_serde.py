@@ -0,0 +1,78 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_checkpoint_serde.py 检查点压缩序列化的格式兼容测试
+"""
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from app.checkpoint import serde
+from app.checkpoint.serde import CheckpointCompressionConfig, CompressedSerializer
+
+_LARGE = {"messages": [HumanMessage(content="查询用户列表", id="h"), AIMessage(content="用户年龄分布" * 500, id="a")]}
+_SMALL = {"step": 1, "note": "短"}
+
+
+def _codecs() -> list[str]:
+    return ["zlib", "zstd"] if serde.zstd_available() else ["zlib"]
+
+
+@pytest.mark.parametrize("codec", _codecs())
+def test_large_blobs_are_compressed_with_a_version_header(codec):
+    compressed = CompressedSerializer(codec=codec, threshold=1024)
+    type_, data = compressed.dumps_typed(_LARGE)
+    plain_type, plain = JsonPlusSerializer().dumps_typed(_LARGE)
+    assert type_ == f"{plain_type}+{codec}"
+    version, size = serde._HEADER.unpack_from(data)
+    assert version == serde._FORMAT_VERSION and size == len(plain)
+    assert len(data) < len(plain)
+    assert compressed.loads_typed((type_, data)) == _LARGE
+
+
+def test_blobs_below_threshold_are_stored_uncompressed():
+    type_, data = CompressedSerializer(codec="zlib", threshold=1024).dumps_typed(_SMALL)
+    # 与未压缩的序列化结果完全一致，没有类型后缀和版本头
+    assert (type_, data) == JsonPlusSerializer().dumps_typed(_SMALL)
+
+
+def test_rows_written_before_compression_still_load():
+    old_row = JsonPlusSerializer().dumps_typed(_LARGE)
+    assert "+" not in old_row[0]
+    assert CompressedSerializer(codec="zlib", threshold=1024).loads_typed(old_row) == _LARGE
+
+
+def test_compressed_rows_load_after_compression_is_turned_off():
+    row = CompressedSerializer(codec="zlib", threshold=1024).dumps_typed(_LARGE)
+    disabled = CompressedSerializer(codec="zlib", threshold=None)
+    assert disabled.loads_typed(row) == _LARGE
+    # 关闭后新写入的数据不再压缩
+    assert "+" not in disabled.dumps_typed(_LARGE)[0]
+
+
+def test_unknown_format_version_is_rejected():
+    type_, data = CompressedSerializer(codec="zlib", threshold=1024).dumps_typed(_LARGE)
+    tampered = serde._HEADER.pack(serde._FORMAT_VERSION + 1, 0) + data[serde._HEADER.size:]
+    with pytest.raises(ValueError):
+        CompressedSerializer(codec="zlib", threshold=1024).loads_typed((type_, tampered))
+
+
+def test_falls_back_to_zlib_without_zstd(monkeypatch):
+    zstd_row = None
+    if serde.zstd_available():
+        zstd_row = CompressedSerializer(codec="zstd", threshold=1024).dumps_typed(_LARGE)
+    monkeypatch.setattr(serde, "_zstd", None)
+    monkeypatch.setattr(serde, "_CODECS", {"zlib": serde._CODECS["zlib"]})
+    assert CheckpointCompressionConfig(codec="auto").resolve_codec() == "zlib"
+    assert CheckpointCompressionConfig(codec="zstd").resolve_codec() == "zlib"
+
+    monkeypatch.setenv("CHECKPOINT_COMPRESSION", "auto")
+    monkeypatch.setenv("CHECKPOINT_COMPRESSION_THRESHOLD", "1024")
+    fallback = serde.create_checkpoint_serde_from_config()
+    type_, data = fallback.dumps_typed(_LARGE)
+    assert type_.endswith("+zlib") and fallback.loads_typed((type_, data)) == _LARGE
+    if zstd_row is not None:
+        # 没有 zstd 的进程读取 zstd 数据时给出明确的错误
+        with pytest.raises(RuntimeError):
+            fallback.loads_typed(zstd_row)
@@ -0,0 +1,83 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_context.py 上下文窗口轮次切分与折叠选择的测试
+"""
+import asyncio
+from typing import Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from app.agent.context import ContextWindowManager, split_turns
+
+
+def _turn(index: int, text: str = "") -> list[BaseMessage]:
+    call_id = f"call_{index}"
+    return [
+        HumanMessage(content=f"问题{index}{text}", id=f"h{index}"),
+        AIMessage(content="", tool_calls=[{"name": "get_all_users", "args": {}, "id": call_id}], id=f"c{index}"),
+        ToolMessage(content=f"结果{index}", tool_call_id=call_id, name="get_all_users", id=f"t{index}"),
+        AIMessage(content=f"回答{index}", id=f"a{index}"),
+    ]
+
+
+def _history(turns: int, text: str = "") -> list[BaseMessage]:
+    return [SystemMessage(content="系统提示", id="s")] + [m for i in range(turns) for m in _turn(i, text)]
+
+
+async def _no_summary(summary: Optional[str], messages: list[BaseMessage]) -> str:
+    return "摘要"
+
+
+def test_split_turns_keeps_tool_calls_with_their_results():
+    prefix, turns = split_turns(_history(3))
+    assert [message.id for message in prefix] == ["s"]
+    assert [[message.id for message in turn] for turn in turns] == \
+        [[f"h{i}", f"c{i}", f"t{i}", f"a{i}"] for i in range(3)]
+
+
+def test_split_turns_attaches_system_messages_to_the_next_turn():
+    messages = _history(1) + [SystemMessage(content="提醒", id="r"), *_turn(1)]
+    _, turns = split_turns(messages)
+    assert [message.id for message in turns[1]][:2] == ["r", "h1"]
+
+
+def test_no_fold_below_thresholds():
+    manager = ContextWindowManager(token_budget=100000, max_turns=10, summary_threshold=100000)
+    assert manager.select_folded_turns(_history(10)) == []
+
+
+def test_fold_by_turns_goes_down_to_low_watermark():
+    manager = ContextWindowManager(token_budget=100000, max_turns=10, summary_threshold=100000)
+    folded = manager.select_folded_turns(_history(11))
+    # 保留 max_turns // 2 轮，折叠的每一轮都包含完整的工具调用与结果
+    assert [message.id for message in folded] == [f"{kind}{i}" for i in range(6) for kind in "hcta"]
+
+
+def test_fold_by_tokens_respects_budget_and_keeps_latest_turn():
+    history = _history(4, text="很长的内容" * 200)
+    manager = ContextWindowManager(token_budget=10, max_turns=10, summary_threshold=100)
+    folded = manager.select_folded_turns(history)
+    assert {message.id for message in folded} == {f"{kind}{i}" for i in range(3) for kind in "hcta"}
+
+
+def test_steady_state_does_not_fold_every_turn():
+    manager = ContextWindowManager(token_budget=100000, max_turns=10, summary_threshold=100000,
+                                   summarizer=_no_summary)
+
+    async def scenario() -> int:
+        messages: list[BaseMessage] = [SystemMessage(content="系统提示", id="s")]
+        compactions = 0
+        for index in range(40):
+            messages.extend(_turn(index))
+            update = await manager.compact(messages, None)
+            if update is not None:
+                removed = {message.id for message in update["messages"]}
+                messages = [message for message in messages if message.id not in removed]
+                compactions += 1
+            assert len(split_turns(messages)[1]) <= manager.max_turns
+        return compactions
+
+    # 第11轮首次折叠到5轮，此后每6轮才折叠一次（第11、17、23、29、35轮），而不是40轮中折叠30次
+    assert asyncio.run(scenario()) == 5
@@ -0,0 +1,112 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_http_client.py 模型服务HTTP客户端重试行为的测试
+"""
+import asyncio
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from app.common import http_client
+from app.common.http_client import LLM_HTTP_RETRIES, LlmHttpConfig, RetryTransport
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """记录重试前的等待时间，不真正等待"""
+    delays: list[float] = []
+
+    async def fake_sleep(delay: float) -> None:
+        delays.append(delay)
+
+    monkeypatch.setattr(http_client.asyncio, "sleep", fake_sleep)
+    # 退避取上限，便于断言
+    monkeypatch.setattr(http_client.random, "uniform", lambda low, high: high)
+    return delays
+
+
+def _send(responses: list, config: LlmHttpConfig = LlmHttpConfig(backoff_base=0.5, backoff_max=20.0)) -> tuple:
+    """
+    依次返回 responses 中的响应（或抛出其中的异常），返回 (最终响应或异常, 请求次数)
+    """
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        result = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def scenario():
+        transport = RetryTransport(httpx.MockTransport(handler), config)
+        async with httpx.AsyncClient(transport=transport, base_url="http://llm") as client:
+            try:
+                return await client.post("/v1/chat/completions", json={"model": "m"})
+            except httpx.HTTPError as e:
+                return e
+
+    return asyncio.run(scenario()), len(calls)
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retries_with_exponential_backoff_on_retryable_statuses(sleeps, status):
+    before = LLM_HTTP_RETRIES.value(reason=str(status))
+    response, calls = _send([httpx.Response(status), httpx.Response(status), httpx.Response(200)])
+    assert response.status_code == 200 and calls == 3
+    assert sleeps == [0.5, 1.0]
+    assert LLM_HTTP_RETRIES.value(reason=str(status)) - before == 2
+
+
+def test_honours_retry_after_seconds(sleeps):
+    response, calls = _send([httpx.Response(429, headers={"Retry-After": "3"}), httpx.Response(200)])
+    assert response.status_code == 200 and calls == 2
+    assert sleeps == [3.0]
+
+
+def test_honours_retry_after_http_date(sleeps):
+    retry_at = formatdate(time.time() + 10, usegmt=True)
+    response, calls = _send([httpx.Response(503, headers={"Retry-After": retry_at}), httpx.Response(200)])
+    assert response.status_code == 200 and calls == 2
+    assert len(sleeps) == 1 and 8.0 <= sleeps[0] <= 10.0
+
+
+def test_retry_after_longer_than_backoff_max_returns_the_response(sleeps):
+    response, calls = _send([httpx.Response(429, headers={"Retry-After": "60"}), httpx.Response(200)])
+    assert response.status_code == 429 and calls == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_client_errors_are_not_retried(sleeps, status):
+    before = sum(value for _, value in LLM_HTTP_RETRIES.samples())
+    response, calls = _send([httpx.Response(status), httpx.Response(200)])
+    assert response.status_code == status and calls == 1
+    assert sleeps == [] and sum(value for _, value in LLM_HTTP_RETRIES.samples()) == before
+
+
+def test_gives_up_after_max_retries(sleeps):
+    before = LLM_HTTP_RETRIES.value(reason="503")
+    config = LlmHttpConfig(max_retries=2, backoff_base=0.5, backoff_max=20.0)
+    response, calls = _send([httpx.Response(503)], config)
+    assert response.status_code == 503 and calls == 3
+    assert sleeps == [0.5, 1.0]
+    assert LLM_HTTP_RETRIES.value(reason="503") - before == 2
+
+
+def test_connect_errors_are_retried_then_raised(sleeps):
+    before = LLM_HTTP_RETRIES.value(reason="connect_error")
+    config = LlmHttpConfig(max_retries=1, backoff_base=0.5, backoff_max=20.0)
+    error, calls = _send([httpx.ConnectError("refused")], config)
+    assert isinstance(error, httpx.ConnectError) and calls == 2
+    assert LLM_HTTP_RETRIES.value(reason="connect_error") - before == 1
+
+
+def test_read_errors_after_sending_are_not_retried(sleeps):
+    error, calls = _send([httpx.ReadTimeout("slow"), httpx.Response(200)])
+    assert isinstance(error, httpx.ReadTimeout) and calls == 1
+    assert sleeps == []
@@ -0,0 +1,88 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_log.py 非阻塞日志在后台线程格式化的测试
+"""
+import io
+import logging
+import sys
+import threading
+
+import pytest
+
+from app.common.log import PAYLOAD, DroppingQueueHandler, logging_stats, setup_logging, shutdown_logging, summarize
+from app.common.metrics import render_metrics
+
+
+@pytest.fixture
+def queue_handler(log_stream) -> DroppingQueueHandler:
+    # 直接使用队列处理器：pytest 的日志捕获处理器也挂在根记录器上，并在调用线程上格式化
+    return next(handler for handler in logging.getLogger().handlers if isinstance(handler, DroppingQueueHandler))
+
+
+def _record(msg: str, *args, exc_info=None) -> logging.LogRecord:
+    return logging.LogRecord("tests", logging.INFO, __file__, 0, msg, args, exc_info)
+
+
+@pytest.fixture
+def log_stream():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    stream = io.StringIO()
+    setup_logging(stream=stream)
+    try:
+        yield stream
+    finally:
+        shutdown_logging()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+
+class _ThreadRecordingValue:
+    def __init__(self):
+        self.formatted_on: list[str] = []
+
+    def __repr__(self) -> str:
+        self.formatted_on.append(threading.current_thread().name)
+        return "value"
+
+
+def test_messages_and_summaries_are_formatted_off_the_calling_thread(queue_handler, log_stream):
+    value = _ThreadRecordingValue()
+    queue_handler.handle(_record("状态: %s", summarize(value)))
+    shutdown_logging()
+    threads = list(value.formatted_on)
+    assert "状态: value" in log_stream.getvalue()
+    assert threads and threading.current_thread().name not in threads
+
+
+def test_exception_traceback_is_rendered(queue_handler, log_stream):
+    try:
+        raise ValueError("坏的输入")
+    except ValueError:
+        queue_handler.handle(_record("处理失败", exc_info=sys.exc_info()))
+    shutdown_logging()
+    output = log_stream.getvalue()
+    assert "处理失败" in output
+    assert "ValueError: 坏的输入" in output and "Traceback" in output
+
+
+def test_dropped_and_sampled_records_are_exported(log_stream):
+    setup_logging(stream=log_stream, queue_size=2, payload_sample_rate=0.0)
+    handler = next(handler for handler in logging.getLogger().handlers if isinstance(handler, DroppingQueueHandler))
+    # 停止后台线程，让队列保持已满
+    shutdown_logging()
+    for index in range(5):
+        handler.handle(_record("记录 %d", index))
+    payload = _record("载荷")
+    payload.payload = PAYLOAD["payload"]
+    handler.handle(payload)
+    assert logging_stats() == {"queued": 2, "queue_size": 2, "dropped": 3, "sampled_out": 1}
+    metrics = render_metrics()
+    assert 'log_records_dropped_total{reason="queue_full"} 3' in metrics
+    assert 'log_records_dropped_total{reason="sampled"} 1' in metrics
+    assert "log_queue_depth 2" in metrics
@@ -0,0 +1,79 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_model_router.py 模型路由同步调用的故障转移与熔断测试
+"""
+from typing import Any, Optional
+
+import httpx
+import openai
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.common.model_router import CircuitState, ModelBackendConfig, ModelRouter, ModelRouterConfig
+
+
+class _FakeBackendModel(BaseChatModel):
+    reply: str = "ok"
+    fail: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-backend"
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        if self.fail:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://backend/v1/chat/completions"))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+
+def _router(models: dict[str, _FakeBackendModel], failure_threshold: int = 3) -> ModelRouter:
+    # 权重递减，空闲时总是先选择第一个后端
+    backends = tuple(ModelBackendConfig(name=name, base_url=f"http://{name}", model="m", weight=len(models) - i)
+                     for i, name in enumerate(models))
+    config = ModelRouterConfig(backends=backends, failure_threshold=failure_threshold)
+    return ModelRouter.from_config(config, lambda backend: models[backend.name])
+
+
+def test_sync_invoke_fails_over_to_next_backend():
+    primary, secondary = _FakeBackendModel(fail=True), _FakeBackendModel(reply="来自备用后端")
+    router = _router({"primary": primary, "secondary": secondary})
+    assert router.invoke("你好").content == "来自备用后端"
+    assert (primary.calls, secondary.calls) == (1, 1)
+    assert all(backend.outstanding == 0 for backend in router.backends)
+
+
+def test_sync_failures_open_the_circuit():
+    primary, secondary = _FakeBackendModel(fail=True), _FakeBackendModel()
+    router = _router({"primary": primary, "secondary": secondary}, failure_threshold=2)
+    router.batch(["1", "2", "3"], config={"max_concurrency": 1})
+    assert router.backends[0].state == CircuitState.OPEN
+    # 熔断后不再尝试故障后端
+    assert primary.calls == 2
+    assert secondary.calls == 3
+
+
+def test_router_backends_use_a_client_without_retries(monkeypatch):
+    from app.common.model_router import set_active_router
+    from app.config import create_model_from_config, create_router_http_client_from_config
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("MODEL_BACKENDS", '[{"name": "a", "base_url": "http://a/v1", "model": "m"}, '
+                                         '{"name": "b", "base_url": "http://b/v1", "model": "m"}]')
+    monkeypatch.setenv("LLM_HTTP_MAX_RETRIES", "3")
+    create_model_from_config.cache_clear()
+    create_router_http_client_from_config.cache_clear()
+    try:
+        router = create_model_from_config()
+        for backend in router.backends:
+            assert backend.model.http_async_client is create_router_http_client_from_config()
+        assert create_router_http_client_from_config()._transport._config.max_retries == 0
+    finally:
+        create_model_from_config.cache_clear()
+        create_router_http_client_from_config.cache_clear()
+        set_active_router(None)
@@ -0,0 +1,63 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_snapshot_cache.py 状态快照缓存的键与失效测试
+"""
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, START, StateGraph
+
+from app.cache.semantic_cache import CacheHit
+from app.cache.snapshot_cache import SnapshotCache, SnapshotEntry
+from app.common.constants import LLM_NODE
+from app.model.state import MyState
+from app.service.impl import OpenAiChatServiceImpl
+
+
+def _entry(checkpoint_id: str) -> SnapshotEntry:
+    return SnapshotEntry(checkpoint_id=checkpoint_id, body=b"{}", header={}, messages=[], message_ids=())
+
+
+def test_entries_are_scoped_to_their_thread():
+    cache = SnapshotCache(max_entries=4)
+    cache.put("t1", _entry("c1"))
+    assert cache.get("t1", "c1") is not None
+    # 其他会话即使知道检查点ID也读不到该条目
+    assert cache.get("t2", "c1") is None
+
+
+def test_invalidate_drops_only_that_thread():
+    cache = SnapshotCache(max_entries=4)
+    cache.put("t1", _entry("c1"))
+    cache.put("t1", _entry("c2"))
+    cache.put("t2", _entry("c3"))
+    cache.invalidate("t1")
+    assert cache.get("t1", "c1") is None and cache.get("t1", "c2") is None
+    assert cache.get("t2", "c3") is not None
+
+
+def test_service_invalidates_the_thread_after_writing_state():
+    builder = StateGraph(MyState)
+    builder.add_node(LLM_NODE, lambda state: {"messages": [AIMessage(content="回答")]})
+    builder.add_edge(START, LLM_NODE)
+    builder.add_edge(LLM_NODE, END)
+    service = OpenAiChatServiceImpl(graph=builder.compile(checkpointer=InMemorySaver()),
+                                    snapshot_cache=SnapshotCache(max_entries=4))
+
+    async def scenario():
+        await service._graph.ainvoke({"messages": [("user", "问题")], "thread_id": "t"},
+                                     {"configurable": {"thread_id": "t"}})
+        response = await service.get_current_state("t")
+        before, checkpoint_id = json.loads(response.body), response.headers["ETag"].strip('"')
+        assert service._snapshot_cache.get("t", checkpoint_id) is not None
+        await service._record_cached_turn({"configurable": {"thread_id": "t"}}, "再问",
+                                          CacheHit(question="再问", answer="缓存回答", score=0.99))
+        assert service._snapshot_cache.get("t", checkpoint_id) is None
+        after = json.loads((await service.get_current_state("t")).body)
+        assert len(after["values"]["messages"]) == len(before["values"]["messages"]) + 2
+
+    asyncio.run(scenario())
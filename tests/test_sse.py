@@ -0,0 +1,150 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_sse.py SSE编码、token合并、心跳与断开检测的测试
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+
+from app.common.sse import (
+    EVENT_DONE, EVENT_TOKEN, EVENT_TOOL_CALL, HEARTBEAT, SseEncoder, SseEvent, SseStreamConfig
+)
+
+
+def _parse(chunks: list[str]) -> list[dict]:
+    """把输出的SSE帧解析为 {"id", "event", "data"}，心跳解析为 {"event": "heartbeat"}"""
+    events = []
+    for frame in "".join(chunks).split("\n\n"):
+        if not frame:
+            continue
+        if frame + "\n\n" == HEARTBEAT:
+            events.append({"event": "heartbeat"})
+            continue
+        fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append({"id": int(fields["id"]), "event": fields["event"], "data": json.loads(fields["data"])})
+    return events
+
+
+async def _source(items: list[tuple[float, SseEvent]]) -> AsyncIterator[SseEvent]:
+    for delay, item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+def _token(text: str, delay: float = 0.0) -> tuple[float, SseEvent]:
+    return delay, SseEvent(event=EVENT_TOKEN, data=text)
+
+
+def _run(items: list[tuple[float, SseEvent]], config: SseStreamConfig, start_id: int = 0) -> list[dict]:
+    async def scenario() -> list[str]:
+        encoder = SseEncoder(config, start_id=start_id)
+        return [chunk async for chunk in encoder.stream(_source(items))]
+
+    return _parse(asyncio.run(scenario()))
+
+
+def test_tokens_arriving_together_are_coalesced_into_one_event():
+    config = SseStreamConfig(max_latency=0.2, max_bytes=1024, heartbeat_interval=0)
+    events = _run([_token("你"), _token("好"), _token("！"), (0, SseEvent(EVENT_DONE, {}))], config)
+    assert [(event["event"], event["data"]) for event in events] == \
+        [(EVENT_TOKEN, {"content": "你好！"}), (EVENT_DONE, {})]
+
+
+def test_tokens_are_flushed_when_max_latency_expires():
+    config = SseStreamConfig(max_latency=0.02, max_bytes=1024, heartbeat_interval=0)
+    events = _run([_token("a"), _token("b"), _token("c", delay=0.1), _token("d")], config)
+    assert [event["data"]["content"] for event in events] == ["ab", "cd"]
+
+
+def test_tokens_are_flushed_when_max_bytes_is_reached():
+    config = SseStreamConfig(max_latency=10, max_bytes=4, heartbeat_interval=0)
+    events = _run([_token("ab"), _token("cd"), _token("ef")], config)
+    # 达到4字节时立即发送，剩余部分在结束时发送
+    assert [event["data"]["content"] for event in events] == ["abcd", "ef"]
+
+
+def test_other_events_flush_pending_tokens_first_and_ids_increment():
+    config = SseStreamConfig(max_latency=10, max_bytes=1024, heartbeat_interval=0)
+    items = [_token("查询"), (0, SseEvent(EVENT_TOOL_CALL, {"name": "get_all_users"})), _token("完成"),
+             (0, SseEvent(EVENT_DONE, {}))]
+    events = _run(items, config, start_id=5)
+    assert [event["event"] for event in events] == [EVENT_TOKEN, EVENT_TOOL_CALL, EVENT_TOKEN, EVENT_DONE]
+    assert [event["id"] for event in events] == [6, 7, 8, 9]
+
+
+def test_heartbeats_are_sent_while_idle():
+    config = SseStreamConfig(max_latency=0.01, max_bytes=1024, heartbeat_interval=0.03)
+    events = _run([_token("a"), _token("b", delay=0.2)], config)
+    assert events[0]["data"] == {"content": "a"}
+    assert events[-1]["data"] == {"content": "b"}
+    heartbeats = [event for event in events if event["event"] == "heartbeat"]
+    assert 2 <= len(heartbeats) <= 7
+    # 心跳不占用事件ID
+    assert [event["id"] for event in events if "id" in event] == [1, 2]
+
+
+def test_on_event_receives_every_encoded_event_except_heartbeats():
+    saved: list[tuple[int, str]] = []
+
+    async def scenario() -> list[str]:
+        encoder = SseEncoder(SseStreamConfig(max_latency=0.01, heartbeat_interval=0.02),
+                             on_event=lambda event_id, frame: saved.append((event_id, frame)))
+        return [chunk async for chunk in encoder.stream(_source([_token("a"), _token("b", delay=0.1)]))]
+
+    chunks = asyncio.run(scenario())
+    assert [event_id for event_id, _ in saved] == [1, 2]
+    assert "".join(chunks).replace(HEARTBEAT, "") == "".join(frame for _, frame in saved)
+
+
+def test_producer_is_cancelled_when_the_client_disconnects():
+    async def scenario():
+        cancelled = asyncio.Event()
+        disconnected = False
+
+        async def endless() -> AsyncIterator[SseEvent]:
+            try:
+                while True:
+                    yield SseEvent(event=EVENT_TOKEN, data="x")
+                    await asyncio.sleep(0.005)
+            finally:
+                cancelled.set()
+
+        async def is_disconnected() -> bool:
+            return disconnected
+
+        encoder = SseEncoder(SseStreamConfig(max_latency=0.01, heartbeat_interval=0,
+                                             disconnect_poll_interval=0.02))
+        chunks: list[str] = []
+        async for chunk in encoder.stream(endless(), is_disconnected):
+            chunks.append(chunk)
+            if len(chunks) == 2:
+                disconnected = True
+        assert encoder.disconnected
+        assert cancelled.is_set()
+        return chunks
+
+    chunks = asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+    assert len(chunks) >= 2
+
+
+def test_closing_the_output_cancels_the_producer():
+    async def scenario() -> Optional[bool]:
+        cancelled = asyncio.Event()
+
+        async def endless() -> AsyncIterator[SseEvent]:
+            try:
+                while True:
+                    yield SseEvent(event=EVENT_TOKEN, data="x")
+                    await asyncio.sleep(0.005)
+            finally:
+                cancelled.set()
+
+        stream = SseEncoder(SseStreamConfig(max_latency=0.01, heartbeat_interval=0)).stream(endless())
+        await anext(stream)
+        await stream.aclose()
+        return cancelled.is_set()
+
+    assert asyncio.run(asyncio.wait_for(scenario(), timeout=5))
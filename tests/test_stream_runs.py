@@ -0,0 +1,149 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_stream_runs.py 流式运行溢出写入Postgres的测试
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from app.cache.stream_runs import StreamRunStore
+from app.common.sse import SseStreamConfig
+
+
+class _SlowCursor:
+    def __init__(self, pool: "_FakePool"):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def executemany(self, sql: str, rows: list) -> None:
+        self.pool.started.set()
+        await self.pool.release.wait()
+        self.pool.written.extend(rows)
+
+
+class _FakeConnection:
+    def __init__(self, pool: "_FakePool"):
+        self.pool = pool
+
+    def cursor(self) -> _SlowCursor:
+        return _SlowCursor(self.pool)
+
+
+class _FakePool:
+    """executemany 等待 release 后才完成的连接池"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.written: list[tuple] = []
+
+    @asynccontextmanager
+    async def connection(self):
+        yield _FakeConnection(self)
+
+
+def _store(pool: _FakePool) -> StreamRunStore:
+    return StreamRunStore(pool=pool, stream_config=SseStreamConfig())
+
+
+def test_flush_spill_keeps_frames_appended_during_write():
+    async def scenario():
+        pool = _FakePool()
+        store = _store(pool)
+        store._spill("run", [(1, "a"), (2, "b")])
+        flush = asyncio.create_task(store._flush_spill())
+        await pool.started.wait()
+        # 写入进行中又有事件被移出内存
+        store._spill("run", [(3, "c")])
+        pool.release.set()
+        await flush
+        assert [row[1] for row in pool.written] == [1, 2]
+        assert store._pending_spill == {"run": [(3, "c")]}
+
+        pool.started.clear()
+        await store._flush_spill()
+        assert [row[1] for row in pool.written] == [1, 2, 3]
+        assert store._pending_spill == {}
+
+    asyncio.run(scenario())
+
+
+def test_flush_spill_keeps_new_runs_spilled_during_write():
+    async def scenario():
+        pool = _FakePool()
+        store = _store(pool)
+        store._spill("first", [(1, "a")])
+        flush = asyncio.create_task(store._flush_spill())
+        await pool.started.wait()
+        store._spill("second", [(1, "x")])
+        pool.release.set()
+        await flush
+        assert pool.written == [("first", 1, "a")]
+        assert store._pending_spill == {"second": [(1, "x")]}
+
+    asyncio.run(scenario())
+
+
+def _frame(event_id: int) -> str:
+    return f"id: {event_id}\ndata: {'x' * 60}\n\n"
+
+
+def test_memory_limit_evicts_finished_runs_and_releases_their_bytes():
+    async def scenario():
+        store = StreamRunStore(max_bytes=3000, stream_config=SseStreamConfig())
+        finished = store.create("s1")
+        for event_id in range(1, 20):
+            store.append(finished, event_id, _frame(event_id))
+        store.finish(finished)
+        live = store.create("s2")
+        for event_id in range(1, 21):
+            store.append(live, event_id, _frame(event_id))
+        # 已结束的运行被整体淘汰，其占用不再计入
+        assert store.get(finished.run_id) is None
+        assert store._bytes == live.bytes
+        assert len(live) == 20
+        assert store.stats()["bytes"] <= store.max_bytes
+
+    asyncio.run(scenario())
+
+
+def test_memory_limit_trims_the_largest_live_run():
+    async def scenario():
+        store = StreamRunStore(max_bytes=1000, stream_config=SseStreamConfig())
+        run = store.create("s1")
+        for event_id in range(1, 40):
+            store.append(run, event_id, f"data: {event_id}\n\n")
+        assert store._bytes == run.bytes <= store.max_bytes
+        assert run.last_id == 39 and run.first_id > 1
+        assert [frame for frame in run.frames_after(0)][-1] == "data: 39\n\n"
+
+    asyncio.run(scenario())
+
+
+def test_stop_cancels_runs_still_executing():
+    async def scenario():
+        store = _store(_FakePool())
+        run = store.create("s1")
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def execute():
+            started.set()
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        run.task = asyncio.create_task(execute())
+        await started.wait()
+        await store.stop()
+        assert cancelled.is_set() and run.task.done()
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_tool_registry.py 工具绑定注册表的缓存键测试
+"""
+from langchain_core.tools import StructuredTool
+
+from app.tools.tool_registry import ToolBindingRegistry
+
+
+class _FakeModel:
+    def __init__(self):
+        self.bind_count = 0
+
+    def bind_tools(self, tools):
+        self.bind_count += 1
+        return ("bound", tuple(tool.name for tool in tools))
+
+
+def _make_weather_tool(session: str) -> StructuredTool:
+    # 模拟MCP重连：结构相同，但工具对象（及其绑定的会话）不同
+    def get_weather(city: str) -> str:
+        """查询城市天气"""
+        return f"{session}:{city}"
+
+    return StructuredTool.from_function(get_weather)
+
+
+def test_tool_node_is_rebuilt_when_tool_objects_change():
+    model = _FakeModel()
+    registry = ToolBindingRegistry(lambda: model)
+    old_tools = [_make_weather_tool("old")]
+    new_tools = [_make_weather_tool("new")]
+
+    assert registry.fingerprint(old_tools) == registry.fingerprint(new_tools)
+    assert registry.get_tool_node(old_tools) is registry.get_tool_node(old_tools)
+    new_node = registry.get_tool_node(new_tools)
+    assert new_node is not registry.get_tool_node(old_tools)
+    assert new_node.tools_by_name["get_weather"] is new_tools[0]
+
+
+def test_bound_model_is_shared_across_equivalent_tool_objects():
+    model = _FakeModel()
+    registry = ToolBindingRegistry(lambda: model)
+    registry.get_bound_model([_make_weather_tool("old")])
+    registry.get_bound_model([_make_weather_tool("new")])
+    assert model.bind_count == 1
@@ -0,0 +1,24 @@
+"""
+@Author  : Yang-yang Miao
+@Email   : yangyangmiao666@icloud.com
+@Time    : 2025/11/18 00:31
+@Desc    : test_tracing.py 链路追踪启停的测试
+"""
+from app.common.tracing import Tracing, TracingConfig
+from app.config import create_langfuse_from_config
+
+
+def test_restart_creates_a_new_langfuse_client(monkeypatch):
+    monkeypatch.setenv("LANGFUSE_PUBLIC_KEY", "pk-lf-test")
+    monkeypatch.setenv("LANGFUSE_SECRET_KEY", "sk-lf-test")
+    monkeypatch.setenv("LANGFUSE_HOST", "http://127.0.0.1:9")
+    tracing = Tracing(TracingConfig())
+    tracing.start()
+    first = tracing._client
+    tracing.stop()
+    assert create_langfuse_from_config.cache_info().currsize == 0
+    tracing.start()
+    try:
+        assert tracing.active and tracing._client is not first
+    finally:
+        tracing.stop()